@@ -25,6 +25,7 @@ def read(*rnames):
 version = read("version.txt").strip()
 
 tests_require = [
+    'ZODB',
     'zope.configuration',
     'zope.site',
     'zope.testrunner',
@@ -74,9 +75,14 @@ setuptools.setup(
         "zope.lifecycleevent",
         "zope.intid >= 4.2",
         "zope.keyreference",
+        "transaction",
     ],
     extras_require={
         'test': tests_require,
+        'benchmarks': [
+            'pyperf',
+            'ZODB',
+        ],
         'docs': [
             'Sphinx',
             'repoze.sphinx.autointerface',
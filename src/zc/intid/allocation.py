@@ -0,0 +1,586 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Id allocation strategies.
+
+These are used as the ``allocator`` of a
+:class:`zc.intid.utility.IntIds` to change how
+:meth:`~zc.intid.interfaces.IIntIdsSubclass.generateId` chooses ids.
+
+The default strategy of :class:`~zc.intid.utility.IntIds` keeps its
+position in a volatile attribute, so it starts over at a random
+position whenever the utility is ghosted or the process restarts.
+Each of those starts is likely to create a new, sparsely filled,
+bucket in ``refs``, and concurrent writers that happen to be working
+in the same region conflict with each other.
+
+:class:`StripeAllocator` instead reserves a *stripe* of ids, about
+the size of a BTree bucket, for each ZODB connection in each process,
+and remembers that reservation persistently.
+
+:class:`BloomFilterAllocator` uses the default strategy, but keeps a
+per-process Bloom filter of the used ids so that most used
+candidates can be skipped without looking them up in ``refs``.
+
+:class:`FreeRangeAllocator` finds the free ranges of ids in a region
+of ``refs`` and allocates from them, so that finding an id usually
+takes one scan of a region, however full the id space is, until
+almost no ids are left.
+"""
+
+import math
+import os
+import socket
+import weakref
+
+import persistent
+from BTrees.OOBTree import OOBTree
+from zope.event import notify
+from zope.interface import implementer
+
+from zc.intid.interfaces import IdSpaceFillEvent
+from zc.intid.interfaces import IIdAllocator
+
+
+_process_key = None
+
+
+def setProcessKey(key):
+    """
+    Set the string that identifies this process to allocators.
+
+    By default this is the host name and process id. When a
+    :class:`StripeAllocator` reserves a stripe, it takes over the
+    reservations left by processes of the same host that are no
+    longer running, so a restarted process continues filling the
+    stripes of the process it replaces. Reservations made with
+    default keys on other hosts are only dropped when their stripes
+    are full.
+
+    Setting a key that stays the same across restarts (for example,
+    the name of a ZEO client) keeps each process on its own stripes
+    wherever it runs. Passing None restores the default.
+    """
+    global _process_key
+    _process_key = key
+
+
+def getProcessKey():
+    """
+    Return the key set with :func:`setProcessKey`, or the default.
+    """
+    if _process_key is not None:
+        return _process_key
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def _isDead(key):
+    # Was the slot key made with the default process key of a process
+    # of this host that is no longer running?
+    process = key.rpartition('/')[0]
+    host, sep, pid = process.rpartition(':')
+    if (os.name != 'posix' or not sep or not pid.isdigit()
+            or host != socket.gethostname() or int(pid) == os.getpid()):
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # It exists, but belongs to someone else.
+        pass
+    return False
+
+
+# jar -> small integer, so that each connection in the pool of this
+# process gets its own stripe.
+_slots = weakref.WeakKeyDictionary()
+
+
+def _slot(jar):
+    if jar is None:
+        return 0
+    try:
+        return _slots[jar]
+    except KeyError:
+        used = set(_slots.values())
+        slot = 0
+        while slot in used:
+            slot += 1
+        _slots[jar] = slot
+        return slot
+
+
+# database -> {oid: per-process state of an allocator}, such as
+# {slot key: next id} for a StripeAllocator. This is kept outside of
+# the allocator so that it survives the allocator being ghosted.
+_cursors = weakref.WeakKeyDictionary()
+
+
+def _processState(allocator, factory):
+    # Return the per-process state of *allocator*, creating it with
+    # *factory* if needed.
+    if allocator._p_jar is None:
+        try:
+            return allocator._v_state
+        except AttributeError:
+            allocator._v_state = factory()
+            return allocator._v_state
+    db = allocator._p_jar.db()
+    try:
+        states = _cursors[db]
+    except KeyError:
+        states = _cursors.setdefault(db, {})
+    try:
+        return states[allocator._p_oid]
+    except KeyError:
+        return states.setdefault(allocator._p_oid, factory())
+
+
+@implementer(IIdAllocator)
+class StripeAllocator(persistent.Persistent):
+    """
+    Allocate sequential ids from stripes reserved per connection.
+
+    A stripe is an aligned range of *stripe_size* ids (by default,
+    the maximum number of items in a bucket of ``refs``). The first
+    time a connection of a process allocates an id, a random unused
+    stripe is reserved for it and recorded in :attr:`stripes`. Ids
+    are then allocated sequentially from that stripe until it is
+    full, when another stripe is reserved.
+
+    Only reserving a stripe modifies the allocator, so that happens
+    about once per *stripe_size* allocations. Reserving a stripe also
+    drops the reservations of full stripes, and takes over one left
+    by a process that is no longer running (see
+    :func:`setProcessKey`). The position within the
+    stripe is cached in memory, and, if that is lost, recovered from
+    the largest id already used in the stripe. If every stripe is
+    reserved by another connection, :exc:`ValueError` is raised.
+    """
+
+    #: How many times to look for an entirely unused stripe before
+    #: settling for any stripe not reserved by another connection.
+    claim_attempts = 100
+
+    def __init__(self, stripe_size=None):
+        self.stripe_size = stripe_size
+        #: Mapping from slot key to the first id of its stripe.
+        self.stripes = OOBTree()
+
+    def _cursors(self):
+        return _processState(self, dict)
+
+    def _stripeSize(self, refs):
+        if self.stripe_size:
+            return self.stripe_size
+        return getattr(type(refs), 'max_leaf_size', 60)
+
+    def slotKey(self, intids):
+        """
+        Return the key of the stripe to use for *intids*.
+
+        This combines the process key (see :func:`setProcessKey`)
+        with a number identifying the connection that loaded
+        *intids*.
+        """
+        return '%s/%d' % (getProcessKey(), _slot(intids._p_jar))
+
+    def _resume(self, refs, start, end):
+        try:
+            last = refs.maxKey(end - 1)
+        except ValueError:
+            return start
+        return last + 1 if last >= start else start
+
+    def _isEmpty(self, refs, start, end):
+        try:
+            return refs.minKey(start) >= end
+        except ValueError:
+            return True
+
+    def _claim(self, intids, key, size):
+        # Drop the reservations of dead processes and of full stripes,
+        # taking over the first of the former that isn't full.
+        stripes = self.stripes
+        refs = intids.refs
+        claimed = set()
+        adopted = None
+        for other, start in list(stripes.items()):
+            if other == key:
+                continue
+            full = self._resume(refs, start, start + size) >= start + size
+            if full or _isDead(other):
+                del stripes[other]
+                if adopted is None and not full:
+                    adopted = start
+            else:
+                claimed.add(start)
+        if adopted is not None:
+            stripes[key] = adopted
+            return adopted
+
+        count = (intids.family.maxint + 1) // size
+        if len(claimed) >= count:
+            raise ValueError("All stripes are reserved")
+        attempts = 0
+        while True:
+            start = intids._randrange(0, count) * size
+            while start in claimed:
+                # Take the next stripe instead of drawing again, which
+                # could take long if most of them are reserved.
+                start = (start + size) % (count * size)
+            attempts += 1
+            if (attempts > self.claim_attempts
+                    or self._isEmpty(refs, start, start + size)):
+                stripes[key] = start
+                return start
+
+    def allocate(self, intids, ob):
+        refs = intids.refs
+        size = self._stripeSize(refs)
+        key = self.slotKey(intids)
+        cursors = self._cursors()
+        start = self.stripes.get(key)
+        uid = cursors.get(key)
+        while True:
+            if start is not None:
+                end = start + size
+                # A cursor at the end means the stripe is used up, even
+                # if the ids aren't in refs yet (as in registerMany).
+                if uid is None or not start <= uid <= end:
+                    uid = self._resume(refs, start, end)
+                while uid < end:
+                    if uid not in refs:
+                        cursors[key] = uid + 1
+                        return uid
+                    uid += 1
+            start = self._claim(intids, key, size)
+            # Continue after the ids already used in it, if any.
+            uid = None
+
+
+class _BloomFilter:
+    # A Bloom filter of integers, using double hashing.
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        size = int(math.ceil(-capacity * math.log(error_rate)
+                             / math.log(2) ** 2))
+        self.size = size
+        self.hashes = max(1, int(round(size / capacity * math.log(2))))
+        self.bits = bytearray((size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        h1 = (value * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        h2 = ((value ^ (value >> 17)) * 0xBF58476D1CE4E5B9
+              & 0xFFFFFFFFFFFFFFFF) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, value):
+        bits = self.bits
+        for pos in self._positions(value):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        bits = self.bits
+        for pos in self._positions(value):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class _FilterState:
+    # The per-process state of a BloomFilterAllocator.
+
+    def __init__(self):
+        self.filter = None
+        # connection slot -> next candidate. The filter is shared by
+        # all the connections of the process, but each allocates
+        # from its own position.
+        self.nextids = {}
+        self.stats = dict.fromkeys(
+            ('allocations', 'probes', 'filtered', 'lookups', 'rebuilds'), 0)
+
+
+@implementer(IIdAllocator)
+class BloomFilterAllocator(persistent.Persistent):
+    """
+    Allocate ids like the default strategy, skipping used ids with
+    the help of a Bloom filter.
+
+    Like the default strategy of :class:`~zc.intid.utility.IntIds`,
+    this allocates sequentially from a random position (one for each
+    connection) and picks a new random position when it finds a
+    used id. Before looking a
+    candidate up in ``refs``, which may have to load a bucket from
+    storage, it checks a Bloom filter of the used ids. A Bloom filter
+    has no false negatives, so candidates it contains are almost
+    always used, and are skipped without touching ``refs``.
+
+    The filter is built by each process the first time it is
+    needed, which reads all the ids in ``refs``, and is kept in
+    memory. Ids allocated by this process are added to it. It is not
+    told about ids registered by other processes or unregistered;
+    those are found when looking candidates up in ``refs``, or just
+    skipped, respectively. The filter is rebuilt when more ids have
+    been added than it was sized for.
+    """
+
+    #: The fraction of unused ids the filter wrongly contains.
+    error_rate = 0.01
+
+    #: The filter is sized for this many times the number of ids
+    #: registered when it is built (and at least *min_capacity*).
+    growth = 2
+    min_capacity = 1024
+
+    def __init__(self, error_rate=None):
+        if error_rate is not None:
+            self.error_rate = error_rate
+
+    def _state(self):
+        return _processState(self, _FilterState)
+
+    def _filter(self, intids, state):
+        bloom = state.filter
+        count = None
+        while bloom is None or bloom.count > bloom.capacity:
+            # Only counted here: without a length counter, len(intids)
+            # reads all of refs. If the count was wrong (ids were
+            # added to refs directly), we notice when building, and
+            # try again with the actual count.
+            if count is None:
+                count = len(intids)
+            capacity = max(count * self.growth, self.min_capacity)
+            bloom = _BloomFilter(capacity, self.error_rate)
+            for uid in intids.refs.keys():
+                bloom.add(uid)
+            count = bloom.count
+            state.filter = bloom
+            state.stats['rebuilds'] += 1
+        return bloom
+
+    def stats(self):
+        """
+        Return a dictionary of counters for this process.
+
+        ``allocations`` is the number of ids allocated, ``probes``
+        the number of candidates considered, ``filtered`` how many of
+        those the filter ruled out, ``lookups`` how many were looked
+        up in ``refs``, and ``rebuilds`` how often the filter was
+        built. The number of probes per allocation is
+        ``probes / allocations``.
+        """
+        return dict(self._state().stats)
+
+    def allocate(self, intids, ob):
+        state = self._state()
+        bloom = self._filter(intids, state)
+        stats = state.stats
+        refs = intids.refs
+        maxint = intids.family.maxint
+        nextids = state.nextids
+        slot = _slot(intids._p_jar)
+        stats['allocations'] += 1
+        while True:
+            uid = nextids.get(slot)
+            if uid is None or uid > maxint:
+                uid = intids._randrange(0, maxint)
+            nextids[slot] = uid + 1
+            stats['probes'] += 1
+            if uid in bloom:
+                stats['filtered'] += 1
+            else:
+                stats['lookups'] += 1
+                if uid not in refs:
+                    bloom.add(uid)
+                    return uid
+                # Used by another process; remember it.
+                bloom.add(uid)
+            nextids[slot] = None
+
+
+class _Ranges:
+    # The free ranges a connection allocates from.
+
+    def __init__(self):
+        # Free [start, end) ranges found by the last scan, highest
+        # first, and the range being allocated from.
+        self.ranges = []
+        self.next = self.end = None
+        # The last region with free ids
+        self.region = None
+
+
+class _RangeState:
+    # The per-process state of a FreeRangeAllocator.
+
+    def __init__(self):
+        # connection slot -> _Ranges, so that the connections of the
+        # process don't allocate the same ids.
+        self.slots = {}
+        self.level = 0
+        self.stats = dict.fromkeys(
+            ('allocations', 'lookups', 'scans', 'scanned'), 0)
+
+
+@implementer(IIdAllocator)
+class FreeRangeAllocator(persistent.Persistent):
+    """
+    Allocate ids sequentially from free ranges found in ``refs``.
+
+    The id space is divided into regions of *region_size* ids. To
+    find free ids, the keys of ``refs`` in a random region are read,
+    and the gaps between them are remembered in memory as free
+    ranges. Ranges of at least *min_range* ids (by default, the
+    maximum size of a bucket of ``refs``) are preferred, so that ids
+    allocated one after another end up in the same bucket; smaller
+    ones are only used when a region has no bigger ones.
+
+    Each connection allocates from its own ranges. Finding an id
+    therefore usually costs at most one scan of a region, plus one
+    lookup in ``refs`` for each id in the range that another
+    connection has used since the scan. After *scan_attempts* random
+    regions without free ids, the following regions are scanned in
+    order, so that a free id is found even if the id space is almost
+    full. That is not bounded: in the worst case, when only a few ids
+    are left, a single allocation reads all the keys of ``refs``. The
+    next scan starts after the region where free ids were found.
+
+    When the fraction of the id space that is used crosses one of the
+    *thresholds*, an :class:`~zc.intid.interfaces.IIdSpaceFillEvent`
+    is notified (once per process and threshold). For utilities
+    created before the number of ids was counted, this is only checked
+    before scanning, since counting reads all of ``refs``.
+    """
+
+    region_size = 2 ** 14
+    min_range = None
+    scan_attempts = 10
+
+    #: Fractions of the id space at which to notify an
+    #: IIdSpaceFillEvent.
+    thresholds = (0.5, 0.75, 0.9, 0.99)
+
+    def __init__(self, region_size=None, min_range=None, thresholds=None):
+        if region_size is not None:
+            self.region_size = region_size
+        if min_range is not None:
+            self.min_range = min_range
+        if thresholds is not None:
+            self.thresholds = tuple(thresholds)
+
+    def _state(self):
+        return _processState(self, _RangeState)
+
+    def stats(self):
+        """
+        Return a dictionary of counters for this process.
+
+        ``allocations`` is the number of ids allocated, ``lookups``
+        the number of candidates looked up in ``refs``, ``scans`` the
+        number of regions scanned and ``scanned`` the number of keys
+        read while scanning.
+        """
+        return dict(self._state().stats)
+
+    def _checkFill(self, intids, count, state):
+        fill = count / (intids.family.maxint + 1)
+        level = max([t for t in self.thresholds if t <= fill], default=0)
+        if level > state.level:
+            notify(IdSpaceFillEvent(intids, fill, level))
+        # If the fill goes down again, warn again next time it goes up
+        state.level = level
+
+    def _scan(self, intids, region, state):
+        # Return the free ranges of the region, highest first.
+        size = self.region_size
+        start = region * size
+        end = min(start + size, intids.family.maxint + 1)
+        min_range = self.min_range or getattr(type(intids.refs),
+                                              'max_leaf_size', 60)
+        big = []
+        small = []
+        free = start
+        scanned = 0
+        for uid in intids.refs.keys(start, end - 1):
+            scanned += 1
+            if uid > free:
+                (big if uid - free >= min_range else small).append(
+                    (free, uid))
+            free = uid + 1
+        if end > free:
+            (big if end - free >= min_range else small).append((free, end))
+        state.stats['scans'] += 1
+        state.stats['scanned'] += scanned
+        ranges = big or small
+        ranges.reverse()
+        return ranges
+
+    def _findRanges(self, intids, state, current):
+        count = (intids.family.maxint + self.region_size) // self.region_size
+        region = None
+        for _ in range(self.scan_attempts):
+            region = intids._randrange(0, count)
+            ranges = self._scan(intids, region, state)
+            if ranges:
+                current.region = region
+                return ranges
+        # Go through the rest of the regions in order, starting after
+        # the last one that had free ids (or the last one scanned, or
+        # a random one).
+        if current.region is not None:
+            region = current.region
+        elif region is None:
+            region = intids._randrange(0, count)
+        for i in range(1, count + 1):
+            next_region = (region + i) % count
+            ranges = self._scan(intids, next_region, state)
+            if ranges:
+                current.region = next_region
+                return ranges
+        raise ValueError("No free ids")
+
+    def allocate(self, intids, ob):
+        state = self._state()
+        stats = state.stats
+        # Without its length counter, len(intids) reads all of refs,
+        # so the fill is then only checked before scanning.
+        length = getattr(intids, '_length', None)
+        if length is not None:
+            self._checkFill(intids, length(), state)
+        refs = intids.refs
+        slot = _slot(intids._p_jar)
+        try:
+            current = state.slots[slot]
+        except KeyError:
+            current = state.slots[slot] = _Ranges()
+        stats['allocations'] += 1
+        while True:
+            if current.next is None or current.next >= current.end:
+                if not current.ranges:
+                    if length is None:
+                        self._checkFill(intids, len(intids), state)
+                    current.ranges = self._findRanges(intids, state,
+                                                      current)
+                current.next, current.end = current.ranges.pop()
+            uid = current.next
+            current.next += 1
+            stats['lookups'] += 1
+            if uid not in refs:
+                return uid
@@ -0,0 +1,12 @@
+"""
+Performance benchmarks.
+
+These modules are meant to be run as scripts; install the
+``benchmarks`` extra first. Most of them use :mod:`pyperf`, for
+example::
+
+    python -m zc.intid.benchmarks.bench_register -o register.json
+
+Use ``python -m pyperf compare_to`` to compare the JSON output of
+different runs.
+"""
@@ -0,0 +1,266 @@
+"""
+Benchmark the methods of the utility that are used the most.
+
+Each benchmark runs ``--ops`` operations per iteration against a
+utility already holding ``--size`` objects, for each combination of
+``--family``, ``--size`` and ``--storage``. The storages are ``none``
+(the utility isn't stored in a database), ``mapping`` (a
+``MappingStorage``, built again by each worker process) and ``file``
+(a ``FileStorage`` in ``--data-dir``, built once and reused by
+later runs). For example::
+
+    python -m zc.intid.benchmarks.bench_intids -o intids.json \\
+        --size 1000 --size 1000000 --storage file
+
+The subscribers are benchmarked as well, with ``--utilities``
+utilities registered (see :mod:`zc.intid.benchmarks.bench_subscribers`).
+
+Building a utility with 10**7 objects takes several minutes and, for
+the ``file`` storage, about a gigabyte of disk.
+"""
+
+import os
+import random
+import tempfile
+
+import BTrees
+import persistent
+import pyperf
+import transaction
+# Importing this installs the zope.component event dispatcher, so
+# the events generated by the utility are dispatched the way they
+# are in an application.
+import zope.component.event  # noqa: F401 imported but unused
+from ZODB.DB import DB
+
+from zc.intid.benchmarks import bench_subscribers
+from zc.intid.utility import IntIds
+
+
+FAMILIES = {
+    32: BTrees.family32,
+    64: BTrees.family64,
+}
+
+STORAGES = ('none', 'mapping', 'file')
+
+#: Objects registered per transaction while building a utility.
+CHUNK = 10000
+
+
+class Content(persistent.Persistent):
+    pass
+
+
+class Fixture:
+    """
+    A utility with *size* objects, and random samples of its objects
+    and ids.
+    """
+
+    def __init__(self, family, size, storage, data_dir, ops):
+        self.conn = None
+        if storage == 'none':
+            self.intids = IntIds('iid', family=FAMILIES[family])
+            self._populate(size)
+        else:
+            if storage == 'mapping':
+                db = DB(None)
+            else:
+                from ZODB.FileStorage import FileStorage
+                path = os.path.join(data_dir, 'intids-%d-%d.fs'
+                                    % (family, size))
+                db = DB(FileStorage(path))
+            self.conn = db.open()
+            root = self.conn.root()
+            if root.get('size') != size:
+                root['intids'] = IntIds('iid', family=FAMILIES[family])
+                transaction.commit()
+                self.intids = root['intids']
+                self._populate(size)
+                root['size'] = size
+                transaction.commit()
+            self.intids = root['intids']
+        rand = random.Random(size)
+        self.ids = rand.sample(list(self.intids.refs.keys()), min(ops, size))
+        self.objects = [self.intids.refs[uid] for uid in self.ids]
+        self.new = [Content() for _ in range(ops)]
+
+    def _populate(self, size):
+        for start in range(0, size, CHUNK):
+            self.intids.registerMany(
+                [Content() for _ in range(min(CHUNK, size - start))])
+            if self.conn is not None:
+                transaction.commit()
+                self.conn.cacheMinimize()
+
+    def done(self):
+        # Throw away anything a benchmark changed.
+        transaction.abort()
+
+
+_fixtures = {}
+
+
+def _fixture(family, size, storage, data_dir, ops):
+    key = (family, size, storage)
+    if key not in _fixtures:
+        _fixtures[key] = Fixture(family, size, storage, data_dir, ops)
+    return _fixtures[key]
+
+
+def _time(loops, fixture, func):
+    total = 0
+    for _ in range(loops):
+        t0 = pyperf.perf_counter()
+        func(fixture)
+        total += pyperf.perf_counter() - t0
+        fixture.done()
+    return total
+
+
+def bench_register(loops, fixture):
+    total = 0
+    intids = fixture.intids
+    for _ in range(loops):
+        t0 = pyperf.perf_counter()
+        for ob in fixture.new:
+            intids.register(ob)
+        total += pyperf.perf_counter() - t0
+        intids.unregisterMany(fixture.new)
+        fixture.done()
+    return total
+
+
+def bench_unregister(loops, fixture):
+    total = 0
+    intids = fixture.intids
+    for _ in range(loops):
+        intids.registerMany(fixture.new)
+        t0 = pyperf.perf_counter()
+        for ob in fixture.new:
+            intids.unregister(ob)
+        total += pyperf.perf_counter() - t0
+        fixture.done()
+    return total
+
+
+def _getId(fixture):
+    getId = fixture.intids.getId
+    for ob in fixture.objects:
+        getId(ob)
+
+
+def _queryId(fixture):
+    queryId = fixture.intids.queryId
+    for ob in fixture.objects:
+        queryId(ob)
+
+
+def _queryId_missing(fixture):
+    queryId = fixture.intids.queryId
+    for ob in fixture.new:
+        queryId(ob)
+
+
+def _getObject(fixture):
+    getObject = fixture.intids.getObject
+    for uid in fixture.ids:
+        getObject(uid)
+
+
+def _queryObject(fixture):
+    queryObject = fixture.intids.queryObject
+    for uid in fixture.ids:
+        queryObject(uid)
+
+
+def _generateId(fixture):
+    generateId = fixture.intids.generateId
+    for ob in fixture.new:
+        generateId(ob)
+
+
+def _items(fixture):
+    fixture.intids.items()
+
+
+def _len(fixture):
+    len(fixture.intids)
+
+
+TIMED = (
+    ('getId', _getId),
+    ('queryId', _queryId),
+    ('queryId missing', _queryId_missing),
+    ('getObject', _getObject),
+    ('queryObject', _queryObject),
+    ('generateId', _generateId),
+    ('items', _items),
+    ('len', _len),
+)
+
+
+def bench(loops, name, family, size, storage, data_dir, ops):
+    fixture = _fixture(family, size, storage, data_dir, ops)
+    if name == 'register':
+        return bench_register(loops, fixture)
+    if name == 'unregister':
+        return bench_unregister(loops, fixture)
+    return _time(loops, fixture, dict(TIMED)[name])
+
+
+def _add_cmdline_args(cmd, args):
+    for family in args.family or ():
+        cmd.extend(('--family', str(family)))
+    for size in args.size or ():
+        cmd.extend(('--size', str(size)))
+    for storage in args.storage or ():
+        cmd.extend(('--storage', storage))
+    for utilities in args.utilities or ():
+        cmd.extend(('--utilities', str(utilities)))
+    cmd.extend(('--ops', str(args.ops), '--data-dir', args.data_dir))
+
+
+def main():
+    runner = pyperf.Runner(add_cmdline_args=_add_cmdline_args)
+    parser = runner.argparser
+    parser.add_argument('--family', type=int, action='append',
+                        choices=sorted(FAMILIES),
+                        help='BTree family (default: both).')
+    parser.add_argument('--size', type=int, action='append',
+                        help='Number of objects in the utility '
+                             '(default: 1000, 10000 and 100000).')
+    parser.add_argument('--storage', action='append', choices=STORAGES,
+                        help='Where to keep the utility (default: all).')
+    parser.add_argument('--utilities', type=int, action='append',
+                        help='Number of utilities for the subscriber '
+                             'benchmarks (default: 1 and 5).')
+    parser.add_argument('--ops', type=int, default=1000,
+                        help='Operations per iteration.')
+    parser.add_argument('--data-dir',
+                        default=os.path.join(tempfile.gettempdir(),
+                                             'zc.intid-benchmarks'),
+                        help='Where to keep the FileStorage fixtures.')
+    args = runner.parse_args()
+    if not os.path.exists(args.data_dir):
+        os.makedirs(args.data_dir)
+
+    names = ['register', 'unregister'] + [name for name, _ in TIMED]
+    for family in args.family or sorted(FAMILIES):
+        for size in args.size or (1000, 10000, 100000):
+            for storage in args.storage or STORAGES:
+                for name in names:
+                    runner.bench_time_func(
+                        '%s family%d %d %s' % (name, family, size, storage),
+                        bench, name, family, size, storage, args.data_dir,
+                        args.ops)
+
+    for utilities in args.utilities or (1, 5):
+        runner.bench_time_func(
+            'subscribers add/remove %d utilities' % utilities,
+            bench_subscribers.bench_add_remove, utilities, args.ops)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare bulk registration with registering one object at a time.
+"""
+
+import pyperf
+# Importing this installs the zope.component event dispatcher, so
+# the events generated by the utility are dispatched the way they
+# are in an application.
+import zope.component.event  # noqa: F401 imported but unused
+
+from zc.intid.utility import IntIds
+
+
+class P:
+    pass
+
+
+def _setup(count):
+    return IntIds('iid'), [P() for _ in range(count)]
+
+
+def bench_register_loop(loops, count):
+    total = 0
+    for _ in range(loops):
+        intids, obs = _setup(count)
+        t0 = pyperf.perf_counter()
+        for ob in obs:
+            intids.register(ob)
+        total += pyperf.perf_counter() - t0
+    return total
+
+
+def bench_registerMany(loops, count, batch_event=False):
+    total = 0
+    for _ in range(loops):
+        intids, obs = _setup(count)
+        t0 = pyperf.perf_counter()
+        intids.registerMany(obs, batch_event)
+        total += pyperf.perf_counter() - t0
+    return total
+
+
+def bench_unregister_loop(loops, count):
+    total = 0
+    for _ in range(loops):
+        intids, obs = _setup(count)
+        intids.registerMany(obs)
+        t0 = pyperf.perf_counter()
+        for ob in obs:
+            intids.unregister(ob)
+        total += pyperf.perf_counter() - t0
+    return total
+
+
+def bench_unregisterMany(loops, count, batch_event=False):
+    total = 0
+    for _ in range(loops):
+        intids, obs = _setup(count)
+        intids.registerMany(obs)
+        t0 = pyperf.perf_counter()
+        intids.unregisterMany(obs, batch_event)
+        total += pyperf.perf_counter() - t0
+    return total
+
+
+def _add_cmdline_args(cmd, args):
+    cmd.extend(('--count', str(args.count)))
+
+
+def main():
+    runner = pyperf.Runner(add_cmdline_args=_add_cmdline_args)
+    runner.argparser.add_argument(
+        '--count', type=int, default=10000,
+        help='Number of objects to (un)register per iteration.')
+    args = runner.parse_args()
+    count = args.count
+
+    runner.bench_time_func('register loop %d' % count,
+                           bench_register_loop, count)
+    runner.bench_time_func('registerMany %d' % count,
+                           bench_registerMany, count)
+    runner.bench_time_func('registerMany batch_event %d' % count,
+                           bench_registerMany, count, True)
+    runner.bench_time_func('unregister loop %d' % count,
+                           bench_unregister_loop, count)
+    runner.bench_time_func('unregisterMany %d' % count,
+                           bench_unregisterMany, count)
+    runner.bench_time_func('unregisterMany batch_event %d' % count,
+                           bench_unregisterMany, count, True)
+
+
+if __name__ == '__main__':
+    main()
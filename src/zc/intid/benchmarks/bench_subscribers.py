@@ -0,0 +1,207 @@
+"""
+Benchmark the lifecycle event subscribers.
+
+Each iteration adds and then removes a number of objects by
+notifying ``IObjectAddedEvent`` and ``IObjectRemovedEvent`` with
+various numbers of registered utilities, with and without lean events.
+
+The subtree benchmarks add and remove a container holding the
+objects, dispatching the events to its sublocations the way
+``zope.container`` does, with and without subtree mode.
+
+The key benchmarks check that the objects can have ids the way the
+subscribers do in each key reference mode, and, for comparison, by
+adapting them to ``IKeyReference`` directly.
+
+The dispatch benchmarks notify the id events of adding and removing
+the objects, which ``intIdEventNotify`` dispatches to the handlers
+for the object and event, with and without such handlers.
+"""
+
+import pyperf
+from zope import component
+from zope.component import testing
+from zope.event import notify as notify_event
+from zope.interface import implementer
+from zope.intid.interfaces import IIntIdEvent
+from zope.intid.interfaces import IntIdAddedEvent
+from zope.intid.interfaces import IntIdRemovedEvent
+from zope.keyreference.interfaces import IKeyReference
+from zope.lifecycleevent import ObjectAddedEvent
+from zope.lifecycleevent import ObjectRemovedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
+from zope.location.interfaces import ILocation
+from zope.location.interfaces import ISublocations
+
+from zc.intid import subscribers
+from zc.intid.interfaces import AddedEvent
+from zc.intid.interfaces import IIdEvent
+from zc.intid.interfaces import IIntIds
+from zc.intid.interfaces import RemovedEvent
+from zc.intid.utility import IntIds
+
+
+@implementer(ILocation)
+class Content:
+    __parent__ = __name__ = None
+
+
+@implementer(ILocation, ISublocations)
+class Container(Content):
+
+    def __init__(self, obs):
+        self.obs = obs
+
+    def sublocations(self):
+        return self.obs
+
+
+@component.adapter(None, IObjectMovedEvent)
+def dispatchToSublocations(ob, event):
+    # Like zope.container.contained.dispatchToSublocations
+    sublocations = ISublocations(ob, None)
+    if sublocations is not None:
+        for sub in sublocations.sublocations():
+            component.handle(sub, event)
+
+
+class KeyReference:
+
+    def __init__(self, ob):
+        self.object = ob
+
+
+def setUp(utility_count):
+    """
+    Register the subscribers and *utility_count* utilities in the
+    global site manager.
+    """
+    testing.setUp()
+    component.provideAdapter(KeyReference, (ILocation,), IKeyReference)
+    component.provideHandler(subscribers.addIntIdSubscriber)
+    component.provideHandler(subscribers.removeIntIdSubscriber)
+    component.provideHandler(subscribers.intIdEventNotify, (IIntIdEvent,))
+    component.provideHandler(subscribers.intIdEventNotify, (IIdEvent,))
+    for i in range(utility_count):
+        component.provideUtility(IntIds('iid%d' % i), IIntIds, str(i))
+
+
+def bench_add_remove(loops, utility_count, count, lean=False):
+    setUp(utility_count)
+    subscribers.setLeanEvents(lean)
+    obs = [Content() for _ in range(count)]
+    notify = component.handle
+    total = 0
+    for _ in range(loops):
+        t0 = pyperf.perf_counter()
+        for ob in obs:
+            notify(ob, ObjectAddedEvent(ob))
+        for ob in obs:
+            notify(ob, ObjectRemovedEvent(ob))
+        total += pyperf.perf_counter() - t0
+    subscribers.setLeanEvents(False)
+    testing.tearDown()
+    return total
+
+
+def bench_add_remove_tree(loops, utility_count, count, subtree=False):
+    setUp(utility_count)
+    component.provideHandler(dispatchToSublocations)
+    subscribers.setSubtreeEvents(subtree)
+    container = Container([Content() for _ in range(count)])
+    notify = component.handle
+    total = 0
+    for _ in range(loops):
+        t0 = pyperf.perf_counter()
+        notify(container, ObjectAddedEvent(container))
+        notify(container, ObjectRemovedEvent(container))
+        total += pyperf.perf_counter() - t0
+    subscribers.setSubtreeEvents(False)
+    testing.tearDown()
+    return total
+
+
+def bench_key(loops, count, mode=None):
+    setUp(0)
+    if mode is None:
+        def key(ob):
+            return IKeyReference(ob, None)
+    else:
+        subscribers.setKeyReferenceMode(mode)
+        key = subscribers._key
+    obs = [Content() for _ in range(count)]
+    total = 0
+    for _ in range(loops):
+        t0 = pyperf.perf_counter()
+        for ob in obs:
+            key(ob)
+        total += pyperf.perf_counter() - t0
+    subscribers.setKeyReferenceMode('adapt')
+    testing.tearDown()
+    return total
+
+
+def bench_dispatch(loops, count, handler_count):
+    testing.setUp()
+    component.provideHandler(subscribers.intIdEventNotify, (IIntIdEvent,))
+    component.provideHandler(subscribers.intIdEventNotify, (IIdEvent,))
+    for _ in range(handler_count):
+        component.provideHandler(lambda ob, event: None,
+                                 (ILocation, IIntIdEvent))
+    utility = IntIds('iid')
+    obs = [Content() for _ in range(count)]
+    total = 0
+    for _ in range(loops):
+        t0 = pyperf.perf_counter()
+        for uid, ob in enumerate(obs):
+            notify_event(AddedEvent(ob, utility, uid))
+            notify_event(IntIdAddedEvent(ob, None))
+            notify_event(IntIdRemovedEvent(ob, None))
+            notify_event(RemovedEvent(ob, utility, uid))
+        total += pyperf.perf_counter() - t0
+    testing.tearDown()
+    return total
+
+
+def _add_cmdline_args(cmd, args):
+    cmd.extend(('--count', str(args.count)))
+
+
+def main():
+    runner = pyperf.Runner(add_cmdline_args=_add_cmdline_args)
+    runner.argparser.add_argument(
+        '--count', type=int, default=1000,
+        help='Number of objects to add and remove per iteration.')
+    args = runner.parse_args()
+
+    for lean in (False, True):
+        for utility_count in (1, 3, 10):
+            runner.bench_time_func(
+                'add/remove %d objects, %d utilities%s' % (
+                    args.count, utility_count, ', lean' if lean else ''),
+                bench_add_remove, utility_count, args.count, lean)
+
+    for subtree in (False, True):
+        for utility_count in (1, 3, 10):
+            runner.bench_time_func(
+                'add/remove container of %d objects, %d utilities%s' % (
+                    args.count, utility_count, ', subtree' if subtree else ''),
+                bench_add_remove_tree, utility_count, args.count, subtree)
+
+    runner.bench_time_func(
+        'adapt %d objects to IKeyReference' % args.count,
+        bench_key, args.count)
+    for mode in ('adapt', 'persistent', 'none'):
+        runner.bench_time_func(
+            'key %d objects, %s mode' % (args.count, mode),
+            bench_key, args.count, mode)
+
+    for handler_count in (0, 3):
+        runner.bench_time_func(
+            'dispatch id events of %d objects, %d handlers' % (
+                args.count, handler_count),
+            bench_dispatch, args.count, handler_count)
+
+
+if __name__ == '__main__':
+    main()
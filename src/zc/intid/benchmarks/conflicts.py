@@ -0,0 +1,239 @@
+"""
+Measure the ConflictError rate of concurrent writers.
+
+Each writer uses its own ZODB connection to register objects in a
+shared utility, and to unregister some of the objects it registered
+before, retrying transactions that fail with a ConflictError.
+Writers are threads sharing a FileStorage or, with ``--processes``,
+processes sharing a ZEO server (this needs ``ZEO`` to be installed).
+
+For each allocator, this reports the commits, conflicts and
+throughput, how many times transactions had to be retried, and the
+objects that conflicted most, described by
+:mod:`zc.intid.diagnostics`. For example::
+
+    python -m zc.intid.benchmarks.conflicts --threads 8 \\
+        --allocator default --allocator stripe
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import persistent
+import transaction
+from ZODB.DB import DB
+from ZODB.POSException import ConflictError
+
+from zc.intid import diagnostics
+from zc.intid.allocation import BloomFilterAllocator
+from zc.intid.allocation import FreeRangeAllocator
+from zc.intid.allocation import StripeAllocator
+from zc.intid.utility import IntIds
+
+
+ALLOCATORS = {
+    'default': lambda: None,
+    'stripe': StripeAllocator,
+    'bloom': BloomFilterAllocator,
+    'range': FreeRangeAllocator,
+}
+
+
+class Content(persistent.Persistent):
+    pass
+
+
+def _work(db, transactions, per_transaction, unregister, minimize, seed):
+    # Run the transactions of one writer, returning a dict of results.
+    rand = random.Random(seed)
+    tm = transaction.TransactionManager()
+    conn = db.open(tm)
+    commits = conflicts = max_retries = 0
+    conflicted = collections.Counter()
+    # The ids this writer has registered and not unregistered
+    mine = []
+    start = time.time()
+    for _ in range(transactions):
+        retries = 0
+        while True:
+            tm.begin()
+            intids = conn.root()['intids']
+            removed = rand.sample(mine, min(unregister, len(mine)))
+            try:
+                for uid in removed:
+                    intids.unregister(intids.getObject(uid))
+                added = [intids.register(Content())
+                         for _ in range(per_transaction)]
+                tm.commit()
+            except ConflictError as e:
+                tm.abort()
+                conflicts += 1
+                retries += 1
+                conflicted[e.oid] += 1
+            else:
+                commits += 1
+                removed = set(removed)
+                mine = [uid for uid in mine if uid not in removed] + added
+                break
+        max_retries = max(max_retries, retries)
+        if minimize:
+            # Simulate cache pressure, which ghosts the utility
+            conn.cacheMinimize()
+    elapsed = time.time() - start
+    conn.close()
+    return {
+        'commits': commits,
+        'conflicts': conflicts,
+        'max_retries': max_retries,
+        'elapsed': elapsed,
+        'conflicted': conflicted,
+    }
+
+
+def _process(addr, args, seed, queue):
+    import ZEO
+    db = ZEO.DB(addr)
+    try:
+        queue.put(_work(db, *args, seed=seed))
+    finally:
+        db.close()
+
+
+def _run_threads(db, count, args):
+    results = []
+
+    def target(seed):
+        results.append(_work(db, *args, seed=seed))
+    workers = [threading.Thread(target=target, args=(seed,))
+               for seed in range(count)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def _run_processes(addr, count, args):
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_process,
+                                       args=(addr, args, seed, queue))
+               for seed in range(count)]
+    for worker in workers:
+        worker.start()
+    results = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def run(allocator, threads=4, transactions=100, per_transaction=5,
+        unregister=2, initial=10000, minimize=False, processes=False):
+    """
+    Run the simulation with the named *allocator*, returning a dict
+    of results.
+    """
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'Data.fs')
+    stop = None
+    try:
+        if processes:
+            import ZEO
+            addr, stop = ZEO.server(path=path)
+            db = ZEO.DB(addr)
+        else:
+            from ZODB.FileStorage import FileStorage
+            db = DB(FileStorage(path), pool_size=threads)
+        with db.transaction() as conn:
+            intids = IntIds('iid', allocator=ALLOCATORS[allocator]())
+            conn.root()['intids'] = intids
+            intids.registerMany([Content() for _ in range(initial)])
+
+        args = (transactions, per_transaction, unregister, minimize)
+        start = time.time()
+        if processes:
+            results = _run_processes(addr, threads, args)
+        else:
+            results = _run_threads(db, threads, args)
+        elapsed = time.time() - start
+
+        conflicted = collections.Counter()
+        for result in results:
+            conflicted.update(result['conflicted'])
+        with db.transaction() as conn:
+            found = diagnostics.nodes(conn.root()['intids'])
+            names = {oid: diagnostics.describe(found[oid]) if oid in found
+                     else 'other' for oid in conflicted}
+        db.close()
+    finally:
+        if stop is not None:
+            stop()
+        shutil.rmtree(tmpdir)
+
+    commits = sum(r['commits'] for r in results)
+    conflicts = sum(r['conflicts'] for r in results)
+    return {
+        'allocator': allocator,
+        'commits': commits,
+        'conflicts': conflicts,
+        'conflict_rate': conflicts / (commits + conflicts),
+        'retries_per_commit': conflicts / commits,
+        'max_retries': max(r['max_retries'] for r in results),
+        'commits_per_second': commits / elapsed,
+        'conflicted': [(names[oid], count)
+                       for oid, count in conflicted.most_common()],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--allocator', action='append',
+                        choices=sorted(ALLOCATORS))
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Number of concurrent writers.')
+    parser.add_argument('--processes', action='store_true',
+                        help='Use processes and a ZEO server instead of '
+                             'threads and a FileStorage.')
+    parser.add_argument('--transactions', type=int, default=100,
+                        help='Transactions committed by each writer.')
+    parser.add_argument('--per-transaction', type=int, default=5,
+                        help='Objects registered in each transaction.')
+    parser.add_argument('--unregister', type=int, default=2,
+                        help='Objects unregistered in each transaction.')
+    parser.add_argument('--initial', type=int, default=10000,
+                        help='Objects registered before starting.')
+    parser.add_argument('--minimize', action='store_true',
+                        help='Minimize the connection cache after each '
+                             'transaction.')
+    parser.add_argument('--top', type=int, default=5,
+                        help='Number of conflicting objects to show.')
+    args = parser.parse_args(argv)
+    if args.processes:
+        try:
+            import ZEO  # noqa: F401 imported but unused
+        except ImportError:
+            parser.error('--processes needs ZEO to be installed')
+
+    for allocator in args.allocator or sorted(ALLOCATORS):
+        result = run(allocator, args.threads, args.transactions,
+                     args.per_transaction, args.unregister, args.initial,
+                     args.minimize, args.processes)
+        print('%(allocator)-10s commits: %(commits)6d'
+              '  conflicts: %(conflicts)6d'
+              '  conflict rate: %(conflict_rate)6.2f%%'
+              '  retries/commit: %(retries_per_commit)5.2f'
+              '  max retries: %(max_retries)3d'
+              '  commits/s: %(commits_per_second)8.1f'
+              % dict(result, conflict_rate=result['conflict_rate'] * 100))
+        for name, count in result['conflicted'][:args.top]:
+            print('    %6d  %s' % (count, name))
+
+
+if __name__ == '__main__':
+    main()
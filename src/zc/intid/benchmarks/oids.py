@@ -0,0 +1,100 @@
+"""
+Measure object loads and commit sizes with and without the oid index.
+
+Objects that are already stored in a FileStorage are registered with
+a utility, looked up after the connection cache is minimized, and
+unregistered again. For each step, the number of objects loaded and
+stored and the growth of the storage are reported. For example::
+
+    python -m zc.intid.benchmarks.oids --count 10000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import persistent
+import transaction
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+
+from zc.intid.utility import IntIds
+
+
+class Content(persistent.Persistent):
+
+    def __init__(self, size):
+        # Give the object some state, so that rewriting it costs
+        # something.
+        self.data = 'x' * size
+
+
+def _step(name, conn, storage, func):
+    conn.getTransferCounts(True)
+    size = storage.getSize()
+    func()
+    transaction.commit()
+    loads, stores = conn.getTransferCounts(True)
+    conn.cacheMinimize()
+    return {
+        'step': name,
+        'loads': loads,
+        'stores': stores,
+        'bytes': storage.getSize() - size,
+    }
+
+
+def run(index_oids, count=10000, size=1000):
+    """
+    Run the steps with a utility that does or doesn't use the oid
+    index, returning a list of dicts of results.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        storage = FileStorage(os.path.join(tmpdir, 'Data.fs'))
+        db = DB(storage)
+        conn = db.open()
+        root = conn.root()
+        root['intids'] = IntIds('iid', index_oids=index_oids)
+        root['obs'] = [Content(size) for _ in range(count)]
+        transaction.commit()
+        conn.cacheMinimize()
+
+        def register():
+            root['intids'].registerMany(root['obs'])
+
+        def lookup():
+            root['intids'].queryIds(root['obs'])
+
+        def unregister():
+            root['intids'].unregisterMany(root['obs'])
+
+        results = [_step(name, conn, storage, func)
+                   for name, func in (('register', register),
+                                      ('lookup', lookup),
+                                      ('unregister', unregister))]
+        conn.close()
+        db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--count', type=int, default=10000,
+                        help='Number of objects.')
+    parser.add_argument('--size', type=int, default=1000,
+                        help='Size of the state of each object.')
+    args = parser.parse_args(argv)
+
+    for index_oids in (False, True):
+        print('oid index' if index_oids else 'attribute')
+        for result in run(index_oids, args.count, args.size):
+            print('  %(step)-10s loads: %(loads)7d  stores: %(stores)7d'
+                  '  bytes: %(bytes)10d' % result)
+
+
+if __name__ == '__main__':
+    main()
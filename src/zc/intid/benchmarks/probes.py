@@ -0,0 +1,107 @@
+"""
+Count the probes and object loads needed to allocate ids in a dense
+utility.
+
+A utility is filled to the given fraction of a range of ids, and the
+random starting points of the allocators are restricted to that range,
+so that the range stands for the whole id space of a nearly full
+utility. The connection cache is minimized before allocating, as
+after a restart. For example::
+
+    python -m zc.intid.benchmarks.probes --ids 200000 --fill 0.9
+"""
+
+import argparse
+import random
+
+import persistent
+import transaction
+from ZODB.DB import DB
+
+from zc.intid.allocation import BloomFilterAllocator
+from zc.intid.allocation import FreeRangeAllocator
+from zc.intid.utility import IntIds
+
+
+ALLOCATORS = {
+    'default': lambda: None,
+    'bloom': BloomFilterAllocator,
+    'range': FreeRangeAllocator,
+}
+
+
+class Content(persistent.Persistent):
+    pass
+
+
+def run(allocator, ids=200000, fill=0.9, count=1000, seed=1):
+    """
+    Allocate *count* ids with the named *allocator* in a utility with
+    *fill* of *ids* ids used, returning a dict of results.
+    """
+    rand = random.Random(seed)
+    db = DB(None)
+    conn = db.open()
+    intids = IntIds('iid', allocator=ALLOCATORS[allocator]())
+    conn.root()['intids'] = intids
+    transaction.commit()
+    for uid in rand.sample(range(ids), int(ids * fill)):
+        intids.refs[uid] = Content()
+    transaction.commit()
+
+    starts = []
+    space = intids.family.maxint + 1
+
+    def randrange(lo, hi):
+        # Scale the range asked for down to the part of the id space
+        # we filled.
+        starts.append(lo)
+        return rand.randrange(0, max(1, ids * hi // space))
+    intids._randrange = randrange
+
+    if isinstance(intids.allocator, BloomFilterAllocator):
+        # Build the filter before measuring.
+        intids.allocator._filter(intids, intids.allocator._state())
+    conn.cacheMinimize()
+    conn.getTransferCounts(True)
+    for _ in range(count):
+        uid = intids.generateId(None)
+        intids.refs[uid] = Content()
+    loads = conn.getTransferCounts()[0]
+
+    if intids.allocator is not None:
+        stats = intids.allocator.stats()
+        probes = stats.get('probes', stats.get('lookups'))
+    else:
+        # Each used id found is followed by a new start.
+        probes = count + len(starts) - 1
+    transaction.abort()
+    conn.close()
+    db.close()
+    return {
+        'allocator': allocator,
+        'probes': probes / count,
+        'loads': loads / count,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--allocator', action='append',
+                        choices=sorted(ALLOCATORS))
+    parser.add_argument('--ids', type=int, default=200000,
+                        help='Size of the range of ids.')
+    parser.add_argument('--fill', type=float, default=0.9,
+                        help='Fraction of the range that is used.')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='Number of ids to allocate.')
+    args = parser.parse_args(argv)
+
+    for allocator in args.allocator or sorted(ALLOCATORS):
+        result = run(allocator, args.ids, args.fill, args.count)
+        print('%(allocator)-10s probes/allocation: %(probes)8.2f'
+              '  loads/allocation: %(loads)8.2f' % result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Finding where ``ConflictError`` happens in a
+:class:`zc.intid.utility.IntIds`.
+
+The oid in a ``ConflictError`` usually belongs to one of the
+persistent objects of a utility: a bucket or an internal node of its
+``refs`` or ``oids`` trees, its length, or the utility itself.
+:func:`nodes` maps the oids of these to a :class:`Node` describing
+them, with the range of keys they hold and how full they are, and
+:func:`attribute` counts the conflicts of a log by node::
+
+    with open('event.log') as log:
+        for node, count in attribute(intids, parseOids(log)):
+            print(count, describe(node))
+
+Many conflicts on the buckets of a few ranges of ids point at
+writers that allocate ids close to each other; many conflicts on
+internal nodes, at buckets that split often. The same can be done
+from the command line, with a ZODB configuration file and the path of
+the utility from the root of the database::
+
+    python -m zc.intid.diagnostics --zconfig zodb.conf \\
+        Application/++etc++site/default/intids event.log
+"""
+
+import argparse
+import collections
+import re
+import sys
+
+from zc.intid.migration import _traverse
+
+
+class Node(collections.namedtuple(
+        'Node', 'kind tree min max size fill')):
+    """
+    A persistent object of a utility.
+
+    *kind* is ``'utility'``, ``'length'``, ``'allocator'``, ``'tree'``
+    (the root of a tree), ``'node'`` (an internal node) or
+    ``'bucket'``. For the parts of trees, *tree* is ``'refs'`` or
+    ``'oids'``, *min* and *max* are the smallest and largest keys
+    they hold, *size* their number of items (of children for internal
+    nodes) and *fill* the fraction of the maximum size that is used.
+    """
+
+
+def _walk(tree, name, result):
+    # Add the nodes of tree to result, returning the Node of the root.
+    max_leaf = type(tree).max_leaf_size
+    max_internal = type(tree).max_internal_size
+
+    def walk(node, kind):
+        # Reading the state of a ghost loads it.
+        state = node.__getstate__()
+        if state is None:
+            found = Node(kind, name, None, None, 0, 0.0)
+        elif len(state) == 1:
+            # A single bucket, stored in the tree itself
+            keys = state[0][0][0][::2]
+            found = Node(kind, name, keys[0] if keys else None,
+                         keys[-1] if keys else None, len(keys),
+                         len(keys) / max_leaf)
+        else:
+            children = [walk(child, 'node') if isinstance(child, type(tree))
+                        else bucket(child) for child in state[0][::2]]
+            found = Node(kind, name, children[0].min, children[-1].max,
+                         len(children), len(children) / max_internal)
+        result[node._p_oid] = found
+        return found
+
+    def bucket(child):
+        size = len(child)
+        found = Node('bucket', name, child.minKey() if size else None,
+                     child.maxKey() if size else None, size,
+                     size / max_leaf)
+        result[child._p_oid] = found
+        return found
+
+    return walk(tree, 'tree')
+
+
+def nodes(intids):
+    """
+    Return a dictionary mapping the oids of the persistent objects of
+    *intids* to their :class:`Node`.
+
+    This loads all the buckets of the trees of the utility, but none
+    of the registered objects. Objects that aren't stored yet are
+    left out.
+    """
+    result = {}
+    result[intids._p_oid] = Node('utility', None, None, None, len(intids),
+                                 None)
+    for kind, name in (('length', '_length'), ('allocator', 'allocator')):
+        value = getattr(intids, name, None)
+        if getattr(value, '_p_oid', None) is not None:
+            result[value._p_oid] = Node(kind, None, None, None, None, None)
+    for name in ('refs', 'oids'):
+        tree = getattr(intids, name)
+        if tree is not None:
+            _walk(tree, name, result)
+    result.pop(None, None)
+    return result
+
+
+_OID = re.compile(r'\boid (0x[0-9a-fA-F]+)')
+
+
+def parseOids(lines):
+    """
+    Yield the oids found in *lines*, such as the lines of a log with
+    the messages of ``ConflictError`` (``oid 0x2a``), as 8-byte
+    strings.
+    """
+    for line in lines:
+        for match in _OID.finditer(line):
+            yield int(match.group(1), 16).to_bytes(8, 'big')
+
+
+def attribute(intids, oids):
+    """
+    Count how many times each of the *oids* (8-byte strings, as in
+    ``ConflictError.oid``) is a persistent object of *intids*.
+
+    Return a list of ``(node, count)`` pairs, most frequent first,
+    with a :class:`Node` of kind ``'other'`` for the oids of other
+    objects.
+    """
+    found = nodes(intids)
+    other = Node('other', None, None, None, None, None)
+    counts = collections.Counter(oids)
+    result = collections.Counter()
+    for oid, count in counts.items():
+        result[found.get(oid, other)] += count
+    return result.most_common()
+
+
+def describe(node):
+    """
+    Return a short description of *node*, for example
+    ``refs bucket 100..250 (45 items, 75% full)``.
+    """
+    if node.tree is None:
+        return node.kind
+    if node.min is None:
+        return '{} {} (empty)'.format(node.tree, node.kind)
+    return '{} {} {!r}..{!r} ({} {}, {:.0%} full)'.format(
+        node.tree, node.kind, node.min, node.max, node.size,
+        'items' if node.kind == 'bucket' else 'children', node.fill)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Attribute the conflicts in logs to the parts of a '
+                    'zc.intid utility.')
+    parser.add_argument('--zconfig', required=True,
+                        help='ZODB configuration file of the database.')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of parts to show.')
+    parser.add_argument('path',
+                        help='Path of the utility from the root of the '
+                             'database.')
+    parser.add_argument('logs', nargs='*',
+                        help='Logs with the conflicts (default: standard '
+                             'input).')
+    args = parser.parse_args(argv)
+
+    import ZODB.config
+    db = ZODB.config.databaseFromURL(args.zconfig)
+    try:
+        oids = []
+        for log in args.logs or ['-']:
+            if log == '-':
+                oids.extend(parseOids(sys.stdin))
+            else:
+                with open(log) as f:
+                    oids.extend(parseOids(f))
+        with db.transaction() as conn:
+            intids = _traverse(conn.root(), args.path)
+            for node, count in attribute(intids, oids)[:args.top]:
+                print('{:8d}  {}'.format(count, describe(node)))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
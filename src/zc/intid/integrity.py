@@ -0,0 +1,341 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Checking and repairing the integrity of a
+:class:`zc.intid.utility.IntIds`.
+
+The ids of a utility are checked in ranges, which :func:`check` can
+spread over worker processes, each with its own ZODB connection. It
+yields a :class:`Problem` for each of these as soon as the range it
+is in has been checked:
+
+``mismatch``
+    The id recorded for the object of an id in ``refs`` (in its
+    attribute or in ``oids``) is another id, or there is none.
+    ``IIntIds.getId`` raises ``IntIdMismatchError`` for such objects.
+
+``missing``
+    The object of an id can't be loaded, because of a
+    ``POSKeyError``.
+
+``orphaned``
+    An oid in ``oids`` has an id that isn't the id of its object in
+    ``refs``. (Objects whose attribute holds an id that isn't in
+    ``refs`` at all can't be found without reading the whole
+    database, and aren't reported.)
+
+    A wrong id in ``oids`` is reported both as a mismatch of the id
+    in ``refs`` and as an orphaned oid; repairing either fixes it.
+
+For example, from the command line, with a ZODB configuration file
+and the path of the utility from the root of the database::
+
+    python -m zc.intid.integrity --zconfig zodb.conf --processes 8 \\
+        Application/++etc++site/default/intids
+
+The workers open the storage read-only (see :func:`openReadOnly`).
+With ``--repair``, the problems found are then repaired by
+:func:`repair`, which can also be used directly.
+"""
+
+import argparse
+import collections
+import functools
+import multiprocessing
+
+import transaction
+
+from zc.intid.migration import _traverse
+from zc.intid.utility import _POSKeyError
+
+
+MISMATCH = 'mismatch'
+MISSING = 'missing'
+ORPHANED = 'orphaned'
+
+#: How often the connection cache is garbage collected while checking.
+GC_INTERVAL = 1000
+
+
+class Problem(collections.namedtuple('Problem', 'kind uid oid stored')):
+    """
+    A problem of the *kind* ``mismatch``, ``missing`` or ``orphaned``
+    with the id *uid*. *oid* is the oid of the object, if it is
+    persistent, and *stored* the id recorded for it, if any.
+    """
+
+
+def _checkId(intids, uid, ob):
+    # Return the Problem of uid, or None.
+    oid = getattr(ob, '_p_oid', None)
+    if getattr(ob, '_p_jar', None) is not None:
+        try:
+            ob._p_activate()
+        except _POSKeyError:
+            return Problem(MISSING, uid, oid, None)
+    stored = intids._storedId(ob)
+    if stored != uid:
+        return Problem(MISMATCH, uid, oid, stored)
+    return None
+
+
+def checkIds(intids, min, max):
+    """
+    Yield the problems of the ids of *intids* from *min* to *max*,
+    inclusive.
+    """
+    jar = intids._p_jar
+    for count, (uid, ob) in enumerate(intids.refs.items(min, max), 1):
+        problem = _checkId(intids, uid, ob)
+        if problem is not None:
+            yield problem
+        if jar is not None and count % GC_INTERVAL == 0:
+            jar.cacheGC()
+
+
+def checkOids(intids, min, max):
+    """
+    Yield the problems of the oids in the ``oids`` index of *intids*
+    from *min* to *max*, inclusive.
+    """
+    if intids.oids is None:
+        return
+    for oid, uid in intids.oids.items(min, max):
+        ob = intids.refs.get(uid)
+        if ob is None or intids._oid(ob) != oid:
+            yield Problem(ORPHANED, uid, oid, uid)
+
+
+def _ranges(lo, hi, count):
+    # Split lo to hi, inclusive, in up to count inclusive ranges of
+    # about the same size. hi may be the largest key of the family, so
+    # nothing past it is used.
+    step = max(1, -(-(hi - lo + 1) // count))
+    return [(start, min(start + step - 1, hi))
+            for start in range(lo, hi + 1, step)]
+
+
+def partitions(intids, count):
+    """
+    Return a list of ``(kind, min, max)`` tuples splitting the ids
+    and oids of *intids* in about *count* ranges of each, where
+    *kind* is ``'ids'`` or ``'oids'`` and *max* is included.
+
+    The ranges are of equal width, which spreads the random ids that
+    the utility allocates evenly.
+    """
+    result = []
+    refs = intids.refs
+    if refs:
+        result.extend(('ids', lo, hi) for lo, hi in
+                      _ranges(refs.minKey(), refs.maxKey(), count))
+    oids = intids.oids
+    if oids:
+        lo = int.from_bytes(oids.minKey(), 'big')
+        hi = int.from_bytes(oids.maxKey(), 'big')
+        result.extend(('oids', lo.to_bytes(8, 'big'), hi.to_bytes(8, 'big'))
+                      for lo, hi in _ranges(lo, hi, count))
+    return result
+
+
+def _checkPartition(db, path, kind, min, max):
+    # Check a partition with a new connection of db, returning a list.
+    tm = transaction.TransactionManager()
+    conn = db.open(tm)
+    try:
+        intids = _traverse(conn.root(), path)
+        checker = checkIds if kind == 'ids' else checkOids
+        return list(checker(intids, min, max))
+    finally:
+        tm.abort()
+        conn.close()
+
+
+# The database of a worker process
+_db = None
+
+
+def _initWorker(open_db):
+    global _db
+    _db = open_db()
+
+
+def _work(partition):
+    return _checkPartition(_db, *partition)
+
+
+def openReadOnly(url):
+    """
+    Open the database configured by the ZODB configuration file at
+    *url*, making its storages read-only where they have that
+    option.
+
+    Read-only storages don't lock a ``FileStorage``, so they can be
+    opened while another process has it open for writing.
+    """
+    import ZConfig
+    import ZODB.config
+    config, _ = ZConfig.loadConfig(ZODB.config.getDbSchema(), url)
+    for database in config.database:
+        storage = database.config.storage.config
+        if hasattr(storage, 'read_only'):
+            storage.read_only = True
+    return ZODB.config.databaseFromConfig(config.database)
+
+
+def check(db, path, open_db=None, processes=4, count=None):
+    """
+    Check the utility at *path* from the root of the database *db*,
+    yielding the problems found.
+
+    The ids are checked in *count* partitions (by default, eight for
+    each process). They are checked in *processes* worker processes,
+    which call *open_db* without arguments to open their database;
+    *open_db* is required then, and must be picklable, for example a
+    :func:`functools.partial` of :func:`openReadOnly`. If *processes*
+    is 0, the partitions are checked one after the other by this
+    process, using *db*. The checks never commit.
+
+    :raises ValueError: If *processes* isn't 0 and *open_db* is None.
+    """
+    if processes and open_db is None:
+        raise ValueError("open_db is required to check in worker "
+                         "processes")
+    return _check(db, path, open_db, processes, count)
+
+
+def _check(db, path, open_db, processes, count):
+    with db.transaction() as conn:
+        parts = partitions(_traverse(conn.root(), path),
+                           count or max(1, processes) * 8)
+    if not processes:
+        for partition in parts:
+            yield from _checkPartition(db, path, *partition)
+        return
+    with multiprocessing.Pool(processes, _initWorker, (open_db,)) as pool:
+        tasks = [(path,) + partition for partition in parts]
+        for problems in pool.imap_unordered(_work, tasks):
+            yield from problems
+
+
+def _repair(intids, problem):
+    # Repair one problem if it is still there. Return whether it was.
+    kind, uid, oid, _ = problem
+    oids = intids.oids
+    if kind == ORPHANED:
+        if oids is None or oids.get(oid) != uid:
+            return False
+        ob = intids.refs.get(uid)
+        if ob is not None and intids._oid(ob) == oid:
+            return False
+        del oids[oid]
+        if intids._attribute_oids is not None:
+            intids._attribute_oids.discard(oid)
+        return True
+
+    ob = intids.refs.get(uid)
+    if ob is None:
+        return False
+    problem = _checkId(intids, uid, ob)
+    if problem is None:
+        return False
+    if problem.kind == MISSING:
+        intids._delRef(uid)
+        intids._changeLength(-1)
+        if oids is not None and oid is not None and oids.get(oid) == uid:
+            del oids[oid]
+    elif (problem.stored is not None
+          and intids.refs.get(problem.stored) is ob):
+        # Registered under two ids; keep the one the object has.
+        intids._delRef(uid)
+        intids._changeLength(-1)
+    else:
+        intids._storeId(ob, uid)
+    return True
+
+
+def repair(intids, problems, batch_size=100):
+    """
+    Repair *problems* of *intids* found by :func:`check` (or
+    :func:`checkIds` and :func:`checkOids`), returning how many were
+    repaired.
+
+    Each problem is checked again, and left alone if it was fixed
+    meanwhile. Ids whose object is missing are removed, as are
+    orphaned oids. An object with a mismatched id is given its id in
+    ``refs``, unless it is also registered under the id it has, in
+    which case the other id is removed. No events are notified.
+
+    A savepoint is made and the cache of the connection of *intids*
+    is minimized after every *batch_size* problems. Committing is left
+    to the caller.
+    """
+    jar = intids._p_jar
+    manager = (jar.transaction_manager if jar is not None
+               else transaction.manager)
+    repaired = 0
+    for count, problem in enumerate(problems, 1):
+        if _repair(intids, problem):
+            repaired += 1
+        if count % batch_size == 0:
+            manager.savepoint(True)
+            if jar is not None:
+                jar.cacheMinimize()
+    return repaired
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Check, and optionally repair, the ids of a zc.intid '
+                    'utility.')
+    parser.add_argument('--zconfig', required=True,
+                        help='ZODB configuration file of the database.')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='Number of worker processes, 0 to check in '
+                             'this process.')
+    parser.add_argument('--partitions', type=int,
+                        help='Number of ranges of ids and of oids '
+                             '(default: eight per process).')
+    parser.add_argument('--repair', action='store_true',
+                        help='Repair the problems found.')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='Problems repaired between savepoints.')
+    parser.add_argument('path',
+                        help='Path of the utility from the root of the '
+                             'database.')
+    args = parser.parse_args(argv)
+
+    import ZODB.config
+    open_db = functools.partial(openReadOnly, args.zconfig)
+    db = (ZODB.config.databaseFromURL(args.zconfig) if args.repair
+          else open_db())
+    try:
+        problems = []
+        for problem in check(db, args.path, open_db, args.processes,
+                             args.partitions):
+            print('{} id {} oid {!r} stored {}'.format(*problem))
+            problems.append(problem)
+        print('{} problems found'.format(len(problems)))
+        if args.repair and problems:
+            with db.transaction() as conn:
+                repaired = repair(_traverse(conn.root(), args.path),
+                                  sorted(problems, key=lambda p: p.uid),
+                                  args.batch_size)
+            print('{} problems repaired'.format(repaired))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -79,6 +79,56 @@ class IIntIdsQuery(zope.interface.Interface):
         Return the default if the object isn't registered
         """
 
+    def getIds(obs):
+        """
+        Return a list of the unique ids of the objects in the
+        iterable *obs*, in the same order.
+
+        This is equivalent to calling :meth:`getId` for each object,
+        but may be more efficient for large numbers of objects.
+
+        :raises zope.intid.interfaces.IntIdMissingError: if
+           there is no id for one of the objects.
+        :raises zc.intid.interfaces.IntIdMismatchError: if the recorded id
+           doesn't match the id of one of the objects.
+        """
+
+    def queryIds(obs, default=None, stats=None):
+        """
+        Return a list of the unique ids of the objects in the
+        iterable *obs*, in the same order.
+
+        The default is used in place of the ids of objects that
+        aren't registered. No exceptions are raised for such objects.
+
+        If *stats* is given, it must be a mapping. Its ``hits``,
+        ``missing`` and ``mismatches`` keys are incremented (starting
+        from 0 if missing) by the number of objects found, the number
+        without an id, and the number whose id doesn't match what's
+        recorded in the utility.
+        """
+
+    def getObjects(ids):
+        """
+        Return a list of the objects with the unique ids in the
+        iterable *ids*, in the same order.
+
+        This is equivalent to calling :meth:`getObject` for each id,
+        but may be more efficient for large numbers of ids.
+
+        :raises zope.intid.interfaces.ObjectMissingError: if
+          there is no object for one of the ids.
+        """
+
+    def queryObjects(ids, default=None):
+        """
+        Return a list of the objects with the unique ids in the
+        iterable *ids*, in the same order.
+
+        The default is used in place of the objects for ids that
+        aren't registered.
+        """
+
     def __iter__():
         """Return an iteration on the ids"""
 
@@ -110,6 +160,33 @@ class IIntIdsSet(zope.interface.Interface):
 
         """
 
+    def registerMany(obs, batch_event=False):
+        """
+        Register each object in the iterable *obs*, returning a list
+        of their ids in the same order.
+
+        This is equivalent to calling :meth:`register` for each
+        object, but new ids are inserted into the utility in sorted
+        order so that each BTree bucket is modified only once.
+        Objects that are already registered keep their ids.
+
+        Normally an :class:`IIdAddedEvent` is generated for each new
+        registration. If *batch_event* is true, a single
+        :class:`IIdsAddedEvent` is generated instead (and only if
+        something was registered).
+        """
+
+    def unregisterMany(obs, batch_event=False):
+        """
+        Unregister each object in the iterable *obs*.
+
+        Objects that are not registered are ignored. Normally an
+        :class:`IIdRemovedEvent` is generated for each
+        unregistration; if *batch_event* is true, a single
+        :class:`IIdsRemovedEvent` is generated instead (and only if
+        something was unregistered).
+        """
+
 
 class IIntIdsManage(zope.interface.Interface):
     """Some methods used by the view."""
@@ -120,6 +197,65 @@ class IIntIdsManage(zope.interface.Interface):
     def items():
         """Return a list of (id, object) pairs."""
 
+    def iteritems(min=None, max=None, excludemin=False, excludemax=False):
+        """
+        Return an iterator over (id, object) pairs, in id order.
+
+        Only ids between *min* and *max* (inclusive, unless
+        *excludemin* or *excludemax* are true) are included. A bound
+        of None means no bound.
+
+        Unlike :meth:`items`, this doesn't build a list, so it can
+        be used to go through very large utilities in constant
+        memory.
+        """
+
+    def iterkeys(min=None, max=None, excludemin=False, excludemax=False):
+        """
+        Return an iterator over the ids in the given range, in order.
+
+        See :meth:`iteritems` for the arguments.
+        """
+
+    def itervalues(min=None, max=None, excludemin=False, excludemax=False):
+        """
+        Return an iterator over the objects with ids in the given
+        range, in id order.
+
+        See :meth:`iteritems` for the arguments.
+        """
+
+    def pageItems(cursor=None, size=100):
+        """
+        Return a page of at most *size* (id, object) pairs, in id order.
+
+        The result is a tuple ``(items, cursor)``. To get the next
+        page, call this again with the returned cursor. The returned
+        cursor is None when there are no more pages; a cursor of
+        None starts at the first page.
+
+        The cursor is the last id of the page, so it can be kept
+        (for example, in a URL) and remains valid even if the
+        utility changes between calls.
+
+        Raises :exc:`ValueError` if *size* is less than 1.
+        """
+
+    def ids():
+        """
+        Return a read-only view of the registered ids, in order.
+
+        This takes constant time and reflects later changes to the
+        utility. It can be passed directly, without copying, to the
+        ``intersection``, ``union`` and ``multiunion`` functions of
+        ``family.IF`` (and the other integer-keyed modules of the
+        family), and as the second argument of ``difference``. For
+        example, to drop the ids that are no longer registered from
+        a catalog result set::
+
+            family.IF.intersection(result, intids.ids())
+        """
+
 
 class IIntIds(IIntIdsSet, IIntIdsQuery, IIntIdsManage):
     """A utility that assigns unique ids to objects.
@@ -136,8 +272,10 @@ class IIntIdsSubclass(zope.interface.Interface):
 
         This will be either BTree.family32 or BTree.family64.
 
-        This may not be modified, but may be used to create additional
-        structures of the same integer family as the ``refs`` structure.
+        This may not be modified directly (use
+        :class:`zc.intid.migration.FamilyConversion`), but may be used
+        to create additional structures of the same integer family as
+        the ``refs`` structure.
 
         """)
 
@@ -164,7 +302,117 @@ class IIntIdsSubclass(zope.interface.Interface):
         If this method returns an id that is already in use,
         ``register`` will raise an :exc:`IntIdInUseError`.
 
+        If the utility has an ``allocator``, it is used instead of
+        the default behavior.
+
+        """
+
+    allocator = zope.interface.Attribute(
+        """An optional :class:`IIdAllocator` used by ``generateId``.
+
+        If this is None (the default), ids are allocated sequentially
+        starting from a random position that is chosen again whenever
+        a used id is found.
+        """)
+
+    oids = zope.interface.Attribute(
+        """An optional BTree mapping oids to ids.
+
+        If this is not None, it holds the ids of the registered
+        persistent objects stored in the same database as the utility,
+        instead of their attribute.
+
+        This should not be directly modified by subclasses.
+        """)
+
+    interfaces = zope.interface.Attribute(
+        """An optional tuple of interfaces limiting what is registered.
+
+        If this is not None (the default), :mod:`zc.intid.subscribers`
+        only register objects providing at least one of these
+        interfaces in this utility. Calling ``register`` directly is
+        not affected.
+        """)
+
+    def accepts(ob):
+        """Return whether :mod:`zc.intid.subscribers` should register
+        *ob* in this utility.
+
+        The default implementation checks :attr:`interfaces`, and the
+        subscribers cache its result for each interface
+        specification. If this method is overridden, the subscribers
+        call it for every object instead.
+        """
+
+
+class IIdAllocator(zope.interface.Interface):
+    """
+    A strategy for choosing new ids.
+
+    Allocators are stored as the ``allocator`` of an
+    :class:`IIntIdsSubclass` and so must be picklable if the utility
+    is persistent.
+    """
+
+    def allocate(intids, ob):
+        """
+        Return an id that is not yet used in *intids*.
+
+        *ob* is the object the id is being generated for.
+        """
+
+
+class IIntIdsStatsSink(zope.interface.Interface):
+    """
+    Receives measurements from :class:`zc.intid.utility.IntIds`.
+
+    See :func:`zc.intid.stats.setSink`.
+    """
+
+    def increment(intids, name, value=1):
         """
+        Add *value* to the counter *name* of the utility *intids*.
+        """
+
+    def observe(intids, name, value):
+        """
+        Record *value* (for example, a duration in seconds) in the
+        histogram *name* of the utility *intids*.
+        """
+
+
+class IIntIdsStats(zope.interface.Interface):
+    """
+    The measurements collected for one utility.
+
+    The utility reports these counters:
+
+    ``registered``, ``unregistered``
+        Objects registered and unregistered.
+    ``lookups``, ``missing``, ``mismatches``
+        Calls to ``getId`` (and so ``queryId``), and how many of
+        them found no id or an id of another object.
+    ``allocations``
+        Ids generated by ``generateId``.
+
+    And these histograms:
+
+    ``probes``
+        The number of candidates ``generateId`` looked up in ``refs``
+        for each id, when the utility has no ``allocator``.
+    ``notify``
+        The time, in seconds, spent notifying the events of
+        (un)registering an object (or a batch of objects).
+    """
+
+    counters = zope.interface.Attribute(
+        "A mapping from counter name to value.")
+
+    histograms = zope.interface.Attribute(
+        "A mapping from histogram name to :class:`zc.intid.stats.Histogram`.")
+
+    def reset():
+        """Forget all the measurements."""
 
 
 class IIdEvent(zope.interface.Interface):
@@ -198,6 +446,60 @@ class IIdAddedEvent(IIdEvent):
     """
 
 
+class IIdsEvent(zope.interface.Interface):
+    """
+    Generic base interface for events about several ids at once.
+    """
+
+    objects = zope.interface.Attribute(
+        "A sequence of the objects related to this event")
+
+    idmanager = zope.interface.Attribute(
+        "The int id utility generating the event.")
+
+    ids = zope.interface.Attribute(
+        "A sequence of the ids being assigned or unassigned, "
+        "parallel to ``objects``.")
+
+
+class IIdsRemovedEvent(IIdsEvent):
+    """
+    Several unique ids have been removed.
+
+    Generated by :meth:`IIntIdsSet.unregisterMany` in place of
+    one :class:`IIdRemovedEvent` for each object.
+    """
+
+
+class IIdsAddedEvent(IIdsEvent):
+    """
+    Several unique ids have been added.
+
+    Generated by :meth:`IIntIdsSet.registerMany` in place of
+    one :class:`IIdAddedEvent` for each object.
+    """
+
+
+class IIdSpaceFillEvent(zope.interface.Interface):
+    """
+    The ids of a utility have filled a given fraction of its id space.
+
+    Allocators that support it (such as
+    :class:`zc.intid.allocation.FreeRangeAllocator`) fire this once
+    per process when the fill crosses one of their thresholds, as a
+    warning that allocating ids will get harder.
+    """
+
+    idmanager = zope.interface.Attribute(
+        "The int id utility whose id space is filling up.")
+
+    fill = zope.interface.Attribute(
+        "The fraction of the id space that is used.")
+
+    threshold = zope.interface.Attribute(
+        "The highest threshold that ``fill`` has crossed.")
+
+
 class Event:
 
     def __init__(self, object, idmanager, id):
@@ -216,6 +518,33 @@ class RemovedEvent(Event):
     pass
 
 
+class BatchEvent:
+
+    def __init__(self, objects, idmanager, ids):
+        self.objects = objects
+        self.idmanager = idmanager
+        self.ids = ids
+
+
+@zope.interface.implementer(IIdsAddedEvent)
+class IdsAddedEvent(BatchEvent):
+    pass
+
+
+@zope.interface.implementer(IIdsRemovedEvent)
+class IdsRemovedEvent(BatchEvent):
+    pass
+
+
+@zope.interface.implementer(IIdSpaceFillEvent)
+class IdSpaceFillEvent:
+
+    def __init__(self, idmanager, fill, threshold):
+        self.idmanager = idmanager
+        self.fill = fill
+        self.threshold = threshold
+
+
 class ISubscriberEvent(zope.interface.Interface):
     """
     An event fired by the subscribers in relation to another event.
@@ -254,6 +583,28 @@ class IBeforeIdRemovedEvent(ISubscriberEvent):
     """
 
 
+class IDeferredIdsEvent(zope.interface.Interface):
+    """
+    Fired once, just before a transaction commits, by the subscribers
+    in deferred mode.
+
+    In that mode, this takes the place of the events the subscribers
+    would otherwise fire for each object. See
+    :func:`zc.intid.subscribers.setDeferredEvents`.
+
+    Registrations that were undone in the same transaction, such as
+    an object that was added and then removed, are not included.
+    """
+
+    added = zope.interface.Attribute(
+        "A list of (utility, id, object) triples for the ids registered "
+        "during the transaction.")
+
+    removed = zope.interface.Attribute(
+        "A list of (utility, id, object) triples for the ids unregistered "
+        "during the transaction.")
+
+
 @zope.interface.implementer(IBeforeIdRemovedEvent)
 class BeforeIdRemovedEvent:
 
@@ -269,3 +620,11 @@ class AfterIdAddedEvent:
         self.object = o
         self.idmap = idmap
         self.original_event = event
+
+
+@zope.interface.implementer(IDeferredIdsEvent)
+class DeferredIdsEvent:
+
+    def __init__(self, added, removed):
+        self.added = added
+        self.removed = removed
@@ -0,0 +1,430 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Migrating ids to :class:`zc.intid.utility.IntIds`.
+
+:class:`Migration` copies the ids of a :class:`zope.intid.IntIds`
+utility to a :class:`zc.intid.utility.IntIds` utility, keeping the
+same ids. It works in batches of ids, committing (or making a
+savepoint) and minimizing the ZODB cache after each one, and records
+the last id it copied in the same transaction, so that a migration
+that stopped can be resumed where it left off. A batch whose commit
+fails with a ``ConflictError`` is retried a few times::
+
+    root['migration'] = migration = Migration(source, target)
+    transaction.commit()
+    migration.run()
+
+The same can be done from the command line, with a ZODB
+configuration file and the paths of the utilities from the root of
+the database::
+
+    python -m zc.intid.migration --zconfig zodb.conf \\
+        Application/++etc++site/default/intids \\
+        Application/++etc++site/default/zc-intids
+
+The target utility has to be created and registered first. Use one
+with an oid index (``IntIds(attribute, index_oids=True)``): the
+migration then doesn't have to load or modify the objects whose ids
+it copies.
+
+No events are notified for the copied ids.
+
+:class:`FamilyConversion` changes the BTree family of a
+:class:`zc.intid.utility.IntIds`, usually from ``BTrees.family32``
+to ``BTrees.family64`` when a utility runs out of 32-bit ids. It
+builds new ``refs`` and ``oids`` trees in batches the same way,
+without loading the registered objects, and then replaces the trees
+of the utility. Until then the utility keeps working as before, and
+registering and unregistering objects also updates the new trees::
+
+    root['conversion'] = conversion = FamilyConversion(intids)
+    transaction.commit()
+    conversion.run()
+
+The conversion can be resumed like a migration, and from the command
+line with ``--family 64`` and the path of the utility::
+
+    python -m zc.intid.migration --zconfig zodb.conf --family 64 \\
+        Application/++etc++site/default/zc-intids
+"""
+
+import argparse
+import logging
+import time
+from itertools import islice
+
+import BTrees
+import persistent
+import transaction
+from transaction.interfaces import TransientError
+
+
+logger = logging.getLogger(__name__)
+
+
+def _logReport(migration, progress):
+    logger.info('%(copied)d ids copied, %(skipped)d skipped, '
+                'up to %(position)r, %(rate).1f ids/s', progress)
+
+
+def _manager(ob):
+    jar = ob._p_jar
+    return (jar, jar.transaction_manager if jar is not None
+            else transaction.manager)
+
+
+def _batch(tree, position, batch_size):
+    # Return a list of the first items of tree after the key position,
+    # getting a new iterator each time since the tree changes in
+    # between.
+    if position is None:
+        items = tree.items()
+    else:
+        items = tree.items(position, excludemin=True)
+    return list(islice(items, batch_size))
+
+
+class _Copy(persistent.Persistent):
+    # The common part of copying trees in batches.
+
+    #: The last key copied, or None if none was.
+    position = None
+
+    #: The number of ids copied.
+    copied = 0
+
+    #: The number of ids that weren't copied.
+    skipped = 0
+
+    #: Whether all the ids were copied.
+    finished = False
+
+    def _retrying(self, manager, savepoints, retries, func):
+        # Call func, which commits, and if committing fails with a
+        # ConflictError (or another transient error), abort and call it
+        # again, up to retries times. With savepoints the caller
+        # commits, so there's nothing to retry.
+        attempts = 0
+        while True:
+            # Aborting resets our state, such as the position, to what
+            # was last committed, but only if we are stored.
+            state = self.__getstate__()
+            try:
+                return func()
+            except TransientError:
+                if savepoints or attempts >= retries:
+                    raise
+                attempts += 1
+                manager.abort()
+                if self._p_jar is None:
+                    self.__setstate__(state)
+                logger.info('Conflict, retrying (%d of %d)', attempts,
+                            retries)
+
+    def _copyBatch(self, manager, tree, batch_size, savepoints):
+        # Copy and commit the next batch. Return whether there was one.
+        batch = _batch(tree, self.position, batch_size)
+        if not batch:
+            return False
+        self._copy(batch)
+        self.position = batch[-1][0]
+        if savepoints:
+            manager.savepoint(True)
+        else:
+            manager.commit()
+        return True
+
+    def _copyBatches(self, jar, manager, tree, batch_size, savepoints,
+                     retries, report, start, copied):
+        def copyBatch():
+            return self._copyBatch(manager, tree, batch_size, savepoints)
+        while self._retrying(manager, savepoints, retries, copyBatch):
+            if jar is not None:
+                jar.cacheMinimize()
+            elapsed = time.time() - start
+            report(self, {
+                'copied': self.copied,
+                'skipped': self.skipped,
+                'position': self.position,
+                'elapsed': elapsed,
+                'rate': (self.copied - copied) / elapsed if elapsed else 0,
+            })
+
+
+class Migration(_Copy):
+    """
+    The progress of copying the ids of the zope.intid utility *source*
+    to the zc.intid utility *target*.
+    """
+
+    #: The number of ids that weren't copied, because their object
+    #: was missing or already had another id in the target, or their
+    #: id was already used by another object. These are logged.
+    skipped = 0
+
+    def __init__(self, source, target):
+        if source.family.maxint > target.family.maxint:
+            raise ValueError("The ids of the source utility don't fit "
+                             "in the family of the target utility")
+        self.source = source
+        self.target = target
+
+    def _copy(self, batch):
+        # Copy a batch of (id, key reference) pairs to the target.
+        target = self.target
+        added = 0
+        for uid, ref in batch:
+            ob = ref()
+            if ob is None:
+                logger.warning('Skipping id %s: its object is missing', uid)
+                self.skipped += 1
+                continue
+            current = target._queryId(ob)
+            if current == uid:
+                # Registered with the same id since, for example by
+                # the subscribers.
+                continue
+            if current is not None or uid in target.refs:
+                logger.warning('Skipping id %s of %r: the object or the id '
+                               'is already registered', uid, ob)
+                self.skipped += 1
+                continue
+            target._setRef(uid, ob)
+            target._storeId(ob, uid)
+            added += 1
+        target._changeLength(added)
+        self.copied += added
+
+    def run(self, batch_size=1000, savepoints=False, report=_logReport,
+            retries=3):
+        """
+        Copy the ids not copied yet, *batch_size* at a time.
+
+        After each batch, the transaction is committed, or if
+        *savepoints* is true, a savepoint is made and committing is
+        left to the caller. Then the cache of the connection of the
+        source is minimized and *report* is called with the migration
+        and a dictionary of the ``copied``, ``skipped``, ``position``,
+        ``elapsed`` seconds and ``rate`` of ids per second of this
+        run. By default the progress is logged.
+
+        When committing fails with a ``ConflictError``, the
+        transaction is aborted and the batch is copied again from the
+        last committed position, up to *retries* times; the error is
+        raised after that.
+
+        Return the number of ids copied by this run.
+        """
+        jar, manager = _manager(self.source)
+        copied = self.copied
+        self._copyBatches(jar, manager, self.source.refs, batch_size,
+                          savepoints, retries, report, time.time(), copied)
+
+        def finish():
+            self.finished = True
+            if not savepoints:
+                manager.commit()
+        self._retrying(manager, savepoints, retries, finish)
+        return self.copied - copied
+
+
+def _differences(old, new):
+    # Return the keys only in old and the keys only in new, walking
+    # both trees in order.
+    missing = []
+    extra = []
+    old_keys = iter(old.keys())
+    new_keys = iter(new.keys())
+    o = next(old_keys, _END)
+    n = next(new_keys, _END)
+    while o is not _END or n is not _END:
+        if n is _END or (o is not _END and o < n):
+            missing.append(o)
+            o = next(old_keys, _END)
+        elif o is _END or n < o:
+            extra.append(n)
+            n = next(new_keys, _END)
+        else:
+            o = next(old_keys, _END)
+            n = next(new_keys, _END)
+    return missing, extra
+
+
+_END = object()
+
+
+class FamilyConversion(_Copy):
+    """
+    The progress of changing the family of the zc.intid utility
+    *intids* to *family*.
+
+    Creating the conversion starts mirroring the changes of the
+    utility to the new trees, so it should be committed before
+    calling :meth:`run`. Only one conversion of a utility can be
+    in progress.
+    """
+
+    #: The tree being copied, ``'refs'`` or ``'oids'``.
+    phase = 'refs'
+
+    def __init__(self, intids, family=BTrees.family64):
+        if intids._conversion is not None:
+            raise ValueError("The family of the utility is already being "
+                             "changed")
+        if family.maxint < intids.family.maxint:
+            raise ValueError("The ids of the utility don't fit in the "
+                             "new family")
+        self.intids = intids
+        self.family = family
+        self.refs = family.IO.BTree()
+        self.oids = family.OI.BTree() if intids.oids is not None else None
+        intids._conversion = self
+
+    def _copy(self, batch):
+        getattr(self, self.phase).update(batch)
+        if self.phase == 'refs':
+            self.copied += len(batch)
+
+    def run(self, batch_size=1000, savepoints=False, report=_logReport,
+            retries=3):
+        """
+        Copy the ``refs`` and ``oids`` of the utility not copied yet,
+        *batch_size* items at a time, and then :meth:`finish` the
+        conversion.
+
+        *savepoints*, *report* and *retries* are used as by
+        :meth:`Migration.run`; the ``position`` reported is the last
+        key of the tree being copied.
+        """
+        jar, manager = _manager(self.intids)
+        start = time.time()
+        copied = self.copied
+        if self.phase == 'refs':
+            self._copyBatches(jar, manager, self.intids.refs, batch_size,
+                              savepoints, retries, report, start, copied)
+            if self.oids is not None:
+                # Committed by itself, so that aborting a conflicting
+                # batch of oids doesn't go back to the end of refs.
+                def nextPhase():
+                    self.phase = 'oids'
+                    self.position = None
+                    if not savepoints:
+                        manager.commit()
+                self._retrying(manager, savepoints, retries, nextPhase)
+        if self.phase == 'oids':
+            self._copyBatches(jar, manager, self.intids.oids, batch_size,
+                              savepoints, retries, report, start, copied)
+
+        def finish():
+            self.finish()
+            if not savepoints:
+                manager.commit()
+        self._retrying(manager, savepoints, retries, finish)
+        return self.copied - copied
+
+    def finish(self):
+        """
+        Replace the trees and the family of the utility, and stop
+        mirroring its changes.
+
+        Any differences between the keys of the old and new trees,
+        left by changes made while a batch was being copied, are
+        repaired first. This reads all the buckets of both trees, but
+        not the registered objects.
+        """
+        intids = self.intids
+        trees = [('refs', self.refs)]
+        if self.oids is not None:
+            trees.append(('oids', self.oids))
+        for name, new in trees:
+            old = getattr(intids, name)
+            missing, extra = _differences(old, new)
+            for key in missing:
+                new[key] = old[key]
+            for key in extra:
+                del new[key]
+            setattr(intids, name, new)
+        intids.family = self.family
+        del intids._conversion
+        intids._v_nextid = None
+        self.finished = True
+
+
+def _traverse(ob, path):
+    for name in path.strip('/').split('/'):
+        if name == '++etc++site':
+            ob = ob.getSiteManager()
+        elif name:
+            ob = ob[name]
+    return ob
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Copy the ids of a zope.intid utility to a zc.intid '
+                    'utility, or change the family of a zc.intid utility, '
+                    'resuming a migration that stopped.')
+    parser.add_argument('--zconfig', required=True,
+                        help='ZODB configuration file of the database.')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Ids copied in each transaction.')
+    parser.add_argument('--family', type=int, choices=(32, 64),
+                        help='Change the family of the zc.intid utility '
+                             'to this one.')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='Paths from the root of the database of the '
+                             'zope.intid and zc.intid utilities, or with '
+                             '--family, of the zc.intid utility.')
+    args = parser.parse_args(argv)
+    if len(args.paths) != (1 if args.family else 2):
+        parser.error('Wrong number of paths')
+
+    import ZODB.config
+    db = ZODB.config.databaseFromURL(args.zconfig)
+    try:
+        conn = db.open()
+        root = conn.root()
+        # The progress is kept in the root, under a key naming the
+        # utilities.
+        key = ' '.join(['zc.intid.migration'] + args.paths)
+        if args.family:
+            key += ' family%d' % args.family
+        migration = root.get(key)
+        if migration is None:
+            utilities = [_traverse(root, path) for path in args.paths]
+            if args.family:
+                family = getattr(BTrees, 'family%d' % args.family)
+                migration = FamilyConversion(*utilities, family=family)
+            else:
+                migration = Migration(*utilities)
+            root[key] = migration
+            transaction.commit()
+        elif migration.finished:
+            print('Already finished, {} ids copied'.format(
+                migration.copied))
+            return
+
+        def report(migration, progress):
+            print('{copied} ids copied, {skipped} skipped, up to '
+                  '{position!r}, {rate:.1f} ids/s'.format(**progress))
+        migration.run(args.batch_size, report=report)
+        print('Finished, {} ids copied, {} skipped'.format(
+            migration.copied, migration.skipped))
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
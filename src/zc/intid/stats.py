@@ -0,0 +1,165 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Opt-in instrumentation of :class:`zc.intid.utility.IntIds`.
+
+Instrumentation is disabled until a
+:class:`~zc.intid.interfaces.IIntIdsStatsSink` is installed with
+:func:`setSink`. The utilities of the process then report counters
+and measurements to it. The simplest sink is a
+:class:`StatsCollector`, which keeps them in memory for each utility;
+they can be read by adapting the utility to
+:class:`~zc.intid.interfaces.IIntIdsStats`::
+
+    collector = setSink(StatsCollector())
+    ...
+    stats = IIntIdsStats(intids)
+    stats.counters['mismatches'] / stats.counters['lookups']
+
+Other sinks can forward the measurements to a metrics system.
+"""
+
+import collections
+import math
+import weakref
+
+from zope.component import adapter
+from zope.interface import implementer
+
+from zc.intid import utility
+from zc.intid.interfaces import IIntIds
+from zc.intid.interfaces import IIntIdsStats
+from zc.intid.interfaces import IIntIdsStatsSink
+
+
+def setSink(sink):
+    """
+    Make the utilities report to *sink*, or stop reporting if that
+    is None. Return *sink*.
+    """
+    utility._sink = sink
+    return sink
+
+
+def getSink():
+    """
+    Return the sink set with :func:`setSink`, or None.
+    """
+    return utility._sink
+
+
+class Histogram:
+    """
+    A summary of the values observed for one measurement.
+
+    Besides the count, total, minimum and maximum, the values are
+    counted in :attr:`buckets` by power of two: the key *n* counts
+    the values greater than ``2 ** (n - 1)`` and at most ``2 ** n``.
+    Zero and negative values are counted under the key None.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = collections.Counter()
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            if mantissa == 0.5:
+                # Exact powers of two belong to the bucket below
+                exponent -= 1
+        else:
+            exponent = None
+        self.buckets[exponent] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+@implementer(IIntIdsStats)
+class IntIdsStats:
+    """
+    The counters and histograms of one utility.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+
+
+@implementer(IIntIdsStatsSink)
+class StatsCollector:
+    """
+    Keep an :class:`IntIdsStats` in memory for each utility.
+
+    The copies of a stored utility loaded by different connections
+    share their statistics.
+    """
+
+    def __init__(self):
+        # Utilities that aren't stored in a database
+        self._stats = weakref.WeakKeyDictionary()
+        # {db: {oid: stats}}
+        self._stored = weakref.WeakKeyDictionary()
+
+    def statsFor(self, intids):
+        """
+        Return the :class:`IntIdsStats` of *intids*.
+        """
+        if intids._p_jar is None:
+            stats = self._stats
+            key = intids
+        else:
+            db = intids._p_jar.db()
+            try:
+                stats = self._stored[db]
+            except KeyError:
+                stats = self._stored.setdefault(db, {})
+            key = intids._p_oid
+        try:
+            return stats[key]
+        except KeyError:
+            return stats.setdefault(key, IntIdsStats())
+
+    def increment(self, intids, name, value=1):
+        self.statsFor(intids).counters[name] += value
+
+    def observe(self, intids, name, value):
+        self.statsFor(intids).histograms[name].observe(value)
+
+
+@adapter(IIntIds)
+@implementer(IIntIdsStats)
+def getStats(intids):
+    """
+    Adapt a utility to the :class:`~zc.intid.interfaces.IIntIdsStats`
+    collected by the installed :class:`StatsCollector`, if any.
+    """
+    sink = utility._sink
+    if isinstance(sink, StatsCollector):
+        return sink.statsFor(intids)
+    return None
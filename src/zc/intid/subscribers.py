@@ -21,32 +21,516 @@ In particular, a few things are done just like :mod:`zope.intid`:
    any processing (even though we don't register that in the utility
    or otherwise use it.) In the common case of persistent objects,
    this will ensure that the object is in the database and has a jar
-   and oid, common needs.
+   and oid, common needs. (This can be changed with
+   :func:`setKeyReferenceMode`.)
 
 #. We do broadcast the events from :mod:`zope.intid.interfaces`, even though
    the utility will broadcast its own events. Thus these subscribers
    generate at least three events for every lifecycle event.
 """
 
+import collections
+import weakref
+from time import perf_counter
+
+import transaction
+import zope.event
 from zope import component
 from zope.component import handle
+from zope.component.event import dispatch
+from zope.component.event import objectEventNotify
 from zope.event import notify
+from zope.interface import implementedBy
+from zope.interface import providedBy
 from zope.intid.interfaces import IntIdAddedEvent
 from zope.intid.interfaces import IntIdRemovedEvent
 from zope.keyreference.interfaces import IKeyReference
 from zope.lifecycleevent.interfaces import IObjectAddedEvent
 from zope.lifecycleevent.interfaces import IObjectRemovedEvent
 from zope.location.interfaces import ILocation
+from zope.location.interfaces import ISublocations
 
 from zc.intid.interfaces import AfterIdAddedEvent
 from zc.intid.interfaces import BeforeIdRemovedEvent
+from zc.intid.interfaces import DeferredIdsEvent
 from zc.intid.interfaces import IIntIds
+from zc.intid.utility import IntIds
+
+
+# Set by setLeanEvents()
+_lean = False
+
+
+def setLeanEvents(lean=True):
+    """
+    Enable or disable *lean* event mode.
+
+    In lean mode, the subscribers only create and notify the
+    events from :mod:`zope.intid.interfaces` and :mod:`zc.intid.interfaces`
+    that they generate if some handler would receive them.
+
+    This can also be set with the ``subscriberOptions`` ZCML directive.
+    """
+    global _lean
+    _lean = bool(lean)
+
+
+# Set by setDeferredEvents()
+_deferred = False
+
+
+def setDeferredEvents(deferred=True):
+    """
+    Enable or disable *deferred* event mode.
+
+    In deferred mode, the subscribers still register and unregister
+    objects immediately, but instead of notifying events for each
+    object they remember the (utility, id, object) triples involved.
+    Just before the current transaction commits, they notify a single
+    :class:`zc.intid.interfaces.IDeferredIdsEvent` with all of them,
+    so that indexes can do their work in bulk. Objects that were
+    added and then removed during the transaction are left out.
+
+    The transaction is that of the transaction manager of the ZODB
+    connection of the object, or if it has none, of the first
+    utility that has one, or else the current transaction of the
+    thread (from :func:`transaction.get`).
+
+    This can also be set with the ``subscriberOptions`` ZCML directive.
+    """
+    global _deferred
+    _deferred = bool(deferred)
+
+
+# Set by setSubtreeEvents()
+_subtree = False
+
+# In subtree mode, maps the events being dispatched to the ids of the
+# objects handled with their subtree.
+_subtrees = weakref.WeakKeyDictionary()
+
+
+def setSubtreeEvents(subtree=True):
+    """
+    Enable or disable *subtree* mode.
+
+    When an object with sublocations, such as a container, is added
+    or removed, :mod:`zope.container` dispatches the event to each of
+    its sublocations as well. In subtree mode, the first time the
+    subscribers get such an event, they find all the sublocations of
+    the object of the event at once and register (or unregister) all
+    of them with a single ``registerMany`` (or ``unregisterMany``) for
+    each utility. Later calls for the same event and one of these
+    objects do nothing.
+
+    The same events are notified for each object, but all the objects
+    are registered before the events of the first one, and the
+    :class:`zc.intid.interfaces.IBeforeIdRemovedEvent` of all of them
+    are notified before the first one is unregistered.
+
+    This can also be set with the ``subscriberOptions`` ZCML directive.
+    """
+    global _subtree
+    _subtree = bool(subtree)
+
+
+def _walk(ob):
+    # ob and its sublocations, each before its own sublocations, in
+    # the order zope.container dispatches to them.
+    result = []
+    stack = [ob]
+    while stack:
+        ob = stack.pop()
+        result.append(ob)
+        sublocations = ISublocations(ob, None)
+        if sublocations is not None:
+            stack.extend(reversed(list(sublocations.sublocations())))
+    return result
+
+
+def _handleSubtree(ob, event, handler):
+    # The first time we see event, call handler with the subtree of
+    # event.object if ob is in it. Return whether ob was handled that
+    # way.
+    try:
+        handled = _subtrees.get(event)
+    except TypeError:
+        # Can't be weakly referenced
+        return False
+    if handled is None:
+        obs = [sub for sub in _walk(event.object)
+               if ILocation.providedBy(sub)]
+        handled = {id(sub) for sub in obs}
+        if id(ob) not in handled:
+            handled = set()
+        _subtrees[event] = handled
+        if handled:
+            handler(obs, event)
+    return id(ob) in handled
+
+
+# Set by setKeyReferenceMode()
+_keyMode = 'adapt'
+
+_KEY_MODES = ('adapt', 'persistent', 'none')
+
+
+def setKeyReferenceMode(mode='adapt'):
+    """
+    Choose how the subscribers decide whether an object can have ids.
+
+    ``'adapt'``
+        The default. Like :mod:`zope.intid`, the object is adapted to
+        :class:`~zope.keyreference.interfaces.IKeyReference`, and is
+        skipped if it can't be. The adapter to use for each interface
+        specification is looked up once and cached until the
+        component registry changes, but it is still called for each
+        object; for persistent objects, it adds new ones to the
+        connection of their parent.
+
+    ``'persistent'``
+        Objects are only checked to be persistent (to have a
+        ``_p_jar`` attribute) without adapting them. New objects get
+        a jar and an oid when their parent is stored, or when a
+        utility with an oid index registers them.
+
+    ``'none'``
+        Every object the subscribers are called for is registered.
+
+    The last two save the cost of the adaptation for each object,
+    which matters for bulk imports.
+
+    This can also be set with the ``subscriberOptions`` ZCML directive.
+    """
+    if mode not in _KEY_MODES:
+        raise ValueError('Unknown key reference mode %r' % (mode,))
+    global _keyMode
+    _keyMode = mode
+
+
+# A deque of trace records, set by setTracing()
+_trace = None
+
+
+def setTracing(size=1000):
+    """
+    Enable tracing, keeping the last *size* records, or disable it if
+    *size* is 0 or None.
+
+    While tracing, the events the subscribers notify are dispatched
+    to each handler in turn, and the time spent in each handler is
+    recorded. Handlers that only dispatch to other handlers, such as
+    :func:`intIdEventNotify`, are replaced by the handlers they would
+    call. Enabling tracing again starts a new trace.
+
+    The events notified by the utilities themselves aren't traced.
+    """
+    global _trace
+    _trace = collections.deque(maxlen=size) if size else None
+
+
+def getTrace():
+    """
+    Return a list of the trace records, oldest first.
+
+    Each record is a tuple ``(event_class, handler, seconds)``, where
+    *event_class* is the name of the class of the event and *handler*
+    the dotted name of the handler.
+    """
+    return list(_trace) if _trace is not None else []
+
+
+def summarizeTrace():
+    """
+    Return a dictionary mapping ``(event_class, handler)`` to a tuple
+    of the number of calls and the total seconds they took.
+    """
+    summary = {}
+    for event_class, handler, seconds in getTrace():
+        count, total = summary.get((event_class, handler), (0, 0))
+        summary[event_class, handler] = (count + 1, total + seconds)
+    return summary
+
+
+def _name(handler):
+    name = getattr(handler, '__qualname__', None) or repr(handler)
+    module = getattr(handler, '__module__', None)
+    return name if module is None else module + '.' + name
+
+
+def _timed(event, handler, *args):
+    start = perf_counter()
+    try:
+        handler(*args)
+    finally:
+        _trace.append((type(event).__name__, _name(handler),
+                       perf_counter() - start))
+
+
+def _tracedHandle(event, objects):
+    # Like zope.component.handle(), but timing each handler.
+    registry = component.getSiteManager().adapters
+    for handler in registry.subscriptions(map(providedBy, objects), None):
+        if handler is intIdEventNotify or handler is objectEventNotify:
+            # These re-dispatch for the object of the event.
+            if objects == (event,):
+                _tracedHandle(event, (event.object, event))
+        else:
+            _timed(event, handler, *objects)
+
+
+def _dispatch(event):
+    if _trace is None:
+        notify(event)
+        return
+    for subscriber in list(zope.event.subscribers):
+        if subscriber is dispatch:
+            _tracedHandle(event, (event,))
+        else:
+            _timed(event, subscriber, event)
+
+
+class _DeferredIds:
+    # The registrations and unregistrations made by the subscribers
+    # during a transaction, keyed by (utility, id).
+
+    def __init__(self):
+        self.added = {}
+        self.removed = {}
+
+    def add(self, utility, uid, ob):
+        key = (utility, uid)
+        if self.removed.get(key) is ob:
+            del self.removed[key]
+        else:
+            self.added[key] = ob
+
+    def remove(self, utility, uid, ob):
+        key = (utility, uid)
+        if self.added.get(key) is ob:
+            del self.added[key]
+        else:
+            self.removed[key] = ob
+
+    @staticmethod
+    def triples(mapping):
+        return [(utility, uid, ob) for (utility, uid), ob in mapping.items()]
+
+
+def _transaction(ob, utilities):
+    # The current transaction of the connection of ob, or of the
+    # first utility that has one, or of the thread.
+    for candidate in (ob,) + tuple(utilities):
+        jar = getattr(candidate, '_p_jar', None)
+        if jar is not None:
+            return jar.transaction_manager.get()
+    return transaction.get()
+
+
+def _deferredIds(ob, utilities):
+    txn = _transaction(ob, utilities)
+    try:
+        deferred = txn.data(_DeferredIds)
+    except KeyError:
+        deferred = None
+    if deferred is None:
+        deferred = _DeferredIds()
+        txn.set_data(_DeferredIds, deferred)
+        txn.addBeforeCommitHook(_notifyDeferred, (txn,))
+    return deferred
+
+
+def _notifyDeferred(txn):
+    deferred = txn.data(_DeferredIds)
+    # Anything the handlers register goes into a new batch, with
+    # its own hook.
+    txn.set_data(_DeferredIds, None)
+    if deferred.added or deferred.removed:
+        _dispatch(DeferredIdsEvent(deferred.triples(deferred.added),
+                                   deferred.triples(deferred.removed)))
+
+
+def _registryCache(registry):
+    # Return a dictionary of things computed from *registry*.
+    #
+    # zope.interface increments the ``_generation`` of a registry
+    # whenever something is registered in it or its bases change.
+    # Like the verifying lookups of zope.interface, we compare the
+    # generations of the registry and all its bases to those the
+    # cache was made with, which also catches changes made to a
+    # persistent base registry by other processes.
+    #
+    # The cache is kept in a volatile attribute of the registry, so it
+    # goes away with the registry and isn't stored if that's
+    # persistent.
+    generations = [r._generation for r in registry.ro]
+    cached = getattr(registry, '_v_zc_intid_cache', None)
+    if cached is None or cached[0] != generations:
+        cached = (generations, {})
+        registry._v_zc_intid_cache = cached
+    return cached[1]
+
+
+def _utilities():
+    # zope.interface already caches this lookup; caching the result
+    # here as well would only add the cost of checking the cache.
+    return tuple(component.getAllUtilitiesRegisteredFor(IIntIds))
+
+
+def _hasHandlers(event_class, ob):
+    # Would notifying an event of the given class for *ob* call
+    # anything?
+    subscribers = zope.event.subscribers
+    if len(subscribers) != 1 or subscribers[0] is not dispatch:
+        # Something other than the component registry is listening
+        # (or nothing at all is).
+        return bool(subscribers)
+    registry = component.getSiteManager().adapters
+    cache = _registryCache(registry)
+    provided = providedBy(ob)
+    key = (event_class, provided)
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    event_provided = implementedBy(event_class)
+    handlers = registry.subscriptions((event_provided,), None)
+    # intIdEventNotify re-dispatches to handlers for the object and
+    # event; anything else is a handler in its own right.
+    result = any(handler is not intIdEventNotify for handler in handlers)
+    if not result and handlers:
+        result = bool(registry.subscriptions((provided, event_provided),
+                                             None))
+    cache[key] = result
+    return result
+
+
+def _notify(event_class, ob, *args):
+    if not _lean or _hasHandlers(event_class, ob):
+        _dispatch(event_class(ob, *args))
+
+
+def _providesKeyReference(ob):
+    return ob
+
+
+def _key(ob):
+    # Return the key reference of ob, or if the mode doesn't adapt,
+    # something else that isn't None if ob can have ids. Return None
+    # if it can't.
+    if _keyMode == 'persistent':
+        return ob if hasattr(ob, '_p_jar') else None
+    if _keyMode == 'none':
+        return ob
+    if hasattr(type(ob), '__conform__'):
+        # It could adapt itself.
+        return IKeyReference(ob, None)
+    # What IKeyReference(ob, None) does, with the adapter factory
+    # cached per specification.
+    registry = component.getSiteManager().adapters
+    cache = _registryCache(registry)
+    provided = providedBy(ob)
+    key = (IKeyReference, provided)
+    try:
+        factory = cache[key]
+    except KeyError:
+        if provided.isOrExtends(IKeyReference):
+            factory = _providesKeyReference
+        else:
+            factory = registry.lookup((provided,), IKeyReference)
+        cache[key] = factory
+    return factory(ob) if factory is not None else None
+
+
+# Whether the default IntIds.accepts takes objects providing a
+# specification, by (interfaces, specification). The answer doesn't
+# depend on any registry, so unlike _registryCache this needs no
+# checking; it is only emptied if it gets large, since specifications
+# can be made on the fly.
+_acceptsCache = {}
+_ACCEPTS_CACHE_SIZE = 1000
+
+
+def _accepts(utility, ob):
+    # Should ob be registered in utility?
+    accepts = getattr(type(utility), 'accepts', None)
+    if accepts is None:
+        return True
+    if accepts is not IntIds.accepts:
+        # Overridden; it may look at more than the interfaces.
+        return accepts(utility, ob)
+    interfaces = utility.interfaces
+    if interfaces is None:
+        return True
+    key = (interfaces, providedBy(ob))
+    try:
+        return _acceptsCache[key]
+    except KeyError:
+        if len(_acceptsCache) >= _ACCEPTS_CACHE_SIZE:
+            _acceptsCache.clear()
+        result = _acceptsCache[key] = any(key[1].isOrExtends(iface)
+                                          for iface in interfaces)
+        return result
 
 
 def _utilities_and_key(ob):
-    utilities = tuple(component.getAllUtilitiesRegisteredFor(IIntIds))
+    utilities = _utilities()
     # Don't even bother trying to adapt if no utilities
-    return utilities, IKeyReference(ob, None) if utilities else None
+    return utilities, _key(ob) if utilities else None
+
+
+def _addSubtree(obs, event):
+    utilities = _utilities()
+    if not utilities:
+        return
+    obs = [ob for ob in obs if _key(ob) is not None]
+    if not obs:
+        return
+    idmaps = [{} for _ in obs]
+    for utility in utilities:
+        accepted = [i for i, ob in enumerate(obs) if _accepts(utility, ob)]
+        uids = utility.registerMany([obs[i] for i in accepted])
+        for i, uid in zip(accepted, uids):
+            idmaps[i][utility] = uid
+
+    if _deferred:
+        deferred = _deferredIds(obs[0], utilities)
+        for ob, idmap in zip(obs, idmaps):
+            for utility, uid in idmap.items():
+                deferred.add(utility, uid, ob)
+        return
+
+    for ob, idmap in zip(obs, idmaps):
+        if idmap:
+            _notify(IntIdAddedEvent, ob, event, idmap)
+            _notify(AfterIdAddedEvent, ob, event, idmap)
+
+
+def _removeSubtree(obs, event):
+    utilities = _utilities()
+    if not utilities:
+        return
+    obs = [ob for ob in obs if _key(ob) is not None]
+    if not obs:
+        return
+    # One lookup of each object in each utility
+    uids = [utility.queryIds(obs) for utility in utilities]
+
+    if _deferred:
+        deferred = _deferredIds(obs[0], utilities)
+        for utility, utility_uids in zip(utilities, uids):
+            for ob, uid in zip(obs, utility_uids):
+                if uid is not None:
+                    deferred.remove(utility, uid, ob)
+    else:
+        for i, ob in enumerate(obs):
+            if any(utility_uids[i] is not None for utility_uids in uids):
+                _notify(BeforeIdRemovedEvent, ob, event)
+                _notify(IntIdRemovedEvent, ob, event)
+
+    for utility, utility_uids in zip(utilities, uids):
+        utility.unregisterMany([ob for ob, uid in zip(obs, utility_uids)
+                                if uid is not None])
 
 
 @component.adapter(ILocation, IObjectAddedEvent)
@@ -59,19 +543,34 @@ def addIntIdSubscriber(ob, event):
     followed by one single :class:`zc.intid.interfaces.IAfterIdAddedEvent`;
     this gives a guaranteed order such that :mod:`zope.catalog` and other Zope
     event listeners will have fired.
+
+    Utilities whose ``accepts`` method (see
+    :class:`zc.intid.interfaces.IIntIdsSubclass`) returns false for the
+    object are skipped, and if there are no others, nothing is done.
     """
+    if _subtree and _handleSubtree(ob, event, _addSubtree):
+        return
     utilities, key = _utilities_and_key(ob)
     if not utilities or key is None:
         return
+    utilities = [utility for utility in utilities if _accepts(utility, ob)]
+    if not utilities:
+        return
 
     idmap = {}
 
     for utility in utilities:
         idmap[utility] = utility.register(ob)
 
+    if _deferred:
+        deferred = _deferredIds(ob, utilities)
+        for utility, uid in idmap.items():
+            deferred.add(utility, uid, ob)
+        return
+
     # Notify the catalogs that this object was added.
-    notify(IntIdAddedEvent(ob, event, idmap))
-    notify(AfterIdAddedEvent(ob, event, idmap))
+    _notify(IntIdAddedEvent, ob, event, idmap)
+    _notify(AfterIdAddedEvent, ob, event, idmap)
 
 
 @component.adapter(ILocation, IObjectRemovedEvent)
@@ -90,11 +589,25 @@ def removeIntIdSubscriber(ob, event):
     :class:`zc.intid.interfaces.IIdRemovedEvent`. This gives a
     guaranteed order such that :mod:`zope.catalog` and other Zope
     event listeners will have fired.
+
+    The object is unregistered from every utility it is registered
+    in, whether or not the utility accepts it.
     """
+    if _subtree and _handleSubtree(ob, event, _removeSubtree):
+        return
     utilities, key = _utilities_and_key(ob)
     if not utilities or key is None:
         return
 
+    if _deferred:
+        deferred = _deferredIds(ob, utilities)
+        for utility in utilities:
+            uid = utility.queryId(ob)
+            if uid is not None:
+                deferred.remove(utility, uid, ob)
+                utility.unregister(ob)
+        return
+
     # Notify the catalogs that this object is about to be removed,
     # if we actually find something to remove
     fired_event = False
@@ -102,8 +615,8 @@ def removeIntIdSubscriber(ob, event):
     for utility in utilities:
         if not fired_event and utility.queryId(ob) is not None:
             fired_event = True
-            notify(BeforeIdRemovedEvent(ob, event))
-            notify(IntIdRemovedEvent(ob, event))
+            _notify(BeforeIdRemovedEvent, ob, event)
+            _notify(IntIdRemovedEvent, ob, event)
         try:
             utility.unregister(ob)
         except KeyError:  # pragma: no cover
@@ -0,0 +1,511 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the id allocators.
+
+"""
+
+import os
+import unittest
+from unittest import mock
+
+import BTrees
+import persistent
+import transaction
+from zope.interface.verify import verifyObject
+
+from zc.intid import allocation
+from zc.intid.interfaces import IIdAllocator
+from zc.intid.interfaces import IIdSpaceFillEvent
+from zc.intid.utility import IntIds
+
+
+class P(persistent.Persistent):
+    pass
+
+
+def _twoConnections(test, intids):
+    # Store intids and return its copies in two connections of the
+    # same database.
+    import ZODB
+    db = ZODB.DB(None)
+    conn1 = db.open()
+    conn1.root()['intids'] = intids
+    transaction.commit()
+    tm2 = transaction.TransactionManager()
+    conn2 = db.open(tm2)
+
+    def cleanUp():
+        transaction.abort()
+        tm2.abort()
+        conn1.close()
+        conn2.close()
+        db.close()
+    test.addCleanup(cleanUp)
+    return conn1.root()['intids'], conn2.root()['intids']
+
+
+def _countLengths(test):
+    # Record the calls of IntIds.__len__ during the test.
+    calls = []
+    real = IntIds.__len__
+
+    def __len__(self):
+        calls.append(self)
+        return real(self)
+    patcher = mock.patch.object(IntIds, '__len__', __len__)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return calls
+
+
+class TestStripeAllocator(unittest.TestCase):
+
+    family = BTrees.family32
+
+    def setUp(self):
+        allocation.setProcessKey('test')
+
+    def tearDown(self):
+        allocation.setProcessKey(None)
+        allocation._cursors.clear()
+        allocation._slots.clear()
+
+    def createIntIds(self, stripe_size=None):
+        return IntIds('iid', family=self.family,
+                      allocator=allocation.StripeAllocator(stripe_size))
+
+    def test_interface(self):
+        verifyObject(IIdAllocator, allocation.StripeAllocator())
+
+    def test_process_key(self):
+        allocation.setProcessKey(None)
+        self.assertIn(':', allocation.getProcessKey())
+        allocation.setProcessKey('client1')
+        self.assertEqual(allocation.getProcessKey(), 'client1')
+
+    def test_sequential_within_stripe(self):
+        u = self.createIntIds()
+        uids = [u.register(P()) for _ in range(60)]
+        start = uids[0]
+        self.assertEqual(start % 60, 0)
+        self.assertEqual(uids, list(range(start, start + 60)))
+        self.assertEqual(dict(u.allocator.stripes), {'test/0': start})
+
+        # Filling the stripe reserves a new one
+        uid = u.register(P())
+        self.assertEqual(uid % 60, 0)
+        self.assertNotEqual(uid, start)
+        self.assertEqual(dict(u.allocator.stripes), {'test/0': uid})
+
+    def test_registerMany(self):
+        u = self.createIntIds(stripe_size=10)
+        uids = u.registerMany([P() for _ in range(25)])
+        self.assertEqual(len(set(uids)), 25)
+
+    def test_skips_used_ids(self):
+        u = self.createIntIds(stripe_size=10)
+        uid = u.register(P())
+        u.refs[uid + 1] = P()
+        self.assertEqual(u.register(P()), uid + 2)
+
+    def test_resume_from_refs(self):
+        u = self.createIntIds(stripe_size=10)
+        uid = u.register(P())
+        u.register(P())
+        # Forget the cached position, as if after a restart
+        del u.allocator._v_state
+        self.assertEqual(u.register(P()), uid + 2)
+
+        # Even if the stripe had ids removed from its end
+        del u.allocator._v_state
+        u.unregister(u.refs[uid + 2])
+        u.unregister(u.refs[uid + 1])
+        self.assertEqual(u.register(P()), uid + 1)
+
+        # A stripe with only ids below it starts at its beginning
+        del u.allocator._v_state
+        u.unregister(u.refs[uid + 1])
+        u.unregister(u.refs[uid])
+        u.refs[uid - 5] = P()
+        self.assertEqual(u.register(P()), uid)
+
+    def test_claim_avoids_reserved_and_used_stripes(self):
+        u = self.createIntIds(stripe_size=10)
+        u.allocator.stripes['other'] = 0
+        u.refs[15] = P()
+        starts = iter([0, 1, 2])
+        u._randrange = lambda lo, hi: next(starts)
+        self.assertEqual(u.register(P()), 20)
+        self.assertEqual(u.allocator.stripes['test/0'], 20)
+
+    def test_claim_skips_reserved_stripes(self):
+        u = self.createIntIds(stripe_size=10)
+        stripes = u.allocator.stripes
+        count = (self.family.maxint + 1) // 10
+        stripes['other'] = (count - 1) * 10
+        stripes['another'] = 0
+        u._randrange = lambda lo, hi: count - 1
+        self.assertEqual(u.register(P()), 10)
+
+    def test_claim_all_reserved(self):
+        size = (self.family.maxint + 1) // 4
+        u = self.createIntIds(stripe_size=size)
+        for i in range(4):
+            u.allocator.stripes['other/%d' % i] = i * size
+        self.assertRaises(ValueError, u.register, P())
+
+    def test_claim_settles_for_partially_used(self):
+        u = self.createIntIds(stripe_size=10)
+        u.allocator.claim_attempts = 0
+        u.refs[10] = P()
+        u._randrange = lambda lo, hi: 1
+        self.assertEqual(u.register(P()), 11)
+
+    def _deadKey(self):
+        import socket
+        import subprocess
+        import sys
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        return '%s:%d/0' % (socket.gethostname(), process.pid)
+
+    @unittest.skipUnless(os.name == 'posix', 'Needs os.kill')
+    def test_isDead(self):
+        import socket
+        host = socket.gethostname()
+        self.assertTrue(allocation._isDead(self._deadKey()))
+        self.assertFalse(allocation._isDead('%s:%d/0' % (host, os.getpid())))
+        self.assertFalse(allocation._isDead('%s:1/0' % host))
+        self.assertFalse(allocation._isDead('elsewhere:1234/0'))
+        self.assertFalse(allocation._isDead('client1/0'))
+
+    @unittest.skipUnless(os.name == 'posix', 'Needs os.kill')
+    def test_claim_takes_over_dead_process(self):
+        u = self.createIntIds(stripe_size=10)
+        dead = self._deadKey()
+        u.allocator.stripes[dead] = 50
+        u.refs[52] = P()
+        self.assertEqual(u.register(P()), 53)
+        self.assertEqual(dict(u.allocator.stripes), {'test/0': 50})
+
+    def test_claim_drops_full_stripes(self):
+        u = self.createIntIds(stripe_size=10)
+        u.allocator.stripes['other'] = 50
+        u.allocator.stripes['elsewhere:1234/0'] = 70
+        u.refs[59] = P()
+        u.refs[79] = P()
+        u._randrange = lambda lo, hi: 2
+        self.assertEqual(u.register(P()), 20)
+        self.assertEqual(dict(u.allocator.stripes), {'test/0': 20})
+
+    def test_stripes_by_connection(self):
+        import ZODB
+        db = ZODB.DB(None)
+        conn1 = db.open()
+        conn1.root()['intids'] = self.createIntIds()
+        transaction.commit()
+
+        tm2 = transaction.TransactionManager()
+        conn2 = db.open(tm2)
+        u1 = conn1.root()['intids']
+        uid1 = u1.register(P())
+        transaction.commit()
+
+        tm2.begin()
+        u2 = conn2.root()['intids']
+        uid2 = u2.register(P())
+        self.assertNotEqual(uid1 // 60, uid2 // 60)
+        tm2.commit()
+        self.assertEqual(len(u2.allocator.stripes), 2)
+
+        # Ghosting the utility and allocator keeps the position
+        transaction.begin()
+        conn1.cacheMinimize()
+        self.assertEqual(u1.allocator._p_status, 'ghost')
+        self.assertEqual(u1.register(P()), uid1 + 1)
+        transaction.commit()
+
+        # And so does a new database (a process restart) using
+        # the same storage.
+        conn1.close()
+        conn2.close()
+        storage = db.storage
+        allocation._cursors.clear()
+        allocation._slots.clear()
+        db = ZODB.DB(storage)
+        conn = db.open()
+        u = conn.root()['intids']
+        self.assertEqual(u.register(P()), uid1 + 2)
+        transaction.abort()
+        conn.close()
+        db.close()
+
+
+class TestStripeAllocator64(TestStripeAllocator):
+
+    family = BTrees.family64
+
+
+class TestBloomFilterAllocator(unittest.TestCase):
+
+    family = BTrees.family32
+
+    def tearDown(self):
+        allocation._cursors.clear()
+
+    def createIntIds(self):
+        return IntIds('iid', family=self.family,
+                      allocator=allocation.BloomFilterAllocator())
+
+    def test_interface(self):
+        verifyObject(IIdAllocator, allocation.BloomFilterAllocator())
+
+    def test_filter(self):
+        bloom = allocation._BloomFilter(1000, 0.01)
+        for i in range(0, 2000, 2):
+            bloom.add(i)
+        self.assertEqual(bloom.count, 1000)
+        # No false negatives
+        self.assertTrue(all(i in bloom for i in range(0, 2000, 2)))
+        false = sum(1 for i in range(1, 20001, 2) if i in bloom)
+        self.assertLess(false, 10000 * 0.02)
+
+    def test_skips_used_ids(self):
+        u = self.createIntIds()
+        for uid in range(100, 110):
+            u.refs[uid] = P()
+        starts = iter([100, 105, 200])
+        u._randrange = lambda lo, hi: next(starts)
+        self.assertEqual(u.register(P()), 200)
+        self.assertEqual(u.register(P()), 201)
+        stats = u.allocator.stats()
+        self.assertEqual(stats['allocations'], 2)
+        self.assertEqual(stats['probes'], 4)
+        # The used ids were ruled out without looking them up
+        self.assertEqual(stats['filtered'], 2)
+        self.assertEqual(stats['lookups'], 2)
+        self.assertEqual(stats['rebuilds'], 1)
+
+    def test_ids_used_elsewhere(self):
+        u = self.createIntIds()
+        u.register(P())
+        # Registered by another process
+        u.refs[500] = P()
+        starts = iter([500, 600])
+        u._randrange = lambda lo, hi: next(starts)
+        u._v_nextid = None
+        u.allocator._state().nextids.clear()
+        self.assertEqual(u.register(P()), 600)
+        self.assertIn(500, u.allocator._state().filter)
+        self.assertEqual(u.allocator.stats()['lookups'], 3)
+
+    def test_rebuild(self):
+        u = self.createIntIds()
+        u.allocator.min_capacity = 10
+        for _ in range(11):
+            u.register(P())
+        self.assertEqual(u.allocator.stats()['rebuilds'], 1)
+        u.register(P())
+        self.assertEqual(u.allocator.stats()['rebuilds'], 2)
+        self.assertEqual(u.allocator._state().filter.capacity, 22)
+
+    def test_counted_when_building(self):
+        # Without the length counter, len() reads all of refs, so the
+        # filter only calls it when it is built.
+        u = self.createIntIds()
+        u._length = None
+        lengths = _countLengths(self)
+        u.registerMany([P() for _ in range(20)])
+        self.assertEqual(len(lengths), 1)
+
+    def test_state_by_database(self):
+        import ZODB
+        db = ZODB.DB(None)
+        conn = db.open()
+        u = conn.root()['intids'] = self.createIntIds()
+        transaction.commit()
+        u.register(P())
+        transaction.commit()
+        # Ghosting the allocator keeps the filter
+        conn.cacheMinimize()
+        u.register(P())
+        self.assertEqual(u.allocator.stats()['allocations'], 2)
+        self.assertEqual(u.allocator.stats()['rebuilds'], 1)
+        transaction.abort()
+        conn.close()
+        db.close()
+
+    def test_cursor_by_connection(self):
+        # Each connection allocates from its own position, so threads
+        # don't allocate the same ids.
+        u1, u2 = _twoConnections(self, self.createIntIds())
+        u1._randrange = lambda lo, hi: 100
+        u2._randrange = lambda lo, hi: 500
+        self.assertEqual([u.register(P()) for u in (u1, u2, u1, u2)],
+                         [100, 500, 101, 501])
+        # The filter is shared
+        self.assertEqual(u1.allocator.stats()['rebuilds'], 1)
+
+
+class TestBloomFilterAllocator64(TestBloomFilterAllocator):
+
+    family = BTrees.family64
+
+
+class TestFreeRangeAllocator(unittest.TestCase):
+
+    family = BTrees.family32
+
+    def tearDown(self):
+        allocation._cursors.clear()
+
+    def createIntIds(self, **kw):
+        kw.setdefault('region_size', 100)
+        kw.setdefault('min_range', 10)
+        u = IntIds('iid', family=self.family,
+                   allocator=allocation.FreeRangeAllocator(**kw))
+        self.regions = []
+
+        def randrange(lo, hi):
+            self.regions.append(hi)
+            return 0
+        u._randrange = randrange
+        return u
+
+    def test_interface(self):
+        verifyObject(IIdAllocator, allocation.FreeRangeAllocator())
+
+    def test_clustered(self):
+        u = self.createIntIds()
+        for uid in list(range(10)) + [15, 50]:
+            u.refs[uid] = P()
+        uids = [u.register(P()) for _ in range(5)]
+        # The gap between 10 and 15 is too small.
+        self.assertEqual(uids, [16, 17, 18, 19, 20])
+        self.assertEqual(self.regions, [self.family.maxint // 100 + 1])
+        stats = u.allocator.stats()
+        self.assertEqual(stats['scans'], 1)
+        self.assertEqual(stats['scanned'], 12)
+        self.assertEqual(stats['lookups'], 5)
+
+        # Ids taken by someone else are skipped
+        u.refs[21] = P()
+        self.assertEqual(u.register(P()), 22)
+
+        # The next range follows
+        for uid in range(23, 50):
+            u.refs[uid] = P()
+        self.assertEqual(u.register(P()), 51)
+        self.assertEqual(u.allocator.stats()['scans'], 1)
+
+    def test_small_ranges(self):
+        u = self.createIntIds()
+        for uid in range(100):
+            if uid not in (5, 7):
+                u.refs[uid] = P()
+        self.assertEqual([u.register(P()) for _ in range(2)], [5, 7])
+
+    def test_full_regions(self):
+        u = self.createIntIds()
+        u.allocator.scan_attempts = 3
+        for uid in range(200):
+            u.refs[uid] = P()
+        self.assertEqual(u.register(P()), 200)
+        stats = u.allocator.stats()
+        self.assertEqual(stats['scans'], 5)
+        self.assertEqual(len(self.regions), 3)
+
+    def test_no_scan_attempts(self):
+        u = self.createIntIds()
+        u.allocator.scan_attempts = 0
+        for uid in range(100):
+            u.refs[uid] = P()
+        # Scanning in order starts after a random region
+        self.assertEqual(u.register(P()), 100)
+        self.assertEqual(len(self.regions), 1)
+        self.assertEqual(u.allocator.stats()['scans'], 1)
+
+    def test_ranges_by_connection(self):
+        # Each connection allocates from its own ranges, so threads
+        # don't allocate the same ids.
+        u = self.createIntIds()
+        del u._randrange
+        u1, u2 = _twoConnections(self, u)
+        u1._randrange = lambda lo, hi: 1
+        u2._randrange = lambda lo, hi: 5
+        self.assertEqual([u.register(P()) for u in (u1, u2, u1, u2)],
+                         [100, 500, 101, 501])
+
+    def test_fill_events(self):
+        import zope.event
+        events = []
+
+        def handler(event):
+            if IIdSpaceFillEvent.providedBy(event):
+                events.append(event)
+        zope.event.subscribers.append(handler)
+        self.addCleanup(zope.event.subscribers.remove, handler)
+        space = self.family.maxint + 1
+        u = self.createIntIds(thresholds=(2 / space, 4 / space))
+        for _ in range(6):
+            u.register(P())
+        self.assertEqual([e.threshold for e in events],
+                         [2 / space, 4 / space])
+        self.assertIs(events[0].idmanager, u)
+        self.assertEqual(events[0].fill, 2 / space)
+
+        # After going back down, it warns again
+        for uid in list(u.refs)[:3]:
+            u.unregister(u.refs[uid])
+        u.register(P())
+        u.register(P())
+        self.assertEqual(len(events), 3)
+
+    def test_fill_counted_when_scanning(self):
+        lengths = _countLengths(self)
+        u = self.createIntIds()
+        regions = iter(range(10))
+        u._randrange = lambda lo, hi: next(regions)
+        u.registerMany([P() for _ in range(30)])
+        # The length counter is used
+        self.assertEqual(lengths, [])
+
+        # Without it, len() reads all of refs, so the fill is only
+        # checked before scanning.
+        u._length = None
+        u.registerMany([P() for _ in range(150)])
+        self.assertEqual(len(lengths), 1)
+        self.assertEqual(u.allocator.stats()['scans'], 2)
+
+
+class TestFreeRangeAllocator64(TestFreeRangeAllocator):
+
+    family = BTrees.family64
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestStripeAllocator),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestStripeAllocator64),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestBloomFilterAllocator),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestBloomFilterAllocator64),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestFreeRangeAllocator),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestFreeRangeAllocator64),
+    ])
@@ -0,0 +1,187 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the conflict diagnostics.
+
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import persistent
+import transaction
+
+from zc.intid import diagnostics
+from zc.intid.allocation import StripeAllocator
+from zc.intid.utility import IntIds
+
+
+class Content(persistent.Persistent):
+    pass
+
+
+class TestDiagnostics(unittest.TestCase):
+
+    def setUp(self):
+        import ZODB
+        self.db = ZODB.DB(None)
+        self.conn = self.db.open()
+        self.root = self.conn.root()
+        self.root['intids'] = self.intids = IntIds(
+            'iid', allocator=StripeAllocator(), index_oids=True)
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+
+    def _fill(self, count):
+        objects = [Content() for _ in range(count)]
+        self.intids.registerMany(objects)
+        transaction.commit()
+        self.conn.cacheMinimize()
+        return objects
+
+    def test_small(self):
+        self._fill(5)
+        found = diagnostics.nodes(self.intids)
+        kinds = sorted((node.kind, node.tree) for node in found.values())
+        self.assertEqual(kinds, [
+            ('allocator', None),
+            ('length', None),
+            ('tree', 'oids'),
+            ('tree', 'refs'),
+            ('utility', None),
+        ])
+        refs = found[self.intids.refs._p_oid]
+        self.assertEqual(refs.size, 5)
+        self.assertEqual(refs.min, self.intids.refs.minKey())
+        self.assertEqual(refs.max, self.intids.refs.maxKey())
+        self.assertEqual(refs.fill, 5 / 60)
+
+    def test_empty(self):
+        # Without an allocator or an oid index
+        self.root['intids'] = intids = IntIds('iid')
+        transaction.commit()
+        found = diagnostics.nodes(intids)
+        self.assertEqual(sorted(node.kind for node in found.values()),
+                         ['length', 'tree', 'utility'])
+        refs = found[intids.refs._p_oid]
+        self.assertEqual((refs.min, refs.size), (None, 0))
+        self.assertEqual(diagnostics.describe(refs), 'refs tree (empty)')
+
+    def test_buckets(self):
+        self._fill(1000)
+        found = diagnostics.nodes(self.intids)
+        buckets = sorted((node for node in found.values()
+                          if node.kind == 'bucket' and node.tree == 'refs'),
+                         key=lambda node: node.min)
+        self.assertGreater(len(buckets), 1)
+        self.assertEqual(sum(node.size for node in buckets), 1000)
+        self.assertEqual(buckets[0].min, self.intids.refs.minKey())
+        self.assertEqual(buckets[-1].max, self.intids.refs.maxKey())
+        for node, next_node in zip(buckets, buckets[1:]):
+            self.assertLess(node.max, next_node.min)
+        refs = found[self.intids.refs._p_oid]
+        self.assertEqual(refs.size, len(buckets))
+        self.assertEqual(diagnostics.describe(buckets[0]),
+                         'refs bucket {!r}..{!r} ({} items, {:.0%} full)'
+                         .format(buckets[0].min, buckets[0].max,
+                                 buckets[0].size, buckets[0].fill))
+
+    def test_parseOids(self):
+        lines = [
+            'ConflictError: database conflict error (oid 0x2a, class '
+            'BTrees.IOBTree.IOBucket, serial this txn started with 0x01)',
+            'nothing here',
+            'database read conflict error (oid 0x012a) (oid 0x03)',
+        ]
+        self.assertEqual(list(diagnostics.parseOids(lines)), [
+            b'\x00' * 7 + b'\x2a',
+            b'\x00' * 6 + b'\x01\x2a',
+            b'\x00' * 7 + b'\x03',
+        ])
+
+    def test_attribute(self):
+        self._fill(1000)
+        bucket = self.intids.refs.__getstate__()[1]
+        log = ['conflict (oid 0x%x)' % int.from_bytes(oid, 'big')
+               for oid in [bucket._p_oid] * 3 + [self.intids._p_oid,
+                                                 b'\xff' * 8]]
+        counts = diagnostics.attribute(self.intids,
+                                       diagnostics.parseOids(log))
+        self.assertEqual([(node.kind, count) for node, count in counts],
+                         [('bucket', 3), ('utility', 1), ('other', 1)])
+        self.assertEqual(counts[0][0].min, bucket.minKey())
+        self.assertEqual(diagnostics.describe(counts[1][0]), 'utility')
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        import ZODB.config
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.zconfig = os.path.join(tmp, 'zodb.conf')
+        with open(self.zconfig, 'w') as f:
+            f.write('<zodb>\n  <filestorage>\n    path %s\n'
+                    '  </filestorage>\n</zodb>\n'
+                    % os.path.join(tmp, 'Data.fs'))
+        db = ZODB.config.databaseFromURL(self.zconfig)
+        with db.transaction() as conn:
+            conn.root()['intids'] = intids = IntIds('iid')
+            intids.registerMany([Content() for _ in range(5)])
+        with db.transaction() as conn:
+            intids = conn.root()['intids']
+            oids = [intids.refs._p_oid] * 2 + [intids._p_oid]
+        db.close()
+        self.log = os.path.join(tmp, 'conflicts.log')
+        with open(self.log, 'w') as f:
+            for oid in oids:
+                f.write('ConflictError: database conflict error (oid 0x%x)\n'
+                        % int.from_bytes(oid, 'big'))
+
+    def _main(self, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            diagnostics.main(['--zconfig', self.zconfig] + list(args))
+        return out.getvalue().splitlines()
+
+    def test_logs(self):
+        output = self._main('intids', self.log)
+        self.assertEqual(len(output), 2)
+        self.assertTrue(output[0].startswith('       2  refs tree '))
+        self.assertTrue(output[0].endswith(' (5 children, 8% full)'))
+        self.assertEqual(output[1], '       1  utility')
+        self.assertEqual(self._main('--top', '1', 'intids', self.log),
+                         output[:1])
+
+    def test_stdin(self):
+        self.addCleanup(setattr, sys, 'stdin', sys.stdin)
+        with open(self.log) as f:
+            sys.stdin = io.StringIO(f.read())
+        self.assertEqual(self._main('intids')[1], '       1  utility')
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestDiagnostics),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestMain),
+    ])
@@ -0,0 +1,361 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the integrity checker.
+
+"""
+
+import contextlib
+import functools
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import persistent
+import transaction
+
+from zc.intid import integrity
+from zc.intid.utility import IntIds
+
+
+class Content(persistent.Persistent):
+    pass
+
+
+class Plain:
+    pass
+
+
+class Missing(Content):
+
+    def _p_activate(self):
+        from ZODB.POSException import POSKeyError
+        raise POSKeyError(self._p_oid)
+
+
+class TestIntegrity(unittest.TestCase):
+
+    index_oids = False
+
+    def setUp(self):
+        import ZODB
+        self.db = ZODB.DB(None)
+        self.conn = self.db.open()
+        self.root = self.conn.root()
+        self.root['intids'] = self.intids = IntIds(
+            'iid', index_oids=self.index_oids)
+        transaction.commit()
+        self.objects = [Content() for _ in range(20)]
+        self.uids = self.intids.registerMany(self.objects)
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+
+    def _check(self, orphaned=True, **kw):
+        # With orphaned false, leave out the orphaned oids that the
+        # other problems cause when there is an oid index.
+        transaction.commit()
+        return sorted((p for p in integrity.check(self.db, 'intids',
+                                                  processes=0, **kw)
+                       if orphaned or p.kind != 'orphaned'),
+                      key=lambda p: p.uid)
+
+    def test_clean(self):
+        self.assertEqual(self._check(), [])
+
+    def test_processes_need_open_db(self):
+        # Raised when called, not when iterating
+        with self.assertRaises(ValueError):
+            integrity.check(self.db, 'intids')
+
+    def test_mismatch(self):
+        ob = self.objects[0]
+        self.intids._storeId(ob, 12345)
+        problems = self._check(orphaned=False)
+        self.assertEqual(problems,
+                         [integrity.Problem('mismatch', self.uids[0],
+                                            ob._p_oid, 12345)])
+        self.assertEqual(integrity.repair(self.intids, problems), 1)
+        self.assertEqual(self.intids.getId(ob), self.uids[0])
+        self.assertEqual(self._check(), [])
+
+    def test_unrecorded(self):
+        ob = Content()
+        self.conn.add(ob)
+        self.intids.refs[12345] = ob
+        self.intids._changeLength(1)
+        problems = self._check()
+        self.assertEqual(problems, [integrity.Problem('mismatch', 12345,
+                                                      ob._p_oid, None)])
+        integrity.repair(self.intids, problems)
+        self.assertEqual(self.intids.getId(ob), 12345)
+
+    def test_registered_twice(self):
+        ob = self.objects[0]
+        self.intids.refs[12345] = ob
+        self.intids._changeLength(1)
+        problems = self._check()
+        self.assertEqual(problems, [integrity.Problem('mismatch', 12345,
+                                                      ob._p_oid,
+                                                      self.uids[0])])
+        integrity.repair(self.intids, problems)
+        self.assertNotIn(12345, self.intids.refs)
+        self.assertEqual(self.intids.getId(ob), self.uids[0])
+        self.assertEqual(len(self.intids), 20)
+
+    def test_missing(self):
+        ob = Missing()
+        uid = self.intids.register(ob)
+        problems = self._check()
+        self.assertEqual(problems, [integrity.Problem('missing', uid,
+                                                      ob._p_oid, None)])
+        integrity.repair(self.intids, problems)
+        self.assertNotIn(uid, self.intids.refs)
+        self.assertEqual(len(self.intids), 20)
+        if self.intids.oids is not None:
+            self.assertNotIn(ob._p_oid, self.intids.oids)
+        self.assertEqual(self._check(), [])
+
+    def test_partitions(self):
+        for count in (1, 3, 50):
+            parts = integrity.partitions(self.intids, count)
+            ids = [p for p in parts if p[0] == 'ids']
+            self.assertLessEqual(len(ids), count)
+            self.assertEqual(ids[0][1], min(self.uids))
+            self.assertEqual(ids[-1][2], max(self.uids))
+            for (_, _, hi), (_, lo, _) in zip(ids, ids[1:]):
+                self.assertEqual(hi + 1, lo)
+            self.assertEqual(len(parts) > len(ids),
+                             self.intids.oids is not None)
+        self.intids._storeId(self.objects[0], 12345)
+        self.assertEqual(len(self._check(orphaned=False, count=7)), 1)
+
+    def test_largest_id(self):
+        # The last range ends at the largest id of the family
+        ob = Content()
+        self.conn.add(ob)
+        maxint = self.intids.family.maxint
+        self.intids._setRef(maxint, ob)
+        self.intids._storeId(ob, maxint)
+        for count in (1, 3):
+            self.assertEqual(self._check(count=count), [])
+        self.intids._storeId(ob, 1)
+        self.assertEqual([p.uid for p in self._check(orphaned=False)],
+                         [maxint])
+
+    def test_not_stored(self):
+        # Objects that aren't persistent, in a utility without a jar
+        intids = IntIds('iid', index_oids=self.index_oids)
+        objects = [Plain() for _ in range(3)]
+        uids = intids.registerMany(objects)
+        intids._storeId(objects[0], 12345)
+        maxint = intids.family.maxint
+        problems = list(integrity.checkIds(intids, 0, maxint))
+        self.assertEqual(problems, [
+            integrity.Problem('mismatch', uids[0], None, 12345)])
+        self.assertEqual(integrity.repair(intids, problems, batch_size=1),
+                         1)
+        self.assertEqual(list(integrity.checkIds(intids, 0, maxint)), [])
+
+    def test_empty(self):
+        self.assertEqual(integrity.partitions(IntIds('iid'), 4), [])
+
+    def test_gc(self):
+        self.addCleanup(setattr, integrity, 'GC_INTERVAL',
+                        integrity.GC_INTERVAL)
+        integrity.GC_INTERVAL = 3
+        self.assertEqual(self._check(count=1), [])
+
+    def test_orphaned_after_indexOids(self):
+        if self.intids.oids is None:
+            self.assertEqual(
+                list(integrity.checkOids(self.intids, b'', b'\xff' * 8)),
+                [])
+        self.intids.indexOids()
+        oid = b'\x00' * 7 + b'\x99'
+        self.intids.oids[oid] = 5
+        self.intids._attribute_oids.add(oid)
+        problems = self._check()
+        self.assertEqual(problems, [integrity.Problem('orphaned', 5, oid, 5)])
+        self.assertEqual(integrity.repair(self.intids, problems), 1)
+        self.assertNotIn(oid, self.intids._attribute_oids)
+
+    def test_repair_removed_meanwhile(self):
+        ob = self.objects[0]
+        self.intids._storeId(ob, 12345)
+        problems = self._check(orphaned=False)
+        self.intids._delRef(self.uids[0])
+        self.assertEqual(integrity.repair(self.intids, problems), 0)
+
+    def test_repair_fixed_meanwhile(self):
+        ob = self.objects[0]
+        self.intids._storeId(ob, 12345)
+        problems = self._check(orphaned=False)
+        self.intids._storeId(ob, self.uids[0])
+        self.assertEqual(integrity.repair(self.intids, problems), 0)
+
+    def test_repair_batches(self):
+        for ob in self.objects:
+            self.intids._storeId(ob, 1)
+        problems = self._check(orphaned=False)
+        self.assertEqual(len(problems), 20)
+        self.assertEqual(integrity.repair(self.intids, problems,
+                                          batch_size=3), 20)
+        self.assertEqual(self._check(), [])
+        transaction.abort()
+        self.assertEqual(self._check(), [])
+
+
+class TestIntegrityOids(TestIntegrity):
+
+    index_oids = True
+
+    def test_orphaned_and_mismatch(self):
+        ob = self.objects[0]
+        self.intids._storeId(ob, 12345)
+        # Both sides of the wrong entry in oids
+        problems = self._check()
+        self.assertEqual(problems, [
+            integrity.Problem('orphaned', 12345, ob._p_oid, 12345),
+            integrity.Problem('mismatch', self.uids[0], ob._p_oid, 12345),
+        ])
+        # Either repair fixes both
+        self.assertEqual(integrity.repair(self.intids, problems), 2)
+        self.assertEqual(self._check(), [])
+        self.intids._storeId(ob, 12345)
+        self.assertEqual(integrity.repair(self.intids, problems[::-1]), 1)
+        self.assertEqual(self._check(), [])
+
+    def test_orphaned_fixed_meanwhile(self):
+        ob = self.objects[0]
+        problem = integrity.Problem('orphaned', self.uids[0], ob._p_oid,
+                                    self.uids[0])
+        self.assertEqual(integrity.repair(self.intids, [problem]), 0)
+
+    def test_orphaned(self):
+        oid = b'\x00' * 7 + b'\x99'
+        self.intids.oids[oid] = 5
+        # An object that isn't registered
+        ob = Content()
+        self.conn.add(ob)
+        self.intids.oids[ob._p_oid] = self.uids[0]
+        problems = self._check()
+        self.assertEqual(sorted(problems), sorted([
+            integrity.Problem('orphaned', 5, oid, 5),
+            integrity.Problem('orphaned', self.uids[0], ob._p_oid,
+                              self.uids[0]),
+        ]))
+        self.assertEqual(integrity.repair(self.intids, problems), 2)
+        self.assertNotIn(oid, self.intids.oids)
+        self.assertNotIn(ob._p_oid, self.intids.oids)
+        self.assertEqual(self._check(), [])
+
+
+class TestFileStorage(unittest.TestCase):
+    # Checking a database configured by a file, as from the command
+    # line.
+
+    def setUp(self):
+        import ZODB.config
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.zconfig = os.path.join(tmp, 'zodb.conf')
+        with open(self.zconfig, 'w') as f:
+            f.write('<zodb>\n  <filestorage>\n    path %s\n'
+                    '  </filestorage>\n</zodb>\n'
+                    % os.path.join(tmp, 'Data.fs'))
+        db = ZODB.config.databaseFromURL(self.zconfig)
+        with db.transaction() as conn:
+            conn.root()['intids'] = intids = IntIds('iid')
+            objects = [Content() for _ in range(10)]
+            uids = intids.registerMany(objects)
+            intids._storeId(objects[0], 12345)
+        self.problem = integrity.Problem(
+            'mismatch', uids[0], objects[0]._p_oid, 12345)
+        db.close()
+
+    def test_openReadOnly_other_storages(self):
+        # Storages without a read_only option are opened as they are
+        with open(self.zconfig, 'w') as f:
+            f.write('<zodb>\n  <mappingstorage/>\n</zodb>\n')
+        integrity.openReadOnly(self.zconfig).close()
+
+    def _main(self, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            integrity.main(['--zconfig', self.zconfig] + list(args)
+                           + ['intids'])
+        return out.getvalue().splitlines()
+
+    def test_openReadOnly(self):
+        db = integrity.openReadOnly(self.zconfig)
+        try:
+            self.assertTrue(db.storage.isReadOnly())
+            with db.transaction() as conn:
+                self.assertEqual(len(conn.root()['intids']), 10)
+        finally:
+            db.close()
+
+    def test_processes(self):
+        open_db = functools.partial(integrity.openReadOnly, self.zconfig)
+        db = open_db()
+        try:
+            self.assertEqual(
+                list(integrity.check(db, 'intids', open_db, processes=1)),
+                [self.problem])
+        finally:
+            db.close()
+
+    def test_worker(self):
+        # What the worker processes do
+        integrity._initWorker(
+            functools.partial(integrity.openReadOnly, self.zconfig))
+        try:
+            self.assertEqual(
+                integrity._work(('intids', 'ids', 0, 2 ** 31 - 1)),
+                [self.problem])
+        finally:
+            integrity._db.close()
+            integrity._db = None
+
+    def test_main(self):
+        output = self._main('--processes', '0')
+        self.assertEqual(output, [
+            'mismatch id {} oid {!r} stored 12345'.format(
+                self.problem.uid, self.problem.oid),
+            '1 problems found',
+        ])
+        # Not repaired
+        self.assertEqual(self._main('--processes', '0')[-1],
+                         '1 problems found')
+
+    def test_main_repair(self):
+        output = self._main('--processes', '0', '--repair')
+        self.assertEqual(output[1:], ['1 problems found',
+                                      '1 problems repaired'])
+        self.assertEqual(self._main('--processes', '0', '--repair'),
+                         ['0 problems found'])
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestIntegrity),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestIntegrityOids),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestFileStorage),
+    ])
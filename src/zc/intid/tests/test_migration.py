@@ -0,0 +1,505 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the migrations.
+
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import BTrees
+import persistent
+import transaction
+import zope.intid
+from zope.keyreference.persistent import KeyReferenceToPersistent
+
+from zc.intid.migration import FamilyConversion
+from zc.intid.migration import Migration
+from zc.intid.migration import _traverse
+from zc.intid.migration import main
+from zc.intid.utility import IntIds
+
+
+class Content(persistent.Persistent):
+    pass
+
+
+class MissingRef(persistent.Persistent):
+    # A key reference whose object is gone
+
+    def __call__(self):
+        return None
+
+
+class ConflictingCommit:
+    # A data manager that makes committing the transaction it joined
+    # fail with a ConflictError.
+
+    transaction_manager = None
+
+    def sortKey(self):
+        return 'ConflictingCommit'
+
+    def abort(self, txn):
+        pass
+
+    tpc_begin = commit = tpc_abort = abort
+
+    def tpc_vote(self, txn):
+        from ZODB.POSException import ConflictError
+        raise ConflictError()
+
+
+class Site:
+
+    def __init__(self, sm):
+        self.sm = sm
+
+    def getSiteManager(self):
+        return self.sm
+
+
+class TestMigration(unittest.TestCase):
+
+    def setUp(self):
+        import ZODB
+        self.db = ZODB.DB(None)
+        self.conn = self.db.open()
+        self.root = self.conn.root()
+        self.root['source'] = self.source = zope.intid.IntIds()
+        self.root['target'] = self.target = IntIds('iid', index_oids=True)
+        self.root['objects'] = self.objects = BTrees.family32.OO.BTree()
+        transaction.commit()
+        for i in range(25):
+            self.objects[i] = ob = Content()
+            self.conn.add(ob)
+            self._register(ob, i * 10)
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+
+    def _register(self, ob, uid):
+        ref = KeyReferenceToPersistent(ob)
+        self.source.refs[uid] = ref
+        self.source.ids[ref] = uid
+
+    def test_run(self):
+        self.root['migration'] = migration = Migration(self.source,
+                                                       self.target)
+        reports = []
+        copied = migration.run(batch_size=10,
+                               report=lambda m, p: reports.append(p))
+        self.assertEqual(copied, 25)
+        self.assertEqual([p['copied'] for p in reports], [10, 20, 25])
+        self.assertEqual(reports[-1]['position'], 240)
+        self.assertTrue(migration.finished)
+        self.assertEqual(len(self.target), 25)
+        for i, ob in self.objects.items():
+            self.assertEqual(self.target.getId(ob), i * 10)
+            # The oid index was used
+            self.assertFalse(hasattr(ob, 'iid'))
+        # Committed
+        transaction.abort()
+        self.assertEqual(len(self.target), 25)
+
+    def test_resume(self):
+        self.root['migration'] = migration = Migration(self.source,
+                                                       self.target)
+        transaction.commit()
+        calls = []
+
+        def crash(migration, progress):
+            calls.append(progress)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            migration.run(batch_size=10, report=crash)
+        self.assertEqual(migration.position, 190)
+
+        # Another run continues after the last committed batch
+        conn = self.db.open(transaction.TransactionManager())
+        migration = conn.root()['migration']
+        self.assertEqual(migration.copied, 20)
+        self.assertEqual(migration.run(batch_size=10,
+                                       report=lambda m, p: None), 5)
+        self.assertEqual(len(migration.target), 25)
+        conn.close()
+
+    def _conflictAfter(self, batches):
+        # Return a report function that changes the migration in
+        # another connection after the given number of batches, so that
+        # committing the next one conflicts.
+        calls = []
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        self.addCleanup(conn.close)
+
+        def report(migration, progress):
+            calls.append(progress)
+            if len(calls) == batches:
+                tm.begin()
+                conn.root()['migration']._p_changed = True
+                tm.commit()
+        return report, calls
+
+    def test_conflict_retried(self):
+        self.root['migration'] = migration = Migration(self.source,
+                                                       self.target)
+        transaction.commit()
+        report, calls = self._conflictAfter(1)
+        with self.assertLogs('zc.intid.migration') as logs:
+            self.assertEqual(migration.run(batch_size=10, report=report),
+                             25)
+        self.assertEqual(logs.output,
+                         ['INFO:zc.intid.migration:Conflict, retrying '
+                          '(1 of 3)'])
+        self.assertEqual([p['copied'] for p in calls], [10, 20, 25])
+        self.assertTrue(migration.finished)
+        transaction.abort()
+        self.assertEqual(len(self.target), 25)
+
+    def test_conflict_retries_exhausted(self):
+        from ZODB.POSException import ConflictError
+        self.root['migration'] = migration = Migration(self.source,
+                                                       self.target)
+        transaction.commit()
+        report, calls = self._conflictAfter(1)
+        with self.assertRaises(ConflictError):
+            migration.run(batch_size=10, report=report, retries=0)
+        transaction.abort()
+        self.assertEqual(migration.position, 90)
+        self.assertEqual(len(self.target), 10)
+
+    def test_conflict_not_stored(self):
+        # Aborting doesn't reset a migration that isn't stored, so its
+        # state is reset by hand.
+        migration = Migration(self.source, self.target)
+
+        def report(migration, progress):
+            if progress['copied'] == 10:
+                transaction.get().join(ConflictingCommit())
+        with self.assertLogs('zc.intid.migration'):
+            self.assertEqual(migration.run(batch_size=10, report=report),
+                             25)
+        self.assertEqual((migration.copied, migration.position), (25, 240))
+        self.assertTrue(migration.finished)
+        transaction.abort()
+        self.assertEqual(len(self.target), 25)
+        for i, ob in self.objects.items():
+            self.assertEqual(self.target.getId(ob), i * 10)
+
+    def test_savepoints(self):
+        migration = Migration(self.source, self.target)
+        migration.run(batch_size=10, savepoints=True,
+                      report=lambda m, p: None)
+        self.assertEqual(len(self.target), 25)
+        transaction.abort()
+        self.assertEqual(len(self.target), 0)
+
+    def test_skipped(self):
+        # Registered with the same id already, for example by the
+        # subscribers
+        ob = self.objects[0]
+        self.target.refs[0] = ob
+        self.target._storeId(ob, 0)
+        self.target._changeLength(1)
+        # An id used by another object
+        self.target.refs[10] = Content()
+        self.target._changeLength(1)
+        transaction.commit()
+
+        migration = Migration(self.source, self.target)
+        with self.assertLogs('zc.intid.migration', 'WARNING'):
+            migration.run(report=lambda m, p: None)
+        self.assertEqual(migration.copied, 23)
+        self.assertEqual(migration.skipped, 1)
+        self.assertEqual(len(self.target), 25)
+        self.assertIsNone(self.target.queryId(self.objects[1]))
+
+    def test_missing(self):
+        self.source.refs[5] = MissingRef()
+        self.root['migration'] = migration = Migration(self.source,
+                                                       self.target)
+        with self.assertLogs('zc.intid.migration') as logs:
+            self.assertEqual(migration.run(), 25)
+        self.assertEqual(migration.skipped, 1)
+        warning, report = logs.output
+        self.assertEqual(warning, 'WARNING:zc.intid.migration:Skipping id '
+                                  '5: its object is missing')
+        # Reported in the log by default
+        self.assertTrue(report.startswith(
+            'INFO:zc.intid.migration:25 ids copied, 1 skipped, up to 240, '))
+
+    def test_traverse(self):
+        sm = {'default': {'intids': self.target}}
+        root = {'app': Site(sm)}
+        self.assertIs(_traverse(root, '/app/++etc++site//default/intids/'),
+                      self.target)
+
+    def test_family(self):
+        source = zope.intid.IntIds(family=BTrees.family64)
+        with self.assertRaises(ValueError):
+            Migration(source, self.target)
+
+
+class TestFamilyConversion(unittest.TestCase):
+
+    def setUp(self):
+        import ZODB
+        self.db = ZODB.DB(None)
+        self.conn = self.db.open()
+        self.root = self.conn.root()
+        self.root['intids'] = self.intids = IntIds('iid', index_oids=True)
+        transaction.commit()
+        self.objects = [Content() for _ in range(25)]
+        self.uids = self.intids.registerMany(self.objects)
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+
+    def _check(self, intids, objects):
+        self.assertIs(intids.family, BTrees.family64)
+        self.assertIsInstance(intids.refs, BTrees.family64.IO.BTree)
+        self.assertIsInstance(intids.oids, BTrees.family64.OI.BTree)
+        self.assertEqual(len(intids.refs), len(objects))
+        self.assertEqual(len(intids.oids), len(objects))
+        for ob in objects:
+            self.assertIs(intids.getObject(intids.getId(ob)), ob)
+
+    def test_run(self):
+        self.root['conversion'] = conversion = FamilyConversion(self.intids)
+        reports = []
+        copied = conversion.run(batch_size=10,
+                                report=lambda c, p: reports.append(p))
+        self.assertEqual(copied, 25)
+        # Three batches of refs, and three of oids
+        self.assertEqual(len(reports), 6)
+        self.assertTrue(conversion.finished)
+        self._check(self.intids, self.objects)
+        self.assertIsNone(self.intids._conversion)
+        transaction.abort()
+        self._check(self.intids, self.objects)
+
+        # Ids can be allocated from the larger space
+        self.intids._randrange = lambda lo, hi: 2 ** 40
+        self.assertEqual(self.intids.register(Content()), 2 ** 40)
+
+    def test_no_oid_index(self):
+        self.root['intids'] = intids = IntIds('iid')
+        self.root['objects'] = objects = [Content() for _ in range(5)]
+        intids.registerMany(objects)
+        conversion = FamilyConversion(intids)
+        transaction.commit()
+        self.assertEqual(conversion.run(report=lambda c, p: None), 5)
+        self.assertIs(intids.family, BTrees.family64)
+        self.assertIsNone(intids.oids)
+        for ob in objects:
+            self.assertIs(intids.getObject(intids.getId(ob)), ob)
+
+    def test_resume_oids(self):
+        self.root['conversion'] = conversion = FamilyConversion(self.intids)
+        transaction.commit()
+
+        def crash(conversion, progress):
+            if conversion.phase == 'oids':
+                raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            conversion.run(batch_size=10, report=crash)
+        # Continues with the oids
+        self.assertEqual((conversion.phase, conversion.copied), ('oids', 25))
+        reports = []
+        self.assertEqual(conversion.run(batch_size=10,
+                                        report=lambda c, p: reports.append(p)),
+                         0)
+        self.assertEqual(len(reports), 2)
+        self._check(self.intids, self.objects)
+
+    def test_writes_mirrored(self):
+        self.root['conversion'] = conversion = FamilyConversion(self.intids)
+        transaction.commit()
+
+        def crash(conversion, progress):
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            conversion.run(batch_size=10, report=crash)
+        self.assertEqual(conversion.copied, 10)
+
+        # The utility keeps working meanwhile
+        removed = self.objects[:3] + self.objects[-3:]
+        self.intids.unregisterMany(removed)
+        added = [Content() for _ in range(5)]
+        self.intids.registerMany(added)
+        self.intids.register(Content())
+        self.intids.unregister(added[0])
+        transaction.commit()
+
+        conn = self.db.open(transaction.TransactionManager())
+        conn.root()['conversion'].run(batch_size=10,
+                                      report=lambda c, p: None)
+        conn.close()
+        transaction.begin()
+        objects = [ob for ob in self.objects + added
+                   if ob not in removed and ob is not added[0]]
+        self.assertEqual(len(self.intids), len(objects) + 1)
+        self._check(self.intids, list(self.intids.refs.values()))
+        for ob in objects:
+            self.assertIsNotNone(self.intids.queryId(ob))
+
+    def test_conflict_retried(self):
+        # Conflicts on the first batch of oids and when finishing
+        self.root['conversion'] = conversion = FamilyConversion(self.intids)
+        transaction.commit()
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        self.addCleanup(conn.close)
+        calls = []
+
+        def report(conversion, progress):
+            calls.append(progress)
+            if len(calls) in (3, 6):
+                tm.begin()
+                conn.root()['conversion']._p_changed = True
+                conn.root()['intids']._p_changed = True
+                tm.commit()
+        with self.assertLogs('zc.intid.migration') as logs:
+            self.assertEqual(conversion.run(batch_size=10, report=report),
+                             25)
+        self.assertEqual(len(calls), 6)
+        self.assertEqual(len(logs.records), 2)
+        self.assertTrue(conversion.finished)
+        transaction.abort()
+        self._check(self.intids, self.objects)
+
+    def test_savepoints(self):
+        conversion = FamilyConversion(self.intids)
+        conversion.run(batch_size=10, savepoints=True,
+                       report=lambda c, p: None)
+        self._check(self.intids, self.objects)
+        transaction.abort()
+        self.assertIs(self.intids.family, BTrees.family32)
+        self.assertIsNone(self.intids._conversion)
+
+    def test_finish_repairs(self):
+        conversion = FamilyConversion(self.intids)
+        conversion.refs.update(self.intids.refs)
+        conversion.oids.update(self.intids.oids)
+        # Left by changes made while batches were copied
+        del conversion.refs[self.uids[0]]
+        conversion.refs[2 ** 40] = Content()
+        conversion.oids[b'stale'] = 1
+        conversion.finish()
+        self._check(self.intids, self.objects)
+
+    def test_errors(self):
+        FamilyConversion(self.intids)
+        with self.assertRaises(ValueError):
+            FamilyConversion(self.intids)
+        with self.assertRaises(ValueError):
+            self.intids.indexOids()
+        with self.assertRaises(ValueError):
+            FamilyConversion(IntIds('iid', family=BTrees.family64),
+                             BTrees.family32)
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        import ZODB.config
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.zconfig = os.path.join(tmp, 'zodb.conf')
+        with open(self.zconfig, 'w') as f:
+            f.write('<zodb>\n  <filestorage>\n    path %s\n'
+                    '  </filestorage>\n</zodb>\n'
+                    % os.path.join(tmp, 'Data.fs'))
+        db = ZODB.config.databaseFromURL(self.zconfig)
+        with db.transaction() as conn:
+            root = conn.root()
+            root['source'] = source = zope.intid.IntIds()
+            root['target'] = IntIds('iid', index_oids=True)
+            for i in range(5):
+                root[i] = ob = Content()
+                conn.add(ob)
+                ref = KeyReferenceToPersistent(ob)
+                source.refs[i] = ref
+                source.ids[ref] = i
+        db.close()
+        self.open = lambda: ZODB.config.databaseFromURL(self.zconfig)
+
+    def _main(self, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main(['--zconfig', self.zconfig] + list(args))
+        return [line.split(', up to')[0] for line in
+                out.getvalue().splitlines()]
+
+    def test_migrate(self):
+        self.assertEqual(
+            self._main('--batch-size', '2', 'source', 'target'),
+            ['2 ids copied, 0 skipped', '4 ids copied, 0 skipped',
+             '5 ids copied, 0 skipped', 'Finished, 5 ids copied, 0 skipped'])
+        self.assertEqual(self._main('source', 'target'),
+                         ['Already finished, 5 ids copied'])
+        db = self.open()
+        with db.transaction() as conn:
+            root = conn.root()
+            self.assertEqual(root['target'].getId(root[3]), 3)
+        db.close()
+
+    def test_resume(self):
+        db = self.open()
+        with db.transaction() as conn:
+            root = conn.root()
+            # Left by a run that stopped before copying anything
+            root['zc.intid.migration source target'] = Migration(
+                root['source'], root['target'])
+        db.close()
+        self.assertEqual(self._main('source', 'target'), [
+            '5 ids copied, 0 skipped', 'Finished, 5 ids copied, 0 skipped'])
+
+    def test_family(self):
+        self._main('source', 'target')
+        self.assertEqual(self._main('--family', '64', 'target'), [
+            '5 ids copied, 0 skipped', '5 ids copied, 0 skipped',
+            'Finished, 5 ids copied, 0 skipped'])
+        db = self.open()
+        with db.transaction() as conn:
+            self.assertIs(conn.root()['target'].family, BTrees.family64)
+        db.close()
+
+    def test_paths(self):
+        for args in (['source'], ['--family', '64', 'source', 'target']):
+            with contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit):
+                    main(['--zconfig', self.zconfig] + args)
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestMigration),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestFamilyConversion),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestMain),
+    ])
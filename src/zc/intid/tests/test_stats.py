@@ -0,0 +1,162 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the instrumentation of the utility.
+
+"""
+
+import unittest
+
+from zope.component import provideAdapter
+from zope.component import testing as componenttesting
+from zope.interface.verify import verifyObject
+
+from zc.intid import stats
+from zc.intid.allocation import StripeAllocator
+from zc.intid.interfaces import IIntIdsStats
+from zc.intid.interfaces import IIntIdsStatsSink
+from zc.intid.utility import IntIds
+
+
+class P:
+    pass
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.collector = stats.setSink(stats.StatsCollector())
+        self.u = IntIds('iid')
+        self.stats = self.collector.statsFor(self.u)
+
+    def tearDown(self):
+        stats.setSink(None)
+
+    def test_interfaces(self):
+        verifyObject(IIntIdsStatsSink, self.collector)
+        verifyObject(IIntIdsStats, self.stats)
+        self.assertIs(stats.getSink(), self.collector)
+
+    def test_disabled(self):
+        stats.setSink(None)
+        self.u.register(P())
+        self.assertEqual(self.stats.counters, {})
+        self.assertEqual(self.stats.histograms, {})
+
+    def test_register_unregister(self):
+        u = self.u
+        obs = [P() for _ in range(5)]
+        u.register(obs[0])
+        u.register(obs[0])
+        u.registerMany(obs[1:], batch_event=True)
+        u.unregister(obs[0])
+        u.unregisterMany(obs[1:3])
+        counters = self.stats.counters
+        self.assertEqual(counters['registered'], 5)
+        self.assertEqual(counters['unregistered'], 3)
+        self.assertEqual(counters['allocations'], 5)
+        # Their own lookups aren't counted
+        self.assertEqual(counters['lookups'], 0)
+        u.queryId(obs[4])
+        self.assertEqual(counters['lookups'], 1)
+        # Two register(), one registerMany(), one unregister(), and one
+        # event for each of the objects in unregisterMany()
+        notify = self.stats.histograms['notify']
+        self.assertEqual(notify.count, 6)
+        self.assertGreater(notify.total, 0)
+
+    def test_lookups(self):
+        u = self.u
+        ob = P()
+        u.register(ob)
+        other = P()
+        u.queryId(other)
+        other.iid = u.getId(ob)
+        u.queryId(other)
+        counters = self.stats.counters
+        self.assertEqual(counters['lookups'], 3)
+        self.assertEqual(counters['missing'], 1)
+        self.assertEqual(counters['mismatches'], 1)
+
+    def test_probes(self):
+        u = self.u
+        u.refs[10] = P()
+        u.refs[11] = P()
+        starts = iter([10, 20])
+        u._randrange = lambda lo, hi: next(starts)
+        u.register(P())
+        probes = self.stats.histograms['probes']
+        self.assertEqual((probes.count, probes.total), (1, 2))
+        self.assertEqual(probes.buckets, {1: 1})
+
+        del u._randrange
+        u.allocator = StripeAllocator()
+        u.register(P())
+        self.assertEqual(self.stats.counters['allocations'], 2)
+        self.assertEqual(probes.count, 1)
+
+    def test_histogram(self):
+        h = stats.Histogram()
+        self.assertIsNone(h.mean)
+        for value in (0, 0.75, 1, 3, 4, 5):
+            h.observe(value)
+        self.assertEqual(h.buckets, {None: 1, 0: 2, 2: 2, 3: 1})
+        self.assertEqual((h.min, h.max, h.count), (0, 5, 6))
+        self.assertAlmostEqual(h.mean, 13.75 / 6)
+
+    def test_reset(self):
+        self.u.register(P())
+        self.stats.reset()
+        self.assertEqual(self.stats.counters, {})
+
+    def test_adapter(self):
+        componenttesting.setUp()
+        self.addCleanup(componenttesting.tearDown)
+        provideAdapter(stats.getStats)
+        self.assertIs(IIntIdsStats(self.u), self.stats)
+        stats.setSink(None)
+        self.assertIsNone(IIntIdsStats(self.u, None))
+
+    def test_connections_share_stats(self):
+        import transaction
+        import ZODB
+        db = ZODB.DB(None)
+        conn1 = db.open()
+        conn1.root()['intids'] = self.u
+        transaction.commit()
+        tm2 = transaction.TransactionManager()
+        conn2 = db.open(tm2)
+
+        def cleanUp():
+            transaction.abort()
+            tm2.abort()
+            conn1.close()
+            conn2.close()
+            db.close()
+        self.addCleanup(cleanUp)
+        u1 = conn1.root()['intids']
+        u2 = conn2.root()['intids']
+        self.assertIsNot(u1, u2)
+        u1.register(P())
+        u2.register(P())
+        self.assertIs(self.collector.statsFor(u1),
+                      self.collector.statsFor(u2))
+        self.assertEqual(
+            self.collector.statsFor(u1).counters['registered'], 2)
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestStats),
+    ])
@@ -17,6 +17,8 @@ Tests for the lifecycle subscribers.
 
 import unittest
 
+import transaction
+import zope.event
 from persistent.interfaces import IPersistent
 from zope.component import eventtesting
 from zope.component import getGlobalSiteManager
@@ -30,7 +32,11 @@ from zope.component.hooks import setHooks
 from zope.component.hooks import setSite
 from zope.component.interfaces import ISite
 from zope.configuration import xmlconfig
+from zope.container.contained import ContainerSublocations
+from zope.container.contained import dispatchToSublocations
+from zope.container.interfaces import IReadContainer
 from zope.interface import Interface
+from zope.interface import directlyProvides
 from zope.interface.interfaces import IComponentLookup
 from zope.intid.interfaces import IIntIdEvent
 from zope.intid.interfaces import IntIdAddedEvent
@@ -39,6 +45,9 @@ from zope.intid.interfaces import ObjectMissingError
 from zope.keyreference.interfaces import IKeyReference
 from zope.lifecycleevent import ObjectAddedEvent
 from zope.lifecycleevent import ObjectRemovedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
+from zope.location.interfaces import ISublocations
+from zope.location.location import Location
 from zope.site.folder import Folder
 from zope.site.folder import rootFolder
 from zope.site.interfaces import IFolder
@@ -47,9 +56,13 @@ from zope.site.site import SiteManagerAdapter
 from zope.traversing.testing import setUp as traversingSetUp
 
 import zc.intid
+from zc.intid import subscribers
 from zc.intid.interfaces import AddedEvent
 from zc.intid.interfaces import AfterIdAddedEvent
 from zc.intid.interfaces import BeforeIdRemovedEvent
+from zc.intid.interfaces import IAfterIdAddedEvent
+from zc.intid.interfaces import IBeforeIdRemovedEvent
+from zc.intid.interfaces import IDeferredIdsEvent
 from zc.intid.interfaces import IIdEvent
 from zc.intid.interfaces import IIntIds
 from zc.intid.interfaces import ISubscriberEvent
@@ -135,6 +148,60 @@ class TestSubscribers(ReferenceSetupMixin, unittest.TestCase):
 
         setSite(self.folder1_1)
 
+    def test_utilities(self):
+        from zc.intid.subscribers import _utilities
+        utilities = _utilities()
+        self.assertEqual(set(utilities), {self.utility, self.utility1})
+
+        # Registering a utility here, or in a base, updates it
+        sm1_1 = getSiteManager(self.folder1_1)
+        utility2 = IntIds("iid2")
+        sm1_1.registerUtility(utility2, name='3', provided=IIntIds)
+        self.assertEqual(set(_utilities()),
+                         {self.utility, self.utility1, utility2})
+
+        utility3 = IntIds("iid3")
+        getSiteManager(self.root).registerUtility(
+            utility3, name='4', provided=IIntIds)
+        self.assertIn(utility3, _utilities())
+
+        # Even without an event
+        utility4 = IntIds("iid4")
+        getGlobalSiteManager().registerUtility(
+            utility4, name='5', provided=IIntIds, event=False)
+        self.assertIn(utility4, _utilities())
+        getGlobalSiteManager().unregisterUtility(
+            utility4, name='5', provided=IIntIds)
+
+        # As does unregistering
+        sm1_1.unregisterUtility(utility2, name='3', provided=IIntIds)
+        self.assertEqual(set(_utilities()),
+                         {self.utility, self.utility1, utility3})
+
+        # Each site has its own
+        setSite(self.root)
+        self.assertEqual(set(_utilities()), {self.utility, utility3})
+
+    def test_intIdEventNotify(self):
+        from zc.intid.subscribers import intIdEventNotify
+        event = IntIdAddedEvent(self.child_folder, None)
+        intIdEventNotify(event)
+        self.assertEqual(self.obj_events, [(self.child_folder, event)])
+
+        # Handlers registered later, here or in a base, are called
+        seen = []
+        getSiteManager(self.folder1_1).registerHandler(
+            lambda ob, event: seen.append('local'), [IFolder, IIntIdEvent])
+        getSiteManager(self.root).registerHandler(
+            lambda ob, event: seen.append('base'), [IFolder, IIntIdEvent])
+        intIdEventNotify(event)
+        self.assertEqual(sorted(seen), ['base', 'local'])
+
+        # Objects without handlers
+        del self.obj_events[:]
+        intIdEventNotify(IntIdAddedEvent(self, None))
+        self.assertEqual(self.obj_events, [])
+
     def test_no_KeyReference(self):
         # Nothing happens for something that can't be a KeyReference
         addIntIdSubscriber(self, ObjectAddedEvent(self))
@@ -227,7 +294,500 @@ class TestSubscribers(ReferenceSetupMixin, unittest.TestCase):
             self.assertEqual(e.id, e.idmanager.getId(e.object))
 
 
+class TestLeanSubscribers(ReferenceSetupMixin, unittest.TestCase):
+
+    def setUp(self):
+        ReferenceSetupMixin.setUp(self)
+        # This listens to everything
+        getGlobalSiteManager().unregisterHandler(
+            eventtesting.events.append, (None,))
+        xmlconfig.file('subscribers.zcml', package=zc.intid)
+        self.utility = IntIds("iid")
+        getSiteManager(self.root).registerUtility(
+            self.utility, name='1', provided=IIntIds)
+        self.root['folder'] = self.folder = Folder()
+
+        subscribers.setLeanEvents()
+        self.notified = []
+
+        def notify(event):
+            self.notified.append(type(event))
+            zope.event.notify(event)
+        subscribers.notify = notify
+
+    def tearDown(self):
+        subscribers.notify = zope.event.notify
+        subscribers.setLeanEvents(False)
+        ReferenceSetupMixin.tearDown(self)
+
+    def _add_remove(self):
+        del self.notified[:]
+        handle(self.folder, ObjectAddedEvent(self.folder))
+        self.assertIsNotNone(self.utility.queryId(self.folder))
+        handle(self.folder, ObjectRemovedEvent(self.folder))
+        self.assertIsNone(self.utility.queryId(self.folder))
+        return self.notified
+
+    def test_no_handlers(self):
+        self.assertEqual(self._add_remove(), [])
+        # With no event subscribers at all, nothing is notified.
+        subscribers_ = zope.event.subscribers[:]
+        del zope.event.subscribers[:]
+        try:
+            self.assertEqual(self._add_remove(), [])
+        finally:
+            zope.event.subscribers[:] = subscribers_
+
+    def test_object_handlers(self):
+        events = []
+        provideHandler(lambda ob, event: events.append(event),
+                       [IFolder, IIntIdEvent])
+        self.assertEqual(self._add_remove(),
+                         [IntIdAddedEvent, IntIdRemovedEvent])
+        self.assertEqual([type(e) for e in events],
+                         [IntIdAddedEvent, IntIdRemovedEvent])
+
+        # Handlers for other objects don't count
+        self.folder = Folder()
+        self.root['folder2'] = self.folder
+        directlyProvides(self.folder, IOther)
+        getGlobalSiteManager().unregisterHandler(
+            required=[IFolder, IIntIdEvent])
+        provideHandler(lambda ob, event: events.append(event),
+                       [IOther, IAfterIdAddedEvent])
+        self.assertEqual(self._add_remove(), [])
+
+    def test_event_handlers(self):
+        events = []
+        provideHandler(events.append, [IAfterIdAddedEvent])
+        self.assertEqual(self._add_remove(), [AfterIdAddedEvent])
+        self.assertEqual(len(events), 1)
+        provideHandler(events.append, [IBeforeIdRemovedEvent])
+        self.assertEqual(self._add_remove(),
+                         [AfterIdAddedEvent, BeforeIdRemovedEvent])
+
+    def test_other_event_subscribers(self):
+        events = []
+        zope.event.subscribers.append(events.append)
+        try:
+            self.assertEqual(self._add_remove(),
+                             [IntIdAddedEvent, AfterIdAddedEvent,
+                              BeforeIdRemovedEvent, IntIdRemovedEvent])
+        finally:
+            zope.event.subscribers.remove(events.append)
+
+
+class TestDeferredSubscribers(ReferenceSetupMixin, unittest.TestCase):
+
+    def setUp(self):
+        ReferenceSetupMixin.setUp(self)
+        xmlconfig.file('subscribers.zcml', package=zc.intid)
+        self.utility = IntIds("iid")
+        getSiteManager(self.root).registerUtility(
+            self.utility, name='1', provided=IIntIds)
+        self.root['folder'] = self.folder = Folder()
+        self.root['other'] = self.other = Folder()
+
+        subscribers.setDeferredEvents()
+        transaction.begin()
+        eventtesting.clearEvents()
+        self.deferred = []
+        provideHandler(self.deferred.append, [IDeferredIdsEvent])
+
+    def tearDown(self):
+        transaction.abort()
+        subscribers.setDeferredEvents(False)
+        ReferenceSetupMixin.tearDown(self)
+
+    def _events(self, iface):
+        return [e for e in eventtesting.getEvents() if iface.providedBy(e)]
+
+    def test_commit(self):
+        handle(self.folder, ObjectAddedEvent(self.folder))
+        uid = self.utility.getId(self.folder)
+        self.utility.register(self.other)
+        handle(self.other, ObjectRemovedEvent(self.other))
+        self.assertIsNone(self.utility.queryId(self.other))
+        self.assertEqual(self.deferred, [])
+        # None of the per-object events were notified
+        self.assertEqual(self._events(IIntIdEvent), [])
+        self.assertEqual(self._events(ISubscriberEvent), [])
+
+        transaction.commit()
+        self.assertEqual(len(self.deferred), 1)
+        event = self.deferred[0]
+        self.assertEqual(event.added, [(self.utility, uid, self.folder)])
+        self.assertEqual(len(event.removed), 1)
+        self.assertEqual(event.removed[0][0], self.utility)
+        self.assertIs(event.removed[0][2], self.other)
+
+        # The next transaction starts over
+        del self.deferred[:]
+        transaction.commit()
+        self.assertEqual(self.deferred, [])
+
+    def test_add_remove_cancel(self):
+        handle(self.folder, ObjectAddedEvent(self.folder))
+        handle(self.folder, ObjectRemovedEvent(self.folder))
+        transaction.commit()
+        self.assertEqual(self.deferred, [])
+
+    def test_abort(self):
+        handle(self.folder, ObjectAddedEvent(self.folder))
+        transaction.abort()
+        transaction.commit()
+        self.assertEqual(self.deferred, [])
+
+    def test_handler_registrations(self):
+        # Registrations made by the handlers are notified too.
+        def handler(event):
+            if len(self.deferred) == 1:
+                handle(self.other, ObjectAddedEvent(self.other))
+        provideHandler(handler, [IDeferredIdsEvent])
+        handle(self.folder, ObjectAddedEvent(self.folder))
+        transaction.commit()
+        self.assertEqual([e.added[0][2] for e in self.deferred],
+                         [self.folder, self.other])
+
+    def test_connection_transaction_manager(self):
+        import ZODB
+        db = ZODB.DB(None)
+        tm = transaction.TransactionManager()
+        conn = db.open(tm)
+        try:
+            conn.root()['folder'] = folder = Folder()
+            tm.commit()
+            handle(folder, ObjectAddedEvent(folder))
+            # Not the thread's transaction
+            transaction.commit()
+            self.assertEqual(self.deferred, [])
+            tm.commit()
+            self.assertEqual([e.added[0][2] for e in self.deferred],
+                             [folder])
+        finally:
+            tm.abort()
+            conn.close()
+            db.close()
+
+
+class TestSubtreeSubscribers(ReferenceSetupMixin, unittest.TestCase):
+
+    def setUp(self):
+        ReferenceSetupMixin.setUp(self)
+        provideAdapter(ContainerSublocations, (IReadContainer,),
+                       ISublocations)
+        provideHandler(dispatchToSublocations, [None, IObjectMovedEvent])
+        # Built before the subscribers are installed
+        self.tree = Folder()
+        self.tree['a'] = Folder()
+        self.tree['a']['b'] = Folder()
+        self.tree['c'] = Folder()
+        self.objects = [self.tree, self.tree['a'], self.tree['a']['b'],
+                        self.tree['c']]
+
+        xmlconfig.file('subscribers.zcml', package=zc.intid)
+        self.utilities = [IntIds("iid"), IntIds("iid2")]
+        for i, utility in enumerate(self.utilities):
+            getSiteManager(self.root).registerUtility(
+                utility, name=str(i), provided=IIntIds)
+            # Only bulk registration is used
+            utility.register = utility.unregister = None
+        subscribers.setSubtreeEvents()
+        self.events = []
+
+        def handler(ob, event):
+            # Record the object and whether all of them are registered
+            self.events.append((type(event), ob, [
+                all(u.queryId(o) is not None for u in self.utilities)
+                for o in self.objects]))
+        provideHandler(handler, [IFolder, IIntIdEvent])
+        provideHandler(lambda event: handler(event.object, event),
+                       [IBeforeIdRemovedEvent])
+
+    def tearDown(self):
+        subscribers.setSubtreeEvents(False)
+        ReferenceSetupMixin.tearDown(self)
+
+    def test_add_remove(self):
+        self.root['tree'] = self.tree
+        self.assertEqual([(e, ob) for e, ob, _ in self.events],
+                         [(IntIdAddedEvent, ob) for ob in self.objects])
+        # Everything was registered before the first event
+        self.assertEqual([registered for _, _, registered in self.events],
+                         [[True] * 4] * 4)
+        for utility in self.utilities:
+            self.assertEqual(len(utility), 4)
+
+        del self.events[:]
+        del self.root['tree']
+        self.assertEqual([(e, ob) for e, ob, _ in self.events],
+                         [e for ob in self.objects
+                          for e in ((BeforeIdRemovedEvent, ob),
+                                    (IntIdRemovedEvent, ob))])
+        # Nothing was unregistered before the last event
+        self.assertEqual(self.events[-1][2], [True] * 4)
+        for utility in self.utilities:
+            self.assertEqual(len(utility), 0)
+
+    def test_partly_registered(self):
+        self.root['tree'] = self.tree
+        self.utilities[0].unregisterMany(self.objects[1:])
+        self.utilities[1].unregisterMany(self.objects[2:])
+        del self.events[:]
+        del self.root['tree']
+        self.assertEqual([ob for e, ob, _ in self.events
+                          if e is BeforeIdRemovedEvent], self.objects[:2])
+        for utility in self.utilities:
+            self.assertEqual(len(utility), 0)
+
+    def test_deferred(self):
+        deferred = []
+        provideHandler(deferred.append, [IDeferredIdsEvent])
+        subscribers.setDeferredEvents()
+        try:
+            transaction.begin()
+            self.root['tree'] = self.tree
+            transaction.commit()
+            self.assertEqual(self.events, [])
+            self.assertEqual(len(deferred[0].added), 8)
+            del self.root['tree']
+            transaction.commit()
+            self.assertEqual(len(deferred[1].removed), 8)
+        finally:
+            transaction.abort()
+            subscribers.setDeferredEvents(False)
+
+
+class TestTracing(ReferenceSetupMixin, unittest.TestCase):
+
+    def setUp(self):
+        ReferenceSetupMixin.setUp(self)
+        xmlconfig.file('subscribers.zcml', package=zc.intid)
+        self.utility = IntIds("iid")
+        getSiteManager(self.root).registerUtility(
+            self.utility, name='1', provided=IIntIds)
+        self.root['folder'] = self.folder = Folder()
+        eventtesting.clearEvents()
+        subscribers.setTracing(10)
+
+    def tearDown(self):
+        subscribers.setTracing(None)
+        ReferenceSetupMixin.tearDown(self)
+
+    def test_trace(self):
+        seen = []
+
+        def objectHandler(ob, event):
+            seen.append(type(event))
+        provideHandler(objectHandler, [IFolder, IIntIdEvent])
+        handle(self.folder, ObjectAddedEvent(self.folder))
+        # The handlers were still called
+        self.assertEqual(seen, [IntIdAddedEvent])
+        self.assertEqual([type(e) for e in eventtesting.getEvents()],
+                         [AddedEvent, IntIdAddedEvent, AfterIdAddedEvent])
+
+        # The AddedEvent of the utility isn't traced
+        trace = subscribers.getTrace()
+        self.assertEqual(
+            {(event_class, handler) for event_class, handler, _ in trace},
+            {('IntIdAddedEvent', 'list.append'),
+             ('IntIdAddedEvent', __name__ + '.'
+              + objectHandler.__qualname__),
+             ('AfterIdAddedEvent', 'list.append')})
+        for _, _, seconds in trace:
+            self.assertGreaterEqual(seconds, 0)
+
+        summary = subscribers.summarizeTrace()
+        count, total = summary['IntIdAddedEvent', 'list.append']
+        self.assertEqual(count, 1)
+        self.assertGreaterEqual(total, 0)
+
+    def test_ring_buffer(self):
+        for _ in range(10):
+            handle(self.folder, ObjectAddedEvent(self.folder))
+            handle(self.folder, ObjectRemovedEvent(self.folder))
+        self.assertEqual(len(subscribers.getTrace()), 10)
+
+    def test_disabled(self):
+        subscribers.setTracing(0)
+        handle(self.folder, ObjectAddedEvent(self.folder))
+        self.assertEqual(subscribers.getTrace(), [])
+        self.assertEqual(subscribers.summarizeTrace(), {})
+
+
+class TestKeyReferenceMode(ReferenceSetupMixin, unittest.TestCase):
+
+    def setUp(self):
+        ReferenceSetupMixin.setUp(self)
+        xmlconfig.file('subscribers.zcml', package=zc.intid)
+        self.utility = IntIds("iid")
+        getSiteManager(self.root).registerUtility(
+            self.utility, name='1', provided=IIntIds)
+        self.adapted = []
+
+        def keyReference(ob):
+            self.adapted.append(ob)
+            return KeyReferenceStub(ob)
+        provideAdapter(keyReference, (IPersistent,), IKeyReference)
+
+    def tearDown(self):
+        subscribers.setKeyReferenceMode()
+        ReferenceSetupMixin.tearDown(self)
+
+    def _add(self, ob):
+        handle(ob, ObjectAddedEvent(ob))
+        return self.utility.queryId(ob)
+
+    def test_adapt(self):
+        folder = Folder()
+        self.assertIsNotNone(self._add(folder))
+        self.assertIsNone(self._add(Location()))
+        self.assertEqual(self.adapted, [folder])
+        # The adapter is called for each object
+        self.assertIsNotNone(self._add(Folder()))
+        self.assertEqual(len(self.adapted), 2)
+
+        # Registering an adapter is seen
+        provideAdapter(KeyReferenceStub, (Interface,), IKeyReference)
+        self.assertIsNotNone(self._add(Location()))
+
+    def test_adapt_provided_or_conform(self):
+        ob = Location()
+        directlyProvides(ob, IKeyReference)
+        self.assertIsNotNone(self._add(ob))
+
+        class Conforming(Location):
+            def __conform__(self, iface):
+                return KeyReferenceStub(self)
+        self.assertIsNotNone(self._add(Conforming()))
+
+    def test_adapt_none(self):
+        provideAdapter(lambda ob: None, (IPersistent,), IKeyReference)
+        self.assertIsNone(self._add(Folder()))
+
+    def test_persistent(self):
+        subscribers.setKeyReferenceMode('persistent')
+        folder = Folder()
+        self.assertIsNotNone(self._add(folder))
+        self.assertIsNone(self._add(Location()))
+        self.assertEqual(self.adapted, [])
+        handle(folder, ObjectRemovedEvent(folder))
+        self.assertIsNone(self.utility.queryId(folder))
+
+    def test_none(self):
+        subscribers.setKeyReferenceMode('none')
+        self.assertIsNotNone(self._add(Location()))
+        self.assertEqual(self.adapted, [])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, subscribers.setKeyReferenceMode, 'no')
+        self.assertEqual(subscribers._keyMode, 'adapt')
+
+
+class TestAccepts(ReferenceSetupMixin, unittest.TestCase):
+
+    def setUp(self):
+        ReferenceSetupMixin.setUp(self)
+        xmlconfig.file('subscribers.zcml', package=zc.intid)
+        sm = getSiteManager(self.root)
+        self.everything = IntIds("iid")
+        self.other = IntIds("iid2", interfaces=[IOther])
+        sm.registerUtility(self.everything, name='1', provided=IIntIds)
+        sm.registerUtility(self.other, name='2', provided=IIntIds)
+        self.events = []
+        provideHandler(lambda ob, event: self.events.append(event),
+                       [IFolder, IIntIdEvent])
+
+    def test_filtered(self):
+        folder = Folder()
+        handle(folder, ObjectAddedEvent(folder))
+        self.assertIsNotNone(self.everything.queryId(folder))
+        self.assertIsNone(self.other.queryId(folder))
+        self.assertEqual(list(self.events[0].idmap), [self.everything])
+
+        other = Folder()
+        directlyProvides(other, IOther)
+        handle(other, ObjectAddedEvent(other))
+        self.assertIsNotNone(self.other.queryId(other))
+
+        # Removed from wherever it is registered
+        self.other.register(folder)
+        handle(folder, ObjectRemovedEvent(folder))
+        self.assertIsNone(self.other.queryId(folder))
+
+    def test_none_accept(self):
+        self.everything.interfaces = (IOther,)
+        folder = Folder()
+        handle(folder, ObjectAddedEvent(folder))
+        self.assertEqual(self.events, [])
+        self.assertEqual(len(self.everything), 0)
+
+    def test_cache_bounded(self):
+        self.addCleanup(setattr, subscribers, '_ACCEPTS_CACHE_SIZE',
+                        subscribers._ACCEPTS_CACHE_SIZE)
+        subscribers._ACCEPTS_CACHE_SIZE = 2
+        subscribers._acceptsCache.clear()
+        for iface in (IOther, IFolder, IOther, IReadContainer):
+            ob = Folder()
+            directlyProvides(ob, iface)
+            handle(ob, ObjectAddedEvent(ob))
+            self.assertLessEqual(len(subscribers._acceptsCache), 2)
+        self.assertEqual(len(self.other), 2)
+
+    def test_overridden(self):
+        seen = []
+
+        class Picky(IntIds):
+            def accepts(self, ob):
+                seen.append(ob)
+                return ob.__name__ == 'picked'
+        picky = Picky("iid3")
+        getSiteManager(self.root).registerUtility(picky, name='3',
+                                                  provided=IIntIds)
+        picked = Folder()
+        picked.__name__ = 'picked'
+        for ob in (picked, Folder()):
+            handle(ob, ObjectAddedEvent(ob))
+        self.assertEqual(seen[0], picked)
+        self.assertEqual(len(seen), 2)
+        self.assertEqual(list(picky.refs.values()), [picked])
+
+    def test_subtree(self):
+        provideAdapter(ContainerSublocations, (IReadContainer,),
+                       ISublocations)
+        provideHandler(dispatchToSublocations, [None, IObjectMovedEvent])
+        tree = Folder()
+        tree['a'] = Folder()
+        directlyProvides(tree['a'], IOther)
+        # Forget the registration made while building the tree
+        self.everything.unregister(tree['a'])
+        del self.events[:]
+        subscribers.setSubtreeEvents()
+        try:
+            handle(tree, ObjectAddedEvent(tree, self.root, 'tree'))
+        finally:
+            subscribers.setSubtreeEvents(False)
+        self.assertEqual(len(self.everything), 2)
+        self.assertEqual(list(self.other.refs.values()), [tree['a']])
+        self.assertEqual([list(e.idmap) for e in self.events], [
+            [self.everything], [self.everything, self.other]])
+
+
+class IOther(Interface):
+    pass
+
+
 def test_suite():
     return unittest.TestSuite([
         unittest.defaultTestLoader.loadTestsFromTestCase(TestSubscribers),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestLeanSubscribers),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestDeferredSubscribers),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestSubtreeSubscribers),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestTracing),
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestKeyReferenceMode),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestAccepts),
     ])
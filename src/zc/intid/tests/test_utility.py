@@ -20,6 +20,8 @@ Tests for the unique id utility.
 import unittest
 
 import BTrees
+import persistent
+import transaction
 import zope.event
 from zope.interface.verify import verifyObject
 from zope.intid.interfaces import IntIdMissingError
@@ -29,6 +31,8 @@ from zope.security.proxy import Proxy
 
 from zc.intid.interfaces import IIdAddedEvent
 from zc.intid.interfaces import IIdRemovedEvent
+from zc.intid.interfaces import IIdsAddedEvent
+from zc.intid.interfaces import IIdsRemovedEvent
 from zc.intid.interfaces import IIntIds
 from zc.intid.interfaces import IIntIdsSubclass
 from zc.intid.interfaces import IntIdInUseError
@@ -40,6 +44,10 @@ class P:
     pass
 
 
+class PersistentP(persistent.Persistent):
+    pass
+
+
 class TestIntIds(unittest.TestCase):
 
     def createIntIds(self, attribute="iid"):
@@ -195,6 +203,52 @@ class TestIntIds(unittest.TestCase):
         self.assertEqual(len(u), 0)
         self.assertEqual(u.items(), [])
 
+    def test_iteration(self):
+        u = self.createIntIds()
+        obs = [P() for _ in range(10)]
+        ids = iter(range(10, 20))
+        u.generateId = lambda ob: next(ids)
+        u.registerMany(obs)
+
+        self.assertEqual(list(u.iterkeys()), list(range(10, 20)))
+        self.assertEqual(list(u.itervalues()), obs)
+        self.assertEqual(list(u.iteritems()), list(zip(range(10, 20), obs)))
+
+        self.assertEqual(list(u.iterkeys(12, 14)), [12, 13, 14])
+        self.assertEqual(list(u.iterkeys(12, 14, excludemin=True)),
+                         [13, 14])
+        self.assertEqual(list(u.iterkeys(12, 14, excludemax=True)),
+                         [12, 13])
+        self.assertEqual(list(u.iterkeys(max=11)), [10, 11])
+        self.assertEqual(list(u.itervalues(18)), obs[8:])
+        self.assertEqual(list(u.iteritems(19)), [(19, obs[9])])
+
+    def test_pageItems(self):
+        u = self.createIntIds()
+        self.assertEqual(u.pageItems(), ([], None))
+
+        obs = [P() for _ in range(10)]
+        uids = sorted(u.registerMany(obs))
+        expected = [(uid, u.getObject(uid)) for uid in uids]
+
+        items, cursor = u.pageItems(size=4)
+        self.assertEqual(items, expected[:4])
+        self.assertEqual(cursor, uids[3])
+        items, cursor = u.pageItems(cursor, 4)
+        self.assertEqual(items, expected[4:8])
+        # Changes between pages don't invalidate the cursor
+        u.unregister(expected[8][1])
+        items, cursor = u.pageItems(cursor, 4)
+        self.assertEqual(items, expected[9:])
+        self.assertIsNone(cursor)
+
+        items, cursor = u.pageItems(size=9)
+        self.assertEqual(len(items), 9)
+        self.assertIsNone(cursor)
+
+        self.assertRaises(ValueError, u.pageItems, size=0)
+        self.assertRaises(ValueError, u.pageItems, uids[0], -1)
+
     def test_getenrateId(self):
         u = self.createIntIds()
         self.assertEqual(u._v_nextid, None)
@@ -301,6 +355,23 @@ class TestIntIds(unittest.TestCase):
         self.assertRaises(POSKeyError, u.getId, obj)
         self.assertRaises(POSKeyError, u.queryId, obj)
 
+    def test_register_uses_queryId(self):
+        # Subclasses can override queryId
+        calls = []
+
+        class Sub(type(self.createIntIds())):
+            def queryId(self, ob, default=None):
+                calls.append(ob)
+                return super().queryId(ob, default)
+
+        u = Sub('iid')
+        obj = P()
+        u.register(obj)
+        u.unregister(obj)
+        u.registerMany([obj])
+        u.unregisterMany([obj])
+        self.assertEqual(calls, [obj] * 4)
+
     def test_unsettable_attr_doesnt_corrupt(self):
         # An error on setting the attribute doesn't leak a reference to
         # the object
@@ -324,6 +395,271 @@ class TestIntIds(unittest.TestCase):
         self.assertRaises(POSKeyError, u.register, obj)
         self.assertEqual(0, len(u))
 
+    def test_registerMany(self):
+        u = self.createIntIds()
+        existing = P()
+        existing_id = u.register(existing)
+        del self.events[:]
+
+        obs = [P() for _ in range(100)]
+        uids = u.registerMany([obs[0], existing] + obs + [obs[1]])
+        self.assertEqual(len(uids), 103)
+        self.assertEqual(uids[1], existing_id)
+        self.assertEqual(uids[0], uids[2])
+        self.assertEqual(uids[-1], uids[3])
+        self.assertEqual(len(set(uids)), 101)
+        self.assertEqual(len(u), 101)
+        for ob, uid in zip(obs, uids[2:]):
+            self.assertEqual(ob.iid, uid)
+            self.assertIs(u.getObject(uid), ob)
+
+        # One event per new registration, in the order given
+        self.assertEqual(len(self.events), 100)
+        self.assertEqual([e.object for e in self.events], obs)
+        for event in self.events:
+            self.assertTrue(IIdAddedEvent.providedBy(event))
+            self.assertEqual(event.id, event.object.iid)
+
+        # Nothing new, nothing happens
+        del self.events[:]
+        self.assertEqual(u.registerMany(obs), uids[2:-1])
+        self.assertEqual(u.registerMany(()), [])
+        self.assertEqual(self.events, [])
+
+    def test_registerMany_batch_event(self):
+        u = self.createIntIds()
+        obs = [P() for _ in range(10)]
+        uids = u.registerMany(Proxy(ob, CheckerPublic) for ob in obs)
+        self.assertEqual(len(self.events), 10)
+        del self.events[:]
+
+        more = [P(), P()]
+        more_ids = u.registerMany(obs + more, batch_event=True)
+        self.assertEqual(more_ids[:10], uids)
+        self.assertEqual(len(self.events), 1)
+        event = self.events[0]
+        self.assertTrue(IIdsAddedEvent.providedBy(event))
+        self.assertIs(event.idmanager, u)
+        self.assertEqual(event.objects, more)
+        self.assertEqual(event.ids, more_ids[10:])
+
+    def test_registerMany_duplicate_id_generation(self):
+        u = self.createIntIds()
+        u.generateId = lambda ob: 42
+        obs = [P(), P()]
+        self.assertRaises(IntIdInUseError, u.registerMany, obs)
+        self.assertEqual(len(u), 0)
+        self.assertEqual(self.events, [])
+
+    def test_registerMany_unsettable_attr_doesnt_corrupt(self):
+        u = self.createIntIds()
+
+        class WithSlots:
+            __slots__ = ()
+
+        ids = iter([1, 2, 3])
+        u.generateId = lambda ob: next(ids)
+        obs = [P(), P(), WithSlots()]
+        self.assertRaises(AttributeError, u.registerMany, obs)
+        self.assertEqual(0, len(u))
+        self.assertIsNone(obs[0].iid)
+        self.assertIsNone(obs[1].iid)
+        self.assertEqual(self.events, [])
+
+    def test_registerMany_failing_insert_doesnt_corrupt(self):
+        u = self.createIntIds()
+        ids = iter([1, 2, 3])
+        u.generateId = lambda ob: next(ids)
+        setRef = u._setRef
+
+        def failingSetRef(uid, ob):
+            if uid == 3:
+                raise KeyError(uid)
+            setRef(uid, ob)
+        u._setRef = failingSetRef
+        obs = [P(), P(), P()]
+        self.assertRaises(KeyError, u.registerMany, obs)
+        self.assertEqual(0, len(u))
+        self.assertEqual([getattr(ob, 'iid', None) for ob in obs],
+                         [None, None, None])
+        self.assertEqual(self.events, [])
+
+    def test_unregisterMany(self):
+        u = self.createIntIds()
+        obs = [P() for _ in range(20)]
+        uids = u.registerMany(obs)
+        del self.events[:]
+
+        u.unregisterMany(obs[:10] + [P(), object()])
+        self.assertEqual(len(u), 10)
+        for ob, uid in zip(obs[:10], uids):
+            self.assertIsNone(ob.iid)
+            self.assertIsNone(u.queryObject(uid))
+        self.assertEqual(len(self.events), 10)
+        for event in self.events:
+            self.assertTrue(IIdRemovedEvent.providedBy(event))
+            self.assertIs(event.idmanager, u)
+        self.assertEqual(sorted(e.id for e in self.events),
+                         sorted(uids[:10]))
+
+        del self.events[:]
+        u.unregisterMany(obs[:10])
+        self.assertEqual(self.events, [])
+
+        u.unregisterMany(obs[10:], batch_event=True)
+        self.assertEqual(len(u), 0)
+        self.assertEqual(len(self.events), 1)
+        event = self.events[0]
+        self.assertTrue(IIdsRemovedEvent.providedBy(event))
+        self.assertEqual(sorted(event.ids), sorted(uids[10:]))
+        for ob, uid in zip(event.objects, event.ids):
+            self.assertEqual(uid, uids[obs.index(ob)])
+
+    def test_getObjects_queryObjects(self):
+        u = self.createIntIds()
+        obs = [P() for _ in range(5)]
+        uids = u.registerMany(obs)
+        missing = max(uids) + 1
+
+        ids = [uids[3], uids[0], uids[3], uids[4]]
+        expected = [obs[3], obs[0], obs[3], obs[4]]
+        self.assertEqual(u.getObjects(ids), expected)
+        self.assertEqual(u.getObjects(iter(ids)), expected)
+        self.assertEqual(u.getObjects(u.family.IF.TreeSet(uids)),
+                         [u.getObject(uid) for uid in sorted(uids)])
+        self.assertEqual(u.getObjects(()), [])
+        with self.assertRaises(ObjectMissingError) as ex:
+            u.getObjects([uids[0], missing])
+        self.assertEqual(ex.exception.args[0], missing)
+
+        self.assertEqual(u.queryObjects([missing, uids[1]]), [None, obs[1]])
+        self.assertEqual(u.queryObjects([missing], 42), [42])
+
+    def test_getIds_queryIds(self):
+        u = self.createIntIds()
+        obs = [P() for _ in range(3)]
+        uids = u.registerMany(obs)
+        unregistered = P()
+        mismatched = P()
+        mismatched.iid = uids[0]
+
+        self.assertEqual(u.getIds(obs[::-1]), uids[::-1])
+        self.assertEqual(u.getIds(Proxy(ob, CheckerPublic) for ob in obs),
+                         uids)
+        self.assertEqual(u.getIds(()), [])
+        with self.assertRaises(IntIdMissingError) as ex:
+            u.getIds([obs[0], unregistered])
+        self.assertIs(ex.exception.args[0], unregistered)
+        with self.assertRaises(IntIdMismatchError) as ex:
+            u.getIds([mismatched])
+        self.assertIs(ex.exception.args[0], mismatched)
+
+        stats = {}
+        self.assertEqual(
+            u.queryIds([obs[1], unregistered, mismatched, obs[2]],
+                       stats=stats),
+            [uids[1], None, None, uids[2]])
+        self.assertEqual(stats, {'hits': 2, 'missing': 1, 'mismatches': 1})
+        self.assertEqual(u.queryIds([unregistered, obs[0]], -1, stats),
+                         [-1, uids[0]])
+        self.assertEqual(stats, {'hits': 3, 'missing': 2, 'mismatches': 1})
+
+    def test_ids(self):
+        u = self.createIntIds()
+        IF = u.family.IF
+        obs = [P() for _ in range(3)]
+        uids = u.registerMany(obs)
+        ids = u.ids()
+        self.assertEqual(list(ids), sorted(uids))
+
+        others = IF.TreeSet([uids[0], uids[1], 42])
+        self.assertEqual(list(IF.intersection(others, ids)),
+                         sorted(uids[:2]))
+        self.assertEqual(list(IF.difference(others, ids)), [42])
+        self.assertEqual(list(IF.union(ids, others)),
+                         sorted(uids + [42]))
+        self.assertEqual(list(IF.multiunion([ids, others])),
+                         sorted(uids + [42]))
+
+        # It's a view
+        u.unregister(obs[0])
+        self.assertEqual(list(IF.intersection(others, ids)), [uids[1]])
+
+    def test_getObjects_prefetch(self):
+        import ZODB
+        db = ZODB.DB(None)
+        conn = db.open()
+        u = conn.root()['intids'] = self.createIntIds()
+        obs = [PersistentP() for _ in range(5)]
+        uids = u.registerMany(obs)
+        transaction.commit()
+
+        prefetched = []
+        conn.prefetch = prefetched.append
+        u.prefetch_size = 2
+        # Objects that are already loaded aren't prefetched
+        for ob in obs[1:]:
+            ob._p_deactivate()
+        self.assertEqual(obs[0]._p_status, 'saved')
+        self.assertEqual(u.getObjects(uids), obs)
+        expected = [ob._p_oid for ob in sorted(obs[1:], key=lambda x: x.iid)]
+        self.assertEqual(prefetched,
+                         [expected[:2], expected[2:]])
+        transaction.abort()
+        conn.close()
+        db.close()
+
+    def test_getObjects_prefetch_multidatabase(self):
+        import ZODB
+        databases = {}
+        db = ZODB.DB(None, databases=databases, database_name='main')
+        ZODB.DB(None, databases=databases, database_name='other')
+        conn = db.open()
+        other = conn.get_connection('other')
+        u = conn.root()['intids'] = self.createIntIds()
+        obs = [PersistentP() for _ in range(4)]
+        conn.add(obs[0])
+        conn.add(obs[1])
+        other.add(obs[2])
+        other.add(obs[3])
+        uids = u.registerMany(obs)
+        transaction.commit()
+
+        prefetched = {}
+        for jar in (conn, other):
+            jar.prefetch = prefetched.setdefault(jar, []).append
+        for ob in obs:
+            ob._p_deactivate()
+        self.assertEqual(u.getObjects(uids), obs)
+        for jar, mine in ((conn, obs[:2]), (other, obs[2:])):
+            self.assertEqual(sorted(oid for oids in prefetched[jar]
+                                    for oid in oids),
+                             sorted(ob._p_oid for ob in mine))
+        transaction.abort()
+        conn.close()
+        for database in databases.values():
+            database.close()
+
+    def test_accepts(self):
+        from zope.interface import Interface
+        from zope.interface import alsoProvides
+        from zope.interface.interfaces import IInterface
+
+        class IMarker(Interface):
+            pass
+        u = self.createIntIds()
+        ob = P()
+        self.assertTrue(u.accepts(ob))
+        u.interfaces = (IInterface, IMarker)
+        self.assertFalse(u.accepts(ob))
+        alsoProvides(ob, IMarker)
+        self.assertTrue(u.accepts(ob))
+        # register() doesn't check
+        u.register(P())
+
+        u = IntIds('iid', interfaces=[IMarker])
+        self.assertEqual(u.interfaces, (IMarker,))
+
 
 class TestIntIds64(TestIntIds):
 
@@ -331,8 +667,231 @@ class TestIntIds64(TestIntIds):
         return IntIds(attribute, family=BTrees.family64)
 
 
+class TestLength(unittest.TestCase):
+
+    def test_migration(self):
+        u = IntIds('iid')
+        u.registerMany([P() for _ in range(3)])
+        # As if created before the counter was added
+        del u._length
+        self.assertIsNone(u._length)
+        self.assertEqual(len(u), 3)
+        # Only changes add the counter
+        self.assertIsNone(u._length)
+
+        u.register(P())
+        self.assertEqual(u._length(), 4)
+        del u._length
+        u.unregisterMany([u.refs[uid] for uid in list(u.refs)[:2]])
+        self.assertEqual(u._length(), 2)
+
+    def test_legacy_len_read_only(self):
+        import ZODB
+        db = ZODB.DB(None)
+        conn = db.open()
+        u = conn.root()['intids'] = IntIds('iid')
+        u.registerMany([PersistentP() for _ in range(3)])
+        del u._length
+        transaction.commit()
+        self.assertEqual(len(u), 3)
+        self.assertFalse(u._p_changed)
+        transaction.abort()
+        conn.close()
+        db.close()
+
+    def test_no_loads(self):
+        import ZODB
+        db = ZODB.DB(None)
+        conn = db.open()
+        u = conn.root()['intids'] = IntIds('iid')
+        u.registerMany([PersistentP() for _ in range(1000)])
+        transaction.commit()
+        conn.cacheMinimize()
+        conn.getTransferCounts(True)
+        self.assertEqual(len(conn.root()['intids']), 1000)
+        # The root, the utility and the counter
+        self.assertEqual(conn.getTransferCounts(), (3, 0))
+        conn.close()
+        db.close()
+
+    def test_utility_not_modified(self):
+        # Only the counter, which resolves conflicts, is changed.
+        import ZODB
+        db = ZODB.DB(None)
+        conn = db.open()
+        u = conn.root()['intids'] = IntIds('iid')
+        transaction.commit()
+        ob = PersistentP()
+        u.register(ob)
+        self.assertFalse(u._p_changed)
+        self.assertTrue(u._length._p_changed)
+        transaction.commit()
+        u.unregister(ob)
+        self.assertFalse(u._p_changed)
+        self.assertEqual(len(u), 0)
+        transaction.abort()
+        conn.close()
+        db.close()
+
+
+class TestOidIndex(unittest.TestCase):
+
+    family = BTrees.family32
+
+    def setUp(self):
+        import ZODB
+        self.db = ZODB.DB(None)
+        self.conn = self.db.open()
+        self.root = self.conn.root()
+        self.u = self.root['intids'] = IntIds(
+            'iid', family=self.family, index_oids=True)
+        transaction.commit()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+
+    def _ghosts(self, count):
+        obs = self.root['obs'] = [PersistentP() for _ in range(count)]
+        transaction.commit()
+        for ob in obs:
+            ob._p_deactivate()
+        return obs
+
+    def test_not_indexed_without_jar(self):
+        u = IntIds('iid', index_oids=True)
+        ob = PersistentP()
+        uid = u.register(ob)
+        self.assertEqual(ob.iid, uid)
+        self.assertEqual(len(u.oids), 0)
+        self.assertEqual(u.getId(ob), uid)
+
+    def test_registered_before_stored(self):
+        u = IntIds('iid', family=self.family, index_oids=True)
+        ob = PersistentP()
+        uid = u.register(ob)
+        self.root['u'] = u
+        self.root['ob'] = ob
+        transaction.commit()
+
+        self.assertEqual(u.queryId(ob), uid)
+        self.assertEqual(u.register(ob), uid)
+        self.assertEqual(len(u), 1)
+        u.unregister(ob)
+        self.assertIsNone(u.queryId(ob))
+        self.assertEqual(len(u), 0)
+        self.assertEqual(len(u.refs), 0)
+        self.assertIsNone(ob.iid)
+        u.register(ob)
+        self.assertEqual(len(u), 1)
+
+    def test_registered_before_stored_indexOids(self):
+        u = IntIds('iid', family=self.family, index_oids=True)
+        ob = PersistentP()
+        uid = u.register(ob)
+        self.root['u'] = u
+        self.root['ob'] = ob
+        transaction.commit()
+        # indexOids() indexes it and stops looking at the attribute
+        self.assertEqual(u.indexOids(), 1)
+        self.assertFalse(u._unindexed)
+        self.assertEqual(dict(u.oids), {ob._p_oid: uid})
+        self.assertEqual(u.getId(ob), uid)
+        u.unregister(ob)
+        self.assertIsNone(ob.iid)
+        self.assertEqual(len(u), 0)
+
+    def test_register_new_object(self):
+        u = self.u
+        ob = PersistentP()
+        uid = u.register(ob)
+        # It was added to the connection to get an oid
+        self.assertIs(ob._p_jar, self.conn)
+        self.assertEqual(dict(u.oids), {ob._p_oid: uid})
+        self.assertFalse(hasattr(ob, 'iid'))
+        self.assertEqual(u.getId(ob), uid)
+        self.assertEqual(u.register(ob), uid)
+
+        # Non-persistent objects use the attribute
+        other = P()
+        uid = u.register(other)
+        self.assertEqual(other.iid, uid)
+        self.assertEqual(len(u.oids), 1)
+        self.assertEqual(u.getIds([other]), [uid])
+
+    def test_ghosts_not_loaded(self):
+        u = self.u
+        obs = self._ghosts(3)
+        uids = [u.register(ob) for ob in obs]
+        self.assertEqual([ob._p_status for ob in obs], ['ghost'] * 3)
+        self.assertEqual([u.getId(ob) for ob in obs], uids)
+        self.assertEqual(u.getIds(obs), uids)
+        self.assertEqual(u.queryIds(obs), uids)
+        self.assertEqual([ob._p_status for ob in obs], ['ghost'] * 3)
+        transaction.commit()
+        # Only the utility and its BTrees were stored
+        self.assertEqual([ob._p_status for ob in obs], ['ghost'] * 3)
+
+        u.unregister(obs[0])
+        self.assertIsNone(u.queryId(obs[0]))
+        self.assertEqual(len(u.oids), 2)
+        u.unregisterMany(obs[1:])
+        self.assertEqual(len(u.oids), 0)
+        self.assertEqual(u.queryIds(obs), [None] * 3)
+
+    def test_mismatch(self):
+        u = self.u
+        ob, other = self._ghosts(2)
+        uid = u.register(ob)
+        u.oids[other._p_oid] = uid
+        self.assertRaises(IntIdMismatchError, u.getId, other)
+        self.assertIsNone(u.queryId(other))
+
+    def test_registerMany(self):
+        u = self.u
+        obs = self._ghosts(3) + [P()]
+        uids = u.registerMany(obs)
+        self.assertEqual(len(u.oids), 3)
+        self.assertEqual(obs[3].iid, uids[3])
+        self.assertEqual(u.getIds(obs), uids)
+
+    def test_indexOids(self):
+        u = IntIds('iid', family=self.family)
+        self.root['old'] = u
+        obs = self._ghosts(2)
+        uids = u.registerMany(obs + [P()])
+        transaction.commit()
+        self.assertIsNone(u.oids)
+        self.assertEqual(u.indexOids(), 2)
+        self.assertEqual(u.indexOids(), 0)
+        self.assertEqual(dict(u.oids),
+                         {ob._p_oid: uid for ob, uid in zip(obs, uids)})
+        # The attribute written before is cleared when unregistering
+        u.unregister(obs[0])
+        self.assertIsNone(obs[0].iid)
+        self.assertEqual(len(u.oids), 1)
+        self.assertEqual(list(u._attribute_oids), [obs[1]._p_oid])
+
+        # Objects registered afterwards are left alone
+        ob = self._ghosts(1)[0]
+        u.register(ob)
+        transaction.commit()
+        ob._p_deactivate()
+        u.unregister(ob)
+        self.assertEqual(ob._p_status, 'ghost')
+
+
+class TestOidIndex64(TestOidIndex):
+
+    family = BTrees.family64
+
+
 def test_suite():
     return unittest.TestSuite([
         unittest.defaultTestLoader.loadTestsFromTestCase(TestIntIds),
         unittest.defaultTestLoader.loadTestsFromTestCase(TestIntIds64),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestLength),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestOidIndex),
+        unittest.defaultTestLoader.loadTestsFromTestCase(TestOidIndex64),
     ])
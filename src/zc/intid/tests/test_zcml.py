@@ -0,0 +1,85 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Tests for the ZCML directives.
+
+"""
+import unittest
+
+from zope.configuration import xmlconfig
+from zope.configuration.config import ConfigurationConflictError
+
+from zc.intid import subscribers
+
+
+TEMPLATE = """
+<configure xmlns="http://namespaces.zope.org/zope"
+           xmlns:intid="http://namespaces.zope.org/zc.intid">
+  <include package="zc.intid" file="meta.zcml" />
+  %s
+</configure>
+"""
+
+
+class TestSubscriberOptions(unittest.TestCase):
+
+    def tearDown(self):
+        subscribers.setLeanEvents(False)
+        subscribers.setDeferredEvents(False)
+        subscribers.setSubtreeEvents(False)
+        subscribers.setKeyReferenceMode()
+
+    def _load(self, directives):
+        xmlconfig.string(TEMPLATE % directives)
+
+    def test_defaults(self):
+        subscribers.setLeanEvents()
+        self._load('<intid:subscriberOptions />')
+        self.assertFalse(subscribers._lean)
+        self.assertFalse(subscribers._deferred)
+
+    def test_lean(self):
+        self._load('<intid:subscriberOptions lean="true" />')
+        self.assertTrue(subscribers._lean)
+
+    def test_deferred(self):
+        self._load('<intid:subscriberOptions deferred="true" />')
+        self.assertTrue(subscribers._deferred)
+        self.assertFalse(subscribers._lean)
+
+    def test_subtree(self):
+        self._load('<intid:subscriberOptions subtree="true" />')
+        self.assertTrue(subscribers._subtree)
+        self.assertFalse(subscribers._deferred)
+
+    def test_key_references(self):
+        self._load('<intid:subscriberOptions keyReferences="persistent" />')
+        self.assertEqual(subscribers._keyMode, 'persistent')
+
+    def test_key_references_invalid(self):
+        from zope.configuration.exceptions import ConfigurationError
+        self.assertRaises(ConfigurationError, self._load,
+                          '<intid:subscriberOptions keyReferences="no" />')
+
+    def test_only_once(self):
+        self.assertRaises(ConfigurationConflictError, self._load,
+                          '<intid:subscriberOptions lean="true" />'
+                          '<intid:subscriberOptions lean="false" />')
+
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.defaultTestLoader.loadTestsFromTestCase(
+            TestSubscriberOptions),
+    ])
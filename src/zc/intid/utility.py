@@ -26,6 +26,8 @@ from zope.intid.interfaces import IntIdMissingError
 from zope.intid.interfaces import ObjectMissingError
 
 from zc.intid.interfaces import AddedEvent
+from zc.intid.interfaces import IdsAddedEvent
+from zc.intid.interfaces import IdsRemovedEvent
 from zc.intid.interfaces import IIntIds
 from zc.intid.interfaces import IIntIdsSubclass
 from zc.intid.interfaces import IntIdInUseError
@@ -47,12 +49,33 @@ except ImportError:  # pragma: no cover (we run tests with ZODB installed)
         pass
 
 import random
+from itertools import islice
+from time import perf_counter
 
 import BTrees
 import persistent
+from BTrees.Length import Length
+from BTrees.OOBTree import OOTreeSet
 from zope.security.proxy import removeSecurityProxy as unwrap
 
 
+_marker = object()
+
+# The IIntIdsStatsSink that utilities report to, set by
+# zc.intid.stats.setSink(). When this is None, the only cost of the
+# instrumentation is checking that.
+_sink = None
+
+
+def _notify(intids, event):
+    if _sink is None:
+        notify(event)
+    else:
+        start = perf_counter()
+        notify(event)
+        _sink.observe(intids, 'notify', perf_counter() - start)
+
+
 @implementer(IIntIds, IIntIdsSubclass)
 class IntIds(persistent.Persistent):
     """This utility provides a two way mapping between objects and
@@ -64,18 +87,99 @@ class IntIds(persistent.Persistent):
 
     _v_nextid = None
 
+    # True while the (un)register methods look up an object with
+    # queryId(), so that the instrumentation doesn't count it.
+    _v_uncounted = False
+
     _randrange = random.randrange
 
     family = BTrees.family32
 
-    def __init__(self, attribute, family=None):
+    allocator = None
+
+    #: If not None, a BTree mapping the oids of registered persistent
+    #: objects stored in the same database as this utility to their
+    #: ids. See ``__init__``.
+    oids = None
+
+    # A BTrees.Length.Length counting the items in ``refs``. This is
+    # None in instances created before the counter was added; they
+    # are migrated by _changeLength().
+    _length = None
+
+    # The oids in ``oids`` of objects that also have the attribute,
+    # because they were registered before indexOids() was called.
+    _attribute_oids = None
+
+    # True if objects were given the attribute while the utility had
+    # an oid index but no jar. Such objects may have been stored in
+    # our database since, so until indexOids() indexes them, ids not
+    # found in ``oids`` are looked for in the attribute too.
+    _unindexed = False
+
+    # While the family of the utility is being changed by a
+    # zc.intid.migration.FamilyConversion, that conversion. The writes
+    # to ``refs`` and ``oids`` are mirrored to the trees it builds.
+    _conversion = None
+
+    #: If not None, a tuple of interfaces; the subscribers only
+    #: register objects providing one of them. See ``accepts``.
+    interfaces = None
+
+    #: The number of oids passed to each call of the connection's
+    #: ``prefetch`` method by ``getObjects`` and ``queryObjects``.
+    prefetch_size = 100
+
+    def __init__(self, attribute, family=None, allocator=None,
+                 index_oids=False, interfaces=None):
+        """
+        If *index_oids* is true, the ids of persistent objects are
+        kept in :attr:`oids` instead of the *attribute* of the object
+        whenever the object is (or can be added to) the same database
+        as the utility. Looking up their ids then doesn't load the
+        objects, and registering them doesn't modify them.
+
+        Objects registered before the utility itself is added to a
+        database use the attribute. They keep working, but looking up
+        objects that aren't in the index then has to load them to
+        check the attribute, until :meth:`indexOids` is called.
+
+        If *interfaces* is given, :mod:`zc.intid.subscribers` only
+        register objects providing one of them in this utility.
+        """
         if family is not None:
             self.family = family
+        if allocator is not None:
+            self.allocator = allocator
         self.attribute = attribute
         self.refs = self.family.IO.BTree()
+        self._length = Length()
+        if index_oids:
+            self.oids = self.family.OI.BTree()
+        if interfaces is not None:
+            self.interfaces = tuple(interfaces)
+
+    def accepts(self, ob):
+        interfaces = self.interfaces
+        return interfaces is None or any(iface.providedBy(ob)
+                                         for iface in interfaces)
 
     def __len__(self):
-        return len(self.refs)
+        length = self._length
+        if length is None:
+            # Created before the counter was added. Reading mustn't
+            # modify the utility; _changeLength() adds the counter on
+            # the next change.
+            return len(self.refs)
+        return length()
+
+    def _changeLength(self, delta):
+        # Called after refs has been changed by delta items. Length
+        # resolves conflicts between concurrent changes.
+        if self._length is None:
+            self._length = Length(len(self.refs))
+        elif delta:
+            self._length.change(delta)
 
     def items(self):
         return list(self.refs.items())
@@ -83,6 +187,32 @@ class IntIds(persistent.Persistent):
     def __iter__(self):
         return self.refs.iterkeys()
 
+    def iteritems(self, min=None, max=None, excludemin=False,
+                  excludemax=False):
+        return self.refs.iteritems(min, max, excludemin, excludemax)
+
+    def iterkeys(self, min=None, max=None, excludemin=False,
+                 excludemax=False):
+        return self.refs.iterkeys(min, max, excludemin, excludemax)
+
+    def itervalues(self, min=None, max=None, excludemin=False,
+                   excludemax=False):
+        return self.refs.itervalues(min, max, excludemin, excludemax)
+
+    def pageItems(self, cursor=None, size=100):
+        if size < 1:
+            raise ValueError("The size of a page must be at least 1")
+        items = list(islice(
+            self.refs.iteritems(cursor, None, cursor is not None),
+            size + 1))
+        if len(items) <= size:
+            return items, None
+        del items[size:]
+        return items, items[-1][0]
+
+    def ids(self):
+        return self.refs.keys()
+
     def getObject(self, id):
         try:
             return self.refs[id]
@@ -96,13 +226,169 @@ class IntIds(persistent.Persistent):
             return self.refs[id]
         return default
 
+    def _lookupObjects(self, ids):
+        # Look the ids up in key order, so that the buckets of refs
+        # are visited once and in order, and then ask the connection
+        # to prefetch the state of the objects we found.
+        found = {}
+        get = self.refs.get
+        for uid in sorted(set(ids)):
+            ob = get(uid, _marker)
+            if ob is not _marker:
+                found[uid] = ob
+        self._prefetch(found.values())
+        return found
+
+    def _prefetch(self, obs):
+        # Only ghosts need to be loaded. Each is prefetched through
+        # its own connection, since objects of other databases (of a
+        # multi-database) have oids of other storages.
+        by_jar = {}
+        for ob in obs:
+            if getattr(ob, '_p_changed', False) is None:
+                jar = ob._p_jar
+                try:
+                    oids = by_jar[jar]
+                except KeyError:
+                    oids = by_jar[jar] = []
+                oids.append(ob._p_oid)
+        size = self.prefetch_size
+        for jar, oids in by_jar.items():
+            prefetch = getattr(jar, 'prefetch', None)
+            if prefetch is None:
+                continue
+            for i in range(0, len(oids), size):
+                prefetch(oids[i:i + size])
+
+    def getObjects(self, ids):
+        ids = list(ids)
+        found = self._lookupObjects(ids)
+        try:
+            return [found[uid] for uid in ids]
+        except KeyError as e:
+            raise ObjectMissingError(e.args[0])
+
+    def queryObjects(self, ids, default=None):
+        ids = list(ids)
+        found = self._lookupObjects(ids)
+        return [found.get(uid, default) for uid in ids]
+
+    def indexOids(self):
+        """
+        Start keeping the ids of persistent objects in :attr:`oids`.
+
+        The objects already registered that are stored in the same
+        database are added to the index, without loading them. Their
+        attribute is left alone until they are unregistered. Return
+        the number of objects added.
+
+        This must be called to use the index with a utility created
+        without *index_oids*.
+        """
+        if self._conversion is not None:
+            raise ValueError("The family of the utility is being changed")
+        if self.oids is None:
+            self.oids = self.family.OI.BTree()
+        if self._attribute_oids is None:
+            self._attribute_oids = OOTreeSet()
+        count = 0
+        pending = False
+        for uid, ob in self.refs.items():
+            oid = self._oid(ob)
+            if oid is None:
+                # Persistent objects that aren't stored yet may end
+                # up in our database.
+                pending = pending or getattr(ob, '_p_jar', _marker) is None
+            elif oid not in self.oids:
+                self.oids[oid] = uid
+                self._attribute_oids.add(oid)
+                count += 1
+        if self._unindexed != pending:
+            self._unindexed = pending
+        return count
+
+    def _setRef(self, uid, ob):
+        self.refs[uid] = ob
+        if self._conversion is not None:
+            self._conversion.refs[uid] = ob
+
+    def _delRef(self, uid):
+        del self.refs[uid]
+        if self._conversion is not None:
+            self._conversion.refs.pop(uid, None)
+
+    def _oid(self, ob):
+        # The oid of ob if it's stored in our database. Accessing
+        # _p_ attributes doesn't load a ghost.
+        jar = getattr(ob, '_p_jar', None)
+        if jar is None or jar is not self._p_jar:
+            return None
+        return ob._p_oid
+
+    def _storedId(self, ob):
+        # The id recorded for ob, or None.
+        if self.oids is not None:
+            oid = self._oid(ob)
+            if oid is not None:
+                # Every registered object from our database is in
+                # the index (unless it was registered before we had
+                # a jar), so this doesn't need to load ob.
+                uid = self.oids.get(oid)
+                if uid is not None or not self._unindexed:
+                    return uid
+        return getattr(ob, self.attribute, None)
+
+    def _storeId(self, ob, uid):
+        # Record uid as the id of ob, which is already in refs.
+        if self.oids is not None and self._p_jar is not None:
+            jar = getattr(ob, '_p_jar', _marker)
+            if jar is None:
+                # A new object; it will be stored when we commit
+                # anyway, so it might as well get its oid now.
+                self._p_jar.add(ob)
+                jar = self._p_jar
+            if jar is self._p_jar:
+                self.oids[ob._p_oid] = uid
+                if self._conversion is not None:
+                    self._conversion.oids[ob._p_oid] = uid
+                return
+        elif (self.oids is not None and not self._unindexed
+              and getattr(ob, '_p_jar', _marker) is None):
+            self._unindexed = True
+        setattr(ob, self.attribute, uid)
+
+    def _clearId(self, ob):
+        if self.oids is not None:
+            oid = self._oid(ob)
+            if self._conversion is not None and oid is not None:
+                self._conversion.oids.pop(oid, None)
+            if oid is not None and self.oids.pop(oid, None) is not None:
+                # Unless it was registered before indexOids(), the
+                # object doesn't have the attribute; leave it alone.
+                converted = self._attribute_oids
+                if converted is not None and oid in converted:
+                    converted.remove(oid)
+                elif (not self._unindexed
+                      or getattr(ob, self.attribute, None) is None):
+                    return
+        setattr(ob, self.attribute, None)
+
     def getId(self, ob):
         unwrapped = unwrap(ob)
-        uid = getattr(unwrapped, self.attribute, None)
+        uid = self._storedId(unwrapped)
+        sink = _sink
+        if sink is not None and self._v_uncounted:
+            sink = None
+        if sink is not None:
+            sink.increment(self, 'lookups')
         if uid is None:
+            if sink is not None:
+                sink.increment(self, 'missing')
             raise IntIdMissingError(ob)
         if uid not in self.refs or self.refs[uid] is not unwrapped:
             # not an id that matches
+            if sink is not None:
+                sink.increment(self, 'mismatches')
             raise IntIdMismatchError(ob)
         return uid
 
@@ -114,45 +400,194 @@ class IntIds(persistent.Persistent):
         except KeyError:
             return default
 
+    def _queryId(self, ob):
+        # queryId for the use of the (un)register methods, whose lookups
+        # the instrumentation doesn't count.
+        if _sink is None:
+            return self.queryId(ob)
+        self._v_uncounted = True
+        try:
+            return self.queryId(ob)
+        finally:
+            self._v_uncounted = False
+
+    def getIds(self, obs):
+        result = []
+        stored = self._storedId
+        get = self.refs.get
+        for ob in obs:
+            unwrapped = unwrap(ob)
+            uid = stored(unwrapped)
+            if uid is None:
+                raise IntIdMissingError(ob)
+            if get(uid, _marker) is not unwrapped:
+                raise IntIdMismatchError(ob)
+            result.append(uid)
+        return result
+
+    def queryIds(self, obs, default=None, stats=None):
+        # Like getIds, but without the cost of raising exceptions
+        result = []
+        stored = self._storedId
+        get = self.refs.get
+        hits = missing = mismatches = 0
+        for ob in obs:
+            unwrapped = unwrap(ob)
+            uid = stored(unwrapped)
+            if uid is None:
+                missing += 1
+                uid = default
+            elif get(uid, _marker) is not unwrapped:
+                mismatches += 1
+                uid = default
+            else:
+                hits += 1
+            result.append(uid)
+        if stats is not None:
+            stats['hits'] = stats.get('hits', 0) + hits
+            stats['missing'] = stats.get('missing', 0) + missing
+            stats['mismatches'] = stats.get('mismatches', 0) + mismatches
+        return result
+
     def generateId(self, ob):
         """Generate an id which is not yet taken.
 
         This tries to allocate sequential ids so they fall into the same
         BTree bucket, and randomizes if it stumbles upon a used one.
 
+        If we have an ``allocator``, this is delegated to it.
+
         """
+        if self.allocator is not None:
+            uid = self.allocator.allocate(self, ob)
+            if _sink is not None:
+                _sink.increment(self, 'allocations')
+            return uid
+        probes = 0
         while True:
             if self._v_nextid is None:
                 self._v_nextid = self._randrange(0, self.family.maxint)
             uid = self._v_nextid
             self._v_nextid += 1
+            probes += 1
             if uid not in self.refs:
+                if _sink is not None:
+                    _sink.increment(self, 'allocations')
+                    _sink.observe(self, 'probes', probes)
                 return uid
             self._v_nextid = None
 
     def register(self, ob):
         ob = unwrap(ob)
-        uid = self.queryId(ob)
+        uid = self._queryId(ob)
         if uid is None:
             uid = self.generateId(ob)
             if uid in self.refs:
                 raise IntIdInUseError("id generator returned used id")
-        self.refs[uid] = ob
+            added = 1
+        else:
+            added = 0
+        self._setRef(uid, ob)
         try:
-            setattr(ob, self.attribute, uid)
+            self._storeId(ob, uid)
         except:  # noqa: E722 do not use bare 'except'
             # cleanup our mess
-            del self.refs[uid]
+            self._delRef(uid)
             raise
-        notify(AddedEvent(ob, self, uid))
+        self._changeLength(added)
+        if _sink is not None:
+            _sink.increment(self, 'registered', added)
+        _notify(self, AddedEvent(ob, self, uid))
         return uid
 
     def unregister(self, ob):
         ob = unwrap(ob)
-        uid = self.queryId(ob)
+        uid = self._queryId(ob)
         if uid is None:
             return
         # This should not raise KeyError, we checked that in queryId
-        del self.refs[uid]
-        setattr(ob, self.attribute, None)
-        notify(RemovedEvent(ob, self, uid))
+        self._delRef(uid)
+        self._clearId(ob)
+        self._changeLength(-1)
+        if _sink is not None:
+            _sink.increment(self, 'unregistered')
+        _notify(self, RemovedEvent(ob, self, uid))
+
+    def registerMany(self, obs, batch_event=False):
+        obs = [unwrap(ob) for ob in obs]
+        uids = []
+        # uid -> ob for the registrations we are making
+        new = {}
+        # id(ob) -> uid, in case an object is listed twice
+        seen = {}
+        for ob in obs:
+            uid = seen.get(id(ob))
+            if uid is None:
+                uid = self._queryId(ob)
+                if uid is None:
+                    uid = self.generateId(ob)
+                    if uid in self.refs or uid in new:
+                        raise IntIdInUseError("id generator returned used id")
+                    new[uid] = ob
+                seen[id(ob)] = uid
+            uids.append(uid)
+
+        if not new:
+            return uids
+
+        # Insert in key order so that each bucket is visited once.
+        inserted = []
+        stored = []
+        try:
+            for uid in sorted(new):
+                ob = new[uid]
+                self._setRef(uid, ob)
+                inserted.append(uid)
+                self._storeId(ob, uid)
+                stored.append(uid)
+        except:  # noqa: E722 do not use bare 'except'
+            # cleanup our mess
+            for uid in inserted:
+                self._delRef(uid)
+            for uid in stored:
+                self._clearId(new[uid])
+            raise
+        self._changeLength(len(new))
+        if _sink is not None:
+            _sink.increment(self, 'registered', len(new))
+
+        added = [(ob, uid) for ob, uid in zip(obs, uids)
+                 if new.pop(uid, None) is not None]
+        if batch_event:
+            _notify(self, IdsAddedEvent([ob for ob, _ in added], self,
+                                        [uid for _, uid in added]))
+        else:
+            for ob, uid in added:
+                _notify(self, AddedEvent(ob, self, uid))
+        return uids
+
+    def unregisterMany(self, obs, batch_event=False):
+        # uid -> ob
+        found = {}
+        for ob in obs:
+            ob = unwrap(ob)
+            uid = self._queryId(ob)
+            if uid is not None:
+                found[uid] = ob
+        if not found:
+            return
+
+        uids = sorted(found)
+        for uid in uids:
+            self._delRef(uid)
+            self._clearId(found[uid])
+        self._changeLength(-len(uids))
+        if _sink is not None:
+            _sink.increment(self, 'unregistered', len(uids))
+
+        if batch_event:
+            _notify(self, IdsRemovedEvent([found[uid] for uid in uids],
+                                          self, uids))
+        else:
+            for uid in uids:
+                _notify(self, RemovedEvent(found[uid], self, uid))
@@ -0,0 +1,81 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+ZCML directives.
+
+These are defined in ``meta.zcml``, in the
+``http://namespaces.zope.org/zc.intid`` namespace.
+"""
+
+from zope.interface import Interface
+from zope.schema import Bool
+from zope.schema import Choice
+
+from zc.intid import subscribers
+
+
+class ISubscriberOptionsDirective(Interface):
+    """
+    Configure the behaviour of :mod:`zc.intid.subscribers`.
+    """
+
+    lean = Bool(
+        title="Lean events",
+        description="Only notify the events generated by the "
+                    "subscribers if some handler would receive them. "
+                    "See :func:`zc.intid.subscribers.setLeanEvents`.",
+        required=False,
+        default=False)
+
+    deferred = Bool(
+        title="Deferred events",
+        description="Notify a single event with all the ids registered "
+                    "and unregistered by the subscribers just before "
+                    "the transaction commits. "
+                    "See :func:`zc.intid.subscribers.setDeferredEvents`.",
+        required=False,
+        default=False)
+
+    subtree = Bool(
+        title="Subtree registration",
+        description="Register and unregister all the sublocations of "
+                    "an added or removed object at once. "
+                    "See :func:`zc.intid.subscribers.setSubtreeEvents`.",
+        required=False,
+        default=False)
+
+    keyReferences = Choice(
+        title="Key references",
+        description="How to decide whether an object can have ids: "
+                    "``adapt`` it to ``IKeyReference``, check that it "
+                    "is ``persistent``, or ``none``. "
+                    "See :func:`zc.intid.subscribers.setKeyReferenceMode`.",
+        values=subscribers._KEY_MODES,
+        required=False,
+        default='adapt')
+
+
+def _setOptions(lean, deferred, subtree=False, keyReferences='adapt'):
+    subscribers.setLeanEvents(lean)
+    subscribers.setDeferredEvents(deferred)
+    subscribers.setSubtreeEvents(subtree)
+    subscribers.setKeyReferenceMode(keyReferences)
+
+
+def subscriberOptions(_context, lean=False, deferred=False, subtree=False,
+                      keyReferences='adapt'):
+    _context.action(
+        discriminator=('zc.intid:subscriberOptions',),
+        callable=_setOptions,
+        args=(lean, deferred, subtree, keyReferences))